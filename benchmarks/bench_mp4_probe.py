@@ -0,0 +1,69 @@
+"""Per file probe cost: ffprobe subprocess vs the in-process mp4 box reader
+
+Usage:
+    python bench_mp4_probe.py [videos_dir] [max_files]
+
+Defaults to the recordings drive. Run it twice if you care about cold cache
+numbers vs warm page cache, the first pass pays for the USB reads.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.append(r"/home/brend/Documents")
+import mediaindex
+
+DEFAULT_VIDEOS_DIR = "/media/brend/DYNABOOK/vidfiles"
+
+
+def ffprobe_duration(fpath: str) -> float:
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "format=duration", "-of", "json", fpath],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    return float(json.loads(result.stdout)["format"]["duration"])
+
+
+def time_per_file(fn, fpaths: list[str]) -> tuple[float, list]:
+    results = []
+    start = time.perf_counter()
+    for fpath in fpaths:
+        try:
+            results.append(fn(fpath))
+        except Exception as e:
+            results.append(e)
+    return (time.perf_counter() - start) / len(fpaths), results
+
+
+if __name__ == "__main__":
+    videos_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_VIDEOS_DIR
+    max_files = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    fpaths = sorted(
+        os.path.join(videos_dir, f) for f in os.listdir(videos_dir) if f.endswith(".mp4")
+    )[:max_files]
+    assert fpaths, f"no .mp4 files found in {videos_dir}"
+    print(f"probing {len(fpaths)} files in {videos_dir}")
+
+    box_secs, box_results = time_per_file(lambda p: mediaindex.probe_path(p).duration, fpaths)
+    print(f"mp4 box reader: {box_secs * 1000:.3f} ms/file")
+
+    if shutil.which("ffprobe") is None:
+        print("ffprobe not installed, skipping comparison")
+        sys.exit(0)
+    ffprobe_secs, ffprobe_results = time_per_file(ffprobe_duration, fpaths)
+    print(f"ffprobe:        {ffprobe_secs * 1000:.3f} ms/file")
+    print(f"speedup:        {ffprobe_secs / box_secs:.1f}x")
+
+    # sanity check the two agree, container vs stream durations can differ by
+    # a frame or so
+    mismatches = [
+        (p, a, b) for p, a, b in zip(fpaths, box_results, ffprobe_results)
+        if not isinstance(a, float) or not isinstance(b, float) or abs(a - b) > 0.1
+    ]
+    print(f"{len(mismatches)} files disagree by >0.1s (or failed to parse)")
+    for p, a, b in mismatches[:10]:
+        print(f"    {os.path.basename(p)}: box reader {a}, ffprobe {b}")
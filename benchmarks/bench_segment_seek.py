@@ -0,0 +1,112 @@
+"""Seek latency: Flask's `send_file` vs the sendfile + fd cache segment path
+
+Usage:
+    python bench_segment_seek.py [videos_dir] [n_seeks]
+
+Serves the directory both ways from a local Werkzeug server (the same one the
+app runs on) and times random Range requests the way a seeking player makes
+them: a short burst of requests into the same file, then a jump to another.
+Each pass is run cold (the files dropped from the page cache with
+POSIX_FADV_DONTNEED, so reads hit the drive) and then warm.
+"""
+
+import http.client
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+from flask import Flask, send_file
+from werkzeug.serving import make_server
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+import segserve
+
+DEFAULT_VIDEOS_DIR = "/media/brend/DYNABOOK/vidfiles"
+SEEK_BYTES = 512 * 1024  # roughly what a browser asks for after a seek
+SEEKS_PER_FILE = 4
+PORT = 5099
+
+
+def make_app(videos_dir: str) -> Flask:
+    app = Flask(__name__)
+    fds = segserve.FdCache()
+
+    @app.route("/send_file/<filename>")
+    def via_send_file(filename):
+        return send_file(os.path.join(videos_dir, filename), mimetype="video/mp4")
+
+    @app.route("/segserve/<filename>")
+    def via_segserve(filename):
+        return segserve.serve_segment(fds, os.path.join(videos_dir, filename), "video/mp4", "no-cache")
+
+    return app
+
+
+def drop_page_cache(fpaths: list[str]):
+    for fpath in fpaths:
+        fd = os.open(fpath, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def seek_plan(fpaths: list[str], n_seeks: int) -> list[tuple[str, int]]:
+    rng = random.Random(0)  # both paths replay the same seeks
+    plan = []
+    while len(plan) < n_seeks:
+        fpath = rng.choice(fpaths)
+        size = os.path.getsize(fpath)
+        for _ in range(SEEKS_PER_FILE):
+            plan.append((os.path.basename(fpath), rng.randrange(max(size - SEEK_BYTES, 1))))
+    return plan[:n_seeks]
+
+
+def run_pass(route: str, plan: list[tuple[str, int]]) -> tuple[list[float], list[float]]:
+    """(time to first byte, time to last byte) per seek, in ms"""
+    ttfb, total = [], []
+    for filename, offset in plan:
+        conn = http.client.HTTPConnection("127.0.0.1", PORT)
+        start = time.perf_counter()
+        conn.request("GET", f"/{route}/{filename}", headers={"Range": f"bytes={offset}-{offset + SEEK_BYTES - 1}"})
+        response = conn.getresponse()
+        response.read(1)
+        ttfb.append((time.perf_counter() - start) * 1000)
+        response.read()
+        total.append((time.perf_counter() - start) * 1000)
+        conn.close()
+    return ttfb, total
+
+
+def summarise(label: str, ms: list[float]) -> str:
+    p95 = statistics.quantiles(ms, n=20)[-1] if len(ms) >= 20 else max(ms)
+    return f"{label}: median {statistics.median(ms):7.2f} ms, p95 {p95:7.2f} ms"
+
+
+if __name__ == "__main__":
+    videos_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_VIDEOS_DIR
+    n_seeks = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    fpaths = sorted(
+        os.path.join(videos_dir, f) for f in os.listdir(videos_dir)
+        if f.endswith(".mp4") and os.path.getsize(os.path.join(videos_dir, f)) > SEEK_BYTES
+    )
+    assert fpaths, f"no .mp4 files over {SEEK_BYTES} bytes found in {videos_dir}"
+    plan = seek_plan(fpaths, n_seeks)
+    print(f"{len(plan)} seeks of {SEEK_BYTES // 1024} KiB across {len({f for f, _ in plan})} files in {videos_dir}")
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no per request lines
+    server = make_server("127.0.0.1", PORT, make_app(videos_dir), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        for temperature in ("cold", "warm"):
+            for route in ("send_file", "segserve"):
+                if temperature == "cold":
+                    drop_page_cache(fpaths)
+                ttfb, total = run_pass(route, plan)
+                print(f"[{temperature}] {route:9s} {summarise('first byte', ttfb)} | {summarise('last byte', total)}")
+    finally:
+        server.shutdown()
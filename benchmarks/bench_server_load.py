@@ -0,0 +1,214 @@
+"""Many concurrent streaming clients: threaded Werkzeug (`app.run`) vs the
+ASGI entry point (asgi.py under uvicorn)
+
+Usage:
+    python bench_server_load.py [videos_dir] [seconds_per_level]
+
+Starts the real app in a child process for each mode, with the synthetic
+camera backend so it runs without a Pi, and for each level of concurrency
+connects that many clients: most watch /video_feed, the rest download
+segments from `videos_dir` over and over at DOWNLOAD_BYTES_PER_SECOND
+(skipped if it has no mp4s). The
+clients are asyncio connections in this process, so they cost no threads of
+their own. Sampled from /proc for the server process:
+    - threads and RSS at the end of the level
+    - context switches and CPU time per second over the level
+and per client the frames / bytes received per second.
+"""
+
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+REPO_DIR = os.path.join(SERVER_DIR, "..")
+DEFAULT_VIDEOS_DIR = "/media/brend/DYNABOOK/vidfiles"
+DEFAULT_SECONDS_PER_LEVEL = 10
+CLIENT_LEVELS = (10, 50, 200)
+DOWNLOAD_FRACTION = 0.2
+# paced like a remote player, so both modes move the same bytes and what
+# differs is the cost of moving them
+DOWNLOAD_BYTES_PER_SECOND = 2 * 1024 * 1024
+FEED_QUERY = "width=320&fps=5"
+PORT = 5097
+
+
+# -- server side, run in the child process
+
+
+def serve(mode: str, videos_dir: str):
+    os.environ["PI_CAMERA_BACKEND"] = "synthetic"
+    sys.path[:0] = [SERVER_DIR, REPO_DIR]
+    os.chdir(tempfile.mkdtemp(prefix="bench_server_load_"))  # the app's caches go here
+    import logging
+
+    logging.disable(logging.WARNING)
+    import app as webapp
+    from indexer import MediaIndexer
+
+    webapp.USB_VID_PATH = videos_dir
+    webapp.media_index = MediaIndexer(
+        videos_dir, webapp.describe_unmanifested_files, on_published=webapp.segment_published
+    )
+    if mode == "threaded":
+        webapp.media_index.start()
+        webapp.app.run(host="127.0.0.1", port=PORT, debug=False, threaded=True)
+    else:
+        import uvicorn
+        import asgi
+
+        uvicorn.run(asgi.app, host="127.0.0.1", port=PORT, log_level="error", timeout_graceful_shutdown=1)
+
+
+# -- client side
+
+
+def proc_stats(pid: int) -> dict:
+    """Threads, RSS, context switches (summed over threads) and CPU seconds"""
+    stats = {"ctx_switches": 0}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key == "Threads":
+                stats["threads"] = int(value)
+            elif key == "VmRSS":
+                stats["rss_mb"] = int(value.split()[0]) / 1024
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status") as f:
+                for line in f:
+                    if "ctxt_switches" in line:
+                        stats["ctx_switches"] += int(line.split(":")[1])
+        except FileNotFoundError:
+            pass  # thread exited
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    stats["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return stats
+
+
+async def feed_client(stop: asyncio.Event, counts: list):
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    writer.write(f"GET /video_feed?{FEED_QUERY} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+    frames, tail = 0, b""
+    try:
+        while not stop.is_set():
+            try:
+                data = await asyncio.wait_for(reader.read(65536), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                break
+            frames += (tail + data).count(b"--frame")
+            tail = data[-7:]
+    finally:
+        counts.append(frames)
+        writer.close()
+
+
+async def download_client(stop: asyncio.Event, filenames: list[str], counts: list):
+    n_bytes, i = 0, 0
+    start = time.monotonic()
+    while not stop.is_set():
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+        writer.write(f"GET /video/{filenames[i % len(filenames)]} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+        i += 1
+        try:
+            while not stop.is_set():
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                n_bytes += len(data)
+                ahead = n_bytes / DOWNLOAD_BYTES_PER_SECOND - (time.monotonic() - start)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        finally:
+            writer.close()
+    counts.append(n_bytes)
+
+
+async def run_level(pid: int, n_clients: int, seconds: float, filenames: list[str]) -> dict:
+    stop = asyncio.Event()
+    n_downloads = round(n_clients * DOWNLOAD_FRACTION) if filenames else 0
+    frames, downloaded = [], []
+    tasks = [asyncio.create_task(feed_client(stop, frames)) for _ in range(n_clients - n_downloads)]
+    tasks += [asyncio.create_task(download_client(stop, filenames, downloaded)) for _ in range(n_downloads)]
+    await asyncio.sleep(min(2.0, seconds / 4))  # let everyone connect + the producer start
+    before, start = proc_stats(pid), time.monotonic()
+    await asyncio.sleep(seconds)
+    after, elapsed = proc_stats(pid), time.monotonic() - start
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    total = elapsed + min(2.0, seconds / 4)
+    return {
+        "threads": after["threads"],
+        "rss_mb": after["rss_mb"],
+        "ctx_switches_per_s": (after["ctx_switches"] - before["ctx_switches"]) / elapsed,
+        "cpu_percent": 100 * (after["cpu_seconds"] - before["cpu_seconds"]) / elapsed,
+        "fps_per_client": statistics.median(frames) / total if frames else 0.0,
+        "download_mb_per_s": sum(downloaded) / total / 1e6,
+    }
+
+
+def wait_for_port(timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError("Server did not start")
+
+
+def bench_mode(mode: str, videos_dir: str, seconds: float, filenames: list[str]) -> list[tuple[int, dict]]:
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, videos_dir])
+    try:
+        wait_for_port()
+        results = []
+        for n_clients in CLIENT_LEVELS:
+            results.append((n_clients, asyncio.run(run_level(server.pid, n_clients, seconds, filenames))))
+            time.sleep(1)  # let disconnected clients be cleaned up
+        return results
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def main():
+    videos_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_VIDEOS_DIR
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SECONDS_PER_LEVEL
+    filenames = sorted(f for f in os.listdir(videos_dir) if f.endswith(".mp4"))[:20] if os.path.isdir(videos_dir) else []
+    if not filenames:
+        print(f"No mp4s in {videos_dir}, live feed clients only")
+
+    modes = ["threaded"]
+    try:
+        import uvicorn  # noqa: F401
+
+        modes.append("asgi")
+    except ImportError:
+        print("uvicorn is not installed, only the threaded mode is run")
+
+    print(
+        f"{'mode':<9} {'clients':>7} {'threads':>8} {'rss MB':>7} {'ctxsw/s':>8} "
+        f"{'cpu %':>6} {'fps/client':>10} {'dl MB/s':>8}"
+    )
+    for mode in modes:
+        for n_clients, r in bench_mode(mode, videos_dir, seconds, filenames):
+            print(
+                f"{mode:<9} {n_clients:>7} {r['threads']:>8} {r['rss_mb']:>7.1f} {r['ctx_switches_per_s']:>8.0f} "
+                f"{r['cpu_percent']:>6.1f} {r['fps_per_client']:>10.1f} {r['download_mb_per_s']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -1 +1,4 @@
-from .diskclean import get_usb_usage, auto_cleanup
\ No newline at end of file
+from .diskclean import get_usb_usage, auto_cleanup
+from .retention import RetentionDaemon, SegmentQueue, disk_usage
+from .tiering import Tiering, Tier, TierReport, TIERS
+from .telemetry import StorageTelemetry, RingSeries, forecast_alerts
@@ -11,9 +11,10 @@ LOGS_DIR_PATHS_LIST = [
 def clean_logs_dir(dir_path):
     assert os.path.exists(dir_path) and os.path.isdir(dir_path)
     to_clean = list(os.listdir(dir_path))
-    for f in to_clean:
+    camera_ids = timestamping.parse_filenames(to_clean, ".log").camera_ids
+    for f, camera_id in zip(to_clean, camera_ids):
         assert f.endswith(".log"), f"NON LOG FILE FOUND: {f}"
-        assert timestamping.parse_filename(f, ".log"), f"MALFORMED LOG FILE FOUND: {f}"
+        assert camera_id >= 0, f"MALFORMED LOG FILE FOUND: {f}"
         fpath = os.path.join(dir_path, f)
         assert os.path.isfile(fpath)
         try:
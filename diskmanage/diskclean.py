@@ -1,4 +1,6 @@
 """Run with care this will screw with a dir if wrong
+
+Once a day sweep, see retention.py for the continuous watermark based one
 """
 import logging
 
@@ -66,33 +68,45 @@ def auto_cleanup(
     total_bytes, used_bytes, _ = get_usb_usage(path=monitor_path)
     logging.info(f"`auto_cleanup()`: initial scan, currently using {used_bytes/GB}GB of total {total_bytes/GB}GB")
 
-    to_clean_files = []
-    if used_bytes / total_bytes > threshold_ratio:
-        to_clean_files = [
-            f for f in os.listdir(clean_path) 
-            if f.endswith(".mp4") and timestamping.parse_filename(f)
-        ]
-        to_clean_files.sort()
-        logging.info(f"`auto_cleanup()`: initialized cleaning list with {len(to_clean_files)} cleanable video files")
-    else:
+    if used_bytes / total_bytes <= threshold_ratio:
         logging.info(f"`auto_cleanup()`: disk usage is {used_bytes*100/total_bytes}% for now, no cleaning to happen")
         return 0
 
+    layout = timestamping.read_layout(clean_path)
+    if layout == timestamping.LAYOUT_FLAT:
+        mp4_files = [f for f in os.listdir(clean_path) if f.endswith(".mp4")]
+        camera_ids = timestamping.parse_filenames(mp4_files).camera_ids
+        to_clean_files = [("", f) for f, camera_id in sorted(zip(mp4_files, camera_ids)) if camera_id >= 0]
+        logging.info(f"`auto_cleanup()`: initialized cleaning list with {len(to_clean_files)} cleanable video files")
+    else:
+        # oldest first, only listing hour directories until enough is freed
+        to_clean_files = (
+            (reldir, f) for reldir, f in timestamping.iter_segments(clean_path, layout)
+            if timestamping.parse_filename(f)[0]
+        )
+        logging.info("`auto_cleanup()`: cleaning partitioned layout, oldest hour directories first")
+
     cleaned_bytes = 0
     cleaned_files = 0
-    for file in to_clean_files:
+    touched_dirs = set()
+    for reldir, file in to_clean_files:
         try:
-            full_fpath = os.path.join(clean_path, file)
+            full_fpath = os.path.join(clean_path, reldir, file)
             file_size = os.path.getsize(full_fpath)
             os.remove(full_fpath)
             cleaned_bytes += file_size
             logging.debug(f"`auto_cleanup()`: {file} of {file_size} bytes was removed, total cleaned bytes: {cleaned_bytes}")
             cleaned_files += 1 
+            if reldir:
+                touched_dirs.add(reldir)
         except:
             logging.error(f"`auto_cleanup()`: {file} was unable to be removed", exc_info=True)
 
         if (used_bytes - cleaned_bytes) / total_bytes < threshold_ratio:
             break
+
+    for reldir in touched_dirs:
+        timestamping.prune_empty_dirs(clean_path, reldir)
     
     if (used_bytes - cleaned_bytes) / total_bytes > threshold_ratio:
         logging.critical(f"`auto_cleanup()`: after cleaning {cleaned_files} cleanable video files, disk usage still exceeds threshold input of {threshold_ratio}")
@@ -0,0 +1,89 @@
+"""Moves an existing archive between the flat and partitioned layouts, see
+timestamping/layout.py
+
+    python migrate_layout.py <videos_dir> partitioned|flat [--dry-run]
+
+Safe to run with the recorder and server up. Every segment is moved with a
+rename (same drive, so nothing is copied and a file is never half moved), and
+the layout marker is switched at the point where everything already knows
+where to look:
+    - to partitioned, the marker is written first so new segments go straight
+      into hour directories, then the loose segments are moved in
+    - to flat, segments are moved out first, then the marker is written, then
+      whatever the recorder wrote in the meantime is moved out too
+An interrupted run can simply be run again.
+"""
+
+import logging
+import os
+import sys
+
+sys.path.append(r"/home/brend/Documents")
+import timestamping
+
+
+def _move(videos_dir: str, reldir: str, fname: str, to_reldir: str, dry_run: bool) -> bool:
+    src = os.path.join(videos_dir, reldir, fname)
+    dst = os.path.join(videos_dir, to_reldir, fname)
+    if os.path.exists(dst):
+        logging.warning(f"`migrate_layout()`: {dst} already exists, leaving {src} where it is")
+        return False
+    if dry_run:
+        print(f"{src} -> {dst}")
+        return True
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    os.rename(src, dst)
+    return True
+
+
+def _to_partitioned(videos_dir: str, dry_run: bool) -> int:
+    moved = 0
+    for fname in sorted(os.listdir(videos_dir)):
+        if not fname.endswith(".mp4"):
+            continue
+        to_reldir = timestamping.relative_dir(fname, timestamping.LAYOUT_PARTITIONED)
+        if to_reldir is None:
+            logging.warning(f"`migrate_layout()`: {fname} has no timestamp, left at the root")
+            continue
+        moved += _move(videos_dir, "", fname, to_reldir, dry_run)
+    return moved
+
+
+def _to_flat(videos_dir: str, dry_run: bool) -> int:
+    moved = 0
+    for reldir, fname in timestamping.iter_segments(videos_dir, timestamping.LAYOUT_PARTITIONED):
+        if reldir:
+            moved += _move(videos_dir, reldir, fname, "", dry_run)
+            if not dry_run:
+                timestamping.prune_empty_dirs(videos_dir, reldir)
+    return moved
+
+
+def migrate_layout(videos_dir: str, layout: str, *, dry_run: bool = False) -> int:
+    """Moves every segment in `videos_dir` to where `layout` puts it and
+    records the layout, returns the number of segments moved
+    """
+    assert os.path.isdir(videos_dir), f"{videos_dir} is not a directory"
+    if layout not in timestamping.LAYOUTS:
+        raise ValueError(f"`layout` must be one of {timestamping.LAYOUTS}")
+    logging.info(f"`migrate_layout()`: {videos_dir} from {timestamping.read_layout(videos_dir)} to {layout}")
+
+    if layout == timestamping.LAYOUT_PARTITIONED:
+        if not dry_run:
+            timestamping.write_layout(videos_dir, layout)
+        moved = _to_partitioned(videos_dir, dry_run)
+    else:
+        moved = _to_flat(videos_dir, dry_run)
+        if not dry_run:
+            timestamping.write_layout(videos_dir, layout)
+            moved += _to_flat(videos_dir, dry_run)
+    logging.info(f"`migrate_layout()`: complete, {moved} segments {'would be ' if dry_run else ''}moved")
+    return moved
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    args = [a for a in sys.argv[1:] if a != "--dry-run"]
+    if len(args) != 2:
+        sys.exit(__doc__)
+    migrate_layout(args[0], args[1], dry_run="--dry-run" in sys.argv)
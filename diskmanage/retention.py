@@ -0,0 +1,284 @@
+"""Continuous retention: keeps the drive between two watermarks as it fills,
+instead of a once a day sweep that a busy morning can outrun
+
+    python retention.py
+
+Usage is polled with `os.statvfs` (one syscall, nothing listed) every
+RETENTION_POLL_SECONDS. Once it reaches the high watermark the oldest segments
+are deleted until it is back under the low watermark, then nothing happens
+until the high watermark is reached again, so it is not deleting a file on
+every poll right at the threshold.
+
+The oldest segments come from a `SegmentQueue`: one scan at start up, then kept
+current from the segments manifest (each segment the recorder publishes is
+the newest, so it goes on the end), so each deletion pops the front with no
+listdir or sort. Deletions run in batches with a pause in between, so the
+drive keeps up with the recorder's writes while a backlog is cleared.
+
+Usage and the segments published are also recorded for telemetry.py, which
+forecasts when the drive fills and alerts if retention is falling behind.
+
+`python -m unittest diskmanage.retention` runs the tests within it
+"""
+
+import bisect
+import collections
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(r"/home/brend/Documents")
+import mediaindex
+import timestamping
+from diskmanage.telemetry import StorageTelemetry, TELEMETRY_FORECAST_SECONDS
+
+# USB_DEVICE_NAME = "E657-3701"
+USB_DEVICE_NAME = "DYNABOOK"
+USB_PATH = os.path.join("/media/brend", USB_DEVICE_NAME)
+USB_VID_PATH = os.path.join(USB_PATH, "vidfiles")
+LOGS_DIR_PATH = "/home/brend/Documents/diskmanage/logs"
+
+HIGH_WATERMARK = 0.92
+LOW_WATERMARK = 0.88
+RETENTION_POLL_SECONDS = 10
+RETENTION_BATCH_FILES = 10
+RETENTION_BATCH_PAUSE_SECONDS = 0.5
+# a fresh scan now and then picks up anything changed behind our back
+RETENTION_RESCAN_SECONDS = 6 * 60 * 60
+# anything newer may still be being written by the recorder
+RETENTION_MIN_AGE_SECONDS = 60
+
+
+def disk_usage(path: str) -> tuple[int, int]:
+    """(used, total) bytes of the filesystem holding `path`, counted the same
+    way as `shutil.disk_usage` (so as `diskclean.get_usb_usage`)
+    """
+    st = os.statvfs(path)
+    return (st.f_blocks - st.f_bfree) * st.f_frsize, st.f_blocks * st.f_frsize
+
+
+class SegmentQueue:
+    """Segments of a videos dir (either layout), oldest first"""
+
+    def __init__(self, videos_dir: str):
+        self.videos_dir = videos_dir
+        self._queue: collections.deque[tuple[str, str]] = collections.deque()  # (filename, relative dir)
+        self._queued: set[str] = set()
+        self._manifest_offset = 0
+        self._manifest_inode = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def rescan(self):
+        # skip to the end of the manifest first, anything published while
+        # scanning is then picked up by `refresh()` (duplicates are dropped)
+        _, self._manifest_offset, self._manifest_inode = mediaindex.read_manifest_since(self.videos_dir)
+        found = [
+            (fname, reldir) for reldir, fname in timestamping.iter_segments(self.videos_dir)
+            if timestamping.parse_filename(fname)[0]
+        ]
+        self._queue = collections.deque(found)
+        self._queued = {fname for fname, _ in found}
+        logging.info(f"`SegmentQueue.rescan()`: {len(found)} segments queued")
+
+    def refresh(self) -> list[dict]:
+        """Queues the segments published since the last call, returns the
+        manifest records of those newly queued. A compacted manifest is read
+        again from the start, the segments already queued are not returned
+        again
+        """
+        records, self._manifest_offset, self._manifest_inode = mediaindex.read_manifest_since(
+            self.videos_dir, self._manifest_offset, self._manifest_inode
+        )
+        if not records:
+            return []
+        layout = timestamping.read_layout(self.videos_dir)
+        queued = []
+        for fname in sorted(records.keys() - self._queued):
+            reldir = timestamping.relative_dir(fname, layout)
+            if reldir is None:
+                continue
+            if not self._queue or fname > self._queue[-1][0]:
+                self._queue.append((fname, reldir))
+            else:  # published out of order, rare
+                bisect.insort(self._queue, (fname, reldir))
+            self._queued.add(fname)
+            queued.append(records[fname])
+        return queued
+
+    def pop_oldest(self) -> tuple[str, str] | None:
+        """(relative dir, filename) of the oldest segment, None if empty"""
+        if not self._queue:
+            return None
+        fname, reldir = self._queue.popleft()
+        self._queued.discard(fname)
+        return reldir, fname
+
+    def push_back(self, reldir: str, fname: str):
+        """Undoes a `pop_oldest()`"""
+        self._queue.appendleft((fname, reldir))
+        self._queued.add(fname)
+
+
+class RetentionDaemon:
+    def __init__(
+        self,
+        *,
+        monitor_path: str,
+        clean_path: str,
+        high_watermark: float = HIGH_WATERMARK,
+        low_watermark: float = LOW_WATERMARK,
+    ):
+        assert os.path.isdir(monitor_path) and os.path.isdir(clean_path)
+        assert 0.1 < low_watermark < high_watermark < 1, "need 0.1 < low_watermark < high_watermark < 1"
+        self.monitor_path = monitor_path
+        self.clean_path = clean_path
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.queue = SegmentQueue(clean_path)
+        self.telemetry = StorageTelemetry(clean_path)
+        self.cleaning = False
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _delete_batch(self, max_bytes: int) -> tuple[int, int, bool]:
+        """Deletes up to RETENTION_BATCH_FILES of the oldest segments, stopping
+        once `max_bytes` are freed, returns (files, bytes) removed and whether
+        there is nothing left to delete
+        """
+        n_files = n_bytes = 0
+        exhausted = False
+        touched_dirs = set()
+        for _ in range(RETENTION_BATCH_FILES):
+            if n_bytes >= max_bytes:
+                break
+            popped = self.queue.pop_oldest()
+            if popped is None:
+                exhausted = True
+                break
+            reldir, fname = popped
+            fpath = os.path.join(self.clean_path, reldir, fname)
+            try:
+                st = os.stat(fpath)
+                if time.time() - st.st_mtime < RETENTION_MIN_AGE_SECONDS:
+                    self.queue.push_back(reldir, fname)
+                    exhausted = True
+                    break
+                os.remove(fpath)
+            except FileNotFoundError:
+                continue  # already gone, e.g. removed by hand
+            except:
+                logging.error(f"`RetentionDaemon`: {fname} was unable to be removed", exc_info=True)
+                continue
+            n_files += 1
+            n_bytes += st.st_size
+            if reldir:
+                touched_dirs.add(reldir)
+            logging.debug(f"`RetentionDaemon`: {fname} of {st.st_size} bytes was removed")
+        for reldir in touched_dirs:
+            timestamping.prune_empty_dirs(self.clean_path, reldir)
+        return n_files, n_bytes, exhausted
+
+    def run_once(self) -> int:
+        """One poll: starts (or carries on) cleaning if over the watermarks,
+        returns the bytes freed
+        """
+        self.telemetry.record_segments(self.queue.refresh())
+        used, total = disk_usage(self.monitor_path)
+        self.telemetry.record_usage(used, total)
+        ratio = used / total
+        if not self.cleaning:
+            if ratio < self.high_watermark:
+                return 0
+            self.cleaning = True
+            logging.info(f"`RetentionDaemon`: usage {ratio:.1%} reached high watermark, cleaning to {self.low_watermark:.0%}")
+
+        cleaned_files = cleaned_bytes = 0
+        while ratio > self.low_watermark and not self._stop.is_set():
+            n_files, n_bytes, exhausted = self._delete_batch(used - int(self.low_watermark * total))
+            cleaned_files += n_files
+            cleaned_bytes += n_bytes
+            used, total = disk_usage(self.monitor_path)
+            ratio = used / total
+            if exhausted and ratio > self.low_watermark:
+                logging.critical(
+                    f"`RetentionDaemon`: usage {ratio:.1%} still over low watermark with no old enough segments left to delete"
+                )
+                break
+            # let the recorder's writes through between batches
+            self._stop.wait(RETENTION_BATCH_PAUSE_SECONDS)
+
+        if ratio <= self.low_watermark:
+            self.cleaning = False
+            logging.info(f"`RetentionDaemon`: usage back to {ratio:.1%}, {cleaned_files} segments / {cleaned_bytes} bytes removed")
+        return cleaned_bytes
+
+    def run(self):
+        logging.info(
+            f"`RetentionDaemon`: watching {self.monitor_path}, watermarks {self.low_watermark:.0%}-{self.high_watermark:.0%}"
+        )
+        last_rescan = last_forecast = None
+        while not self._stop.is_set():
+            try:
+                if last_rescan is None or time.monotonic() - last_rescan > RETENTION_RESCAN_SECONDS:
+                    self.queue.rescan()
+                    last_rescan = time.monotonic()
+                self.run_once()
+                if last_forecast is None or time.monotonic() - last_forecast > TELEMETRY_FORECAST_SECONDS:
+                    self.telemetry.check_alerts(self.telemetry.forecast(self.high_watermark))
+                    last_forecast = time.monotonic()
+            except:
+                logging.critical("`RetentionDaemon`: exception caught in retention loop", exc_info=True)
+            self._stop.wait(RETENTION_POLL_SECONDS)
+
+
+class TestSegmentQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _publish(self, hour: int) -> str:
+        fname = f"20250616_{hour:02d}0000_cam.mp4"
+        open(os.path.join(self.dir, fname), "wb").close()
+        mediaindex.append_record(self.dir, {"filename": fname, "camera_name": "cam", "size_bytes": 1})
+        return fname
+
+    def test_refresh_returns_new_segments_only(self):
+        queue = SegmentQueue(self.dir)
+        queue.rescan()
+        published = [self._publish(hour) for hour in range(3)]
+        self.assertEqual([r["filename"] for r in queue.refresh()], published)
+        self.assertEqual(queue.refresh(), [])
+        # compacting gives the manifest a new inode, so it is read again from the start
+        mediaindex.compact_manifest(self.dir, set(published))
+        self.assertEqual(queue.refresh(), [])
+        published.append(self._publish(3))
+        self.assertEqual([r["filename"] for r in queue.refresh()], published[-1:])
+        self.assertEqual(len(queue), 4)
+        self.assertEqual(queue.pop_oldest(), ("", published[0]))
+
+
+if __name__ == "__main__":
+    timestamped_log_fname = timestamping.generate_filename(
+        camera_name=USB_DEVICE_NAME+"_RETENTIONLOG",
+        extension=".log"
+    )
+    assert os.path.exists(LOGS_DIR_PATH) and os.path.isdir(LOGS_DIR_PATH)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[logging.FileHandler(os.path.join(LOGS_DIR_PATH, timestamped_log_fname))]
+    )
+    used_bytes, total_bytes = disk_usage(USB_PATH)
+    print(f"retention.py started: current usage: {used_bytes / total_bytes:.1%}")
+    RetentionDaemon(monitor_path=USB_PATH, clean_path=USB_VID_PATH).run()
@@ -0,0 +1,244 @@
+"""Storage telemetry: disk usage and bytes written per segment over time, and
+the forecasts made from them (write rate per camera, hours until the high
+watermark / a full drive)
+
+Kept in fixed size ring files (`RingSeries`) under `<videos dir>/_telemetry/`,
+so they never need pruning and stay small:
+    usage.ring               (time, used bytes, total bytes), one sample every
+                             TELEMETRY_USAGE_SAMPLE_SECONDS, about two weeks
+    segments.<camera>.ring   (time published, bytes, seconds) of each segment
+Written by retention.py, which polls usage and tails the segments manifest
+anyway, read by the server for /storage.
+
+Two rates come out of them, over the last TELEMETRY_RATE_WINDOW_SECONDS:
+    - write rate: bytes of new segments per second, per camera and summed.
+      Until the high watermark is reached nothing is deleted, so this is
+      what `hours_to_high_watermark` is based on
+    - net fill rate: least squares slope of the used bytes, i.e. writes less
+      whatever retention / tiering freed. Positive means retention is not
+      keeping up, and `hours_to_full` is when recording starts failing
+"""
+
+import logging
+import os
+import statistics
+import struct
+import time
+
+TELEMETRY_DIRNAME = "_telemetry"
+TELEMETRY_USAGE_SAMPLE_SECONDS = 60
+TELEMETRY_USAGE_CAPACITY = 14 * 24 * 60
+TELEMETRY_SEGMENTS_CAPACITY = 8192  # per camera, four weeks of 5 minute segments
+TELEMETRY_RATE_WINDOW_SECONDS = 6 * 60 * 60
+# need at least this much history before forecasting anything
+TELEMETRY_MIN_SPAN_SECONDS = 15 * 60
+# how often retention.py forecasts and checks the alerts
+TELEMETRY_FORECAST_SECONDS = 10 * 60
+STORAGE_ALERT_HOURS = 12
+STORAGE_ALERT_REPEAT_SECONDS = 6 * 60 * 60
+
+_USAGE_RECORD = struct.Struct("<dqq")
+_SEGMENT_RECORD = struct.Struct("<dqd")
+_RING_MAGIC = b"PIRS"
+_RING_VERSION = 1
+# magic, version, record size, capacity, records ever appended
+_RING_HEADER = struct.Struct("<4sHHQQ")
+
+
+class RingSeries:
+    """Fixed width records in a file of fixed size, the oldest overwritten
+    once it is full. One writer, any number of readers; a record is written
+    before the header that makes it visible
+    """
+
+    def __init__(self, path: str, record: struct.Struct, capacity: int):
+        self.path = path
+        self.record = record
+        self.capacity = capacity
+
+    def _open_for_append(self) -> tuple[int, int]:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        header = os.pread(fd, _RING_HEADER.size, 0)
+        if len(header) < _RING_HEADER.size:
+            os.ftruncate(fd, _RING_HEADER.size + self.record.size * self.capacity)
+            os.pwrite(fd, _RING_HEADER.pack(_RING_MAGIC, _RING_VERSION, self.record.size, self.capacity, 0), 0)
+            return fd, 0
+        magic, version, record_size, capacity, appended = _RING_HEADER.unpack(header)
+        if (magic, version, record_size, capacity) != (_RING_MAGIC, _RING_VERSION, self.record.size, self.capacity):
+            os.close(fd)
+            raise ValueError(f"{self.path} is not a ring of {self.capacity} x {self.record.size} byte records")
+        return fd, appended
+
+    def append_many(self, rows: list[tuple]):
+        if not rows:
+            return
+        fd, appended = self._open_for_append()
+        try:
+            for row in rows:
+                offset = _RING_HEADER.size + (appended % self.capacity) * self.record.size
+                os.pwrite(fd, self.record.pack(*row), offset)
+                appended += 1
+            os.pwrite(fd, _RING_HEADER.pack(_RING_MAGIC, _RING_VERSION, self.record.size, self.capacity, appended), 0)
+        finally:
+            os.close(fd)
+
+    def read(self) -> list[tuple]:
+        """Every record still held, oldest first"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        if len(data) < _RING_HEADER.size:
+            return []
+        magic, version, record_size, capacity, appended = _RING_HEADER.unpack_from(data)
+        if (magic, version, record_size) != (_RING_MAGIC, _RING_VERSION, self.record.size):
+            raise ValueError(f"{self.path} is not a ring of {self.record.size} byte records")
+        body = data[_RING_HEADER.size : _RING_HEADER.size + capacity * record_size]
+        rows = list(self.record.iter_unpack(body[: len(body) - len(body) % record_size]))
+        if appended <= capacity:
+            return rows[:appended]
+        head = appended % capacity
+        return rows[head:] + rows[:head]
+
+
+class StorageTelemetry:
+    def __init__(self, videos_dir: str):
+        self.videos_dir = videos_dir
+        self.dir_path = os.path.join(videos_dir, TELEMETRY_DIRNAME)
+        self.usage = RingSeries(os.path.join(self.dir_path, "usage.ring"), _USAGE_RECORD, TELEMETRY_USAGE_CAPACITY)
+        self._last_usage_sample = 0.0
+        self._last_alerts: dict[str, float] = {}
+
+    def _segments(self, camera_name: str) -> RingSeries:
+        return RingSeries(
+            os.path.join(self.dir_path, f"segments.{camera_name}.ring"), _SEGMENT_RECORD, TELEMETRY_SEGMENTS_CAPACITY
+        )
+
+    def cameras(self) -> list[str]:
+        try:
+            names = os.listdir(self.dir_path)
+        except FileNotFoundError:
+            return []
+        return sorted(n[len("segments."):-len(".ring")] for n in names if n.startswith("segments.") and n.endswith(".ring"))
+
+    # -- recording, from retention.py
+
+    def record_usage(self, used_bytes: int, total_bytes: int, now: float | None = None):
+        """Samples usage, at most once every TELEMETRY_USAGE_SAMPLE_SECONDS"""
+        now = time.time() if now is None else now
+        if now - self._last_usage_sample < TELEMETRY_USAGE_SAMPLE_SECONDS:
+            return
+        os.makedirs(self.dir_path, exist_ok=True)
+        self.usage.append_many([(now, used_bytes, total_bytes)])
+        self._last_usage_sample = now
+
+    def record_segments(self, records):
+        """Segments manifest records of newly published segments"""
+        by_camera: dict[str, list[tuple]] = {}
+        for record in records:
+            if record.get("tier") or not record.get("camera_name"):
+                continue  # re-encoded by tiering.py, not newly written
+            by_camera.setdefault(record["camera_name"], []).append(
+                (
+                    float(record.get("published_at") or time.time()),
+                    int(record.get("size_bytes") or 0),
+                    float(record.get("duration_seconds") or 0.0),
+                )
+            )
+        if by_camera:
+            os.makedirs(self.dir_path, exist_ok=True)
+        for camera_name, rows in by_camera.items():
+            self._segments(camera_name).append_many(sorted(rows))
+
+    # -- reading, for the server
+
+    def usage_history(self, since: float, max_points: int) -> list[tuple[float, int]]:
+        """(time, used bytes) samples since `since`, every nth so there are at
+        most `max_points`
+        """
+        rows = [(t, used) for t, used, _ in self.usage.read() if t >= since]
+        step = -(-len(rows) // max_points) if max_points > 0 else len(rows) + 1
+        return rows[::step] if rows else []
+
+    # -- forecasting
+
+    def forecast(self, high_watermark: float, now: float | None = None) -> dict:
+        """Write rates and how long until the high watermark / a full drive at
+        them, None where there is not yet enough history to tell
+        """
+        now = time.time() if now is None else now
+        window_start = now - TELEMETRY_RATE_WINDOW_SECONDS
+        usage = self.usage.read()
+        latest = usage[-1] if usage else None
+
+        cameras = {}
+        for camera_name in self.cameras():
+            rows = [r for r in self._segments(camera_name).read() if r[0] >= window_start]
+            # published_at is when a segment finished, it was written over its duration before that
+            span = now - (rows[0][0] - rows[0][2]) if rows else 0.0
+            cameras[camera_name] = {
+                "segments": len(rows),
+                "bytes": sum(r[1] for r in rows),
+                "bytes_per_second": sum(r[1] for r in rows) / span if span >= TELEMETRY_MIN_SPAN_SECONDS else None,
+            }
+        rates = [c["bytes_per_second"] for c in cameras.values() if c["bytes_per_second"] is not None]
+        write_rate = sum(rates) if rates else None
+
+        recent = [r for r in usage if r[0] >= window_start]
+        net_rate = None
+        if len(recent) >= 2 and recent[-1][0] - recent[0][0] >= TELEMETRY_MIN_SPAN_SECONDS:
+            net_rate = statistics.linear_regression([r[0] for r in recent], [r[1] for r in recent]).slope
+
+        result = {
+            "sampled_at": latest[0] if latest else None,
+            "used_bytes": latest[1] if latest else None,
+            "total_bytes": latest[2] if latest else None,
+            "used_ratio": latest[1] / latest[2] if latest else None,
+            "high_watermark": high_watermark,
+            "window_seconds": TELEMETRY_RATE_WINDOW_SECONDS,
+            "cameras": cameras,
+            "write_bytes_per_second": write_rate,
+            "net_bytes_per_second": net_rate,
+            "hours_to_high_watermark": None,
+            "hours_to_full": None,
+        }
+        if latest and write_rate:
+            headroom = max(0.0, high_watermark * latest[2] - latest[1])
+            result["hours_to_high_watermark"] = headroom / write_rate / 3600
+        if latest and net_rate and net_rate > 0:
+            result["hours_to_full"] = max(0, latest[2] - latest[1]) / net_rate / 3600
+        return result
+
+    def check_alerts(self, forecast: dict, now: float | None = None) -> list[str]:
+        """Logs each of `forecast_alerts()` at most every
+        STORAGE_ALERT_REPEAT_SECONDS, returns all of them, repeated or not
+        """
+        now = time.time() if now is None else now
+        alerts = forecast_alerts(forecast)
+        for key, (level, message) in alerts.items():
+            if now - self._last_alerts.get(key, 0.0) >= STORAGE_ALERT_REPEAT_SECONDS:
+                logging.log(level, f"`StorageTelemetry`: {message}")
+                self._last_alerts[key] = now
+        return [message for _, message in alerts.values()]
+
+
+def forecast_alerts(forecast: dict) -> dict[str, tuple[int, str]]:
+    """{alert: (log level, message)} for a `StorageTelemetry.forecast()`: the
+    drive filling up faster than retention frees it (CRITICAL), and the high
+    watermark coming up (WARNING, retention takes it from there)
+    """
+    alerts = {}
+    hours = forecast["hours_to_full"]
+    if hours is not None and hours < STORAGE_ALERT_HOURS:
+        alerts["full"] = logging.CRITICAL, (
+            f"drive full in {hours:.1f}h at the current net fill rate of "
+            f"{forecast['net_bytes_per_second'] / 1e6:.2f}MB/s, retention is not keeping up"
+        )
+    hours = forecast["hours_to_high_watermark"]
+    if hours is not None and 0 < hours < STORAGE_ALERT_HOURS:
+        alerts["high_watermark"] = logging.WARNING, (
+            f"high watermark of {forecast['high_watermark']:.0%} in {hours:.1f}h at the current write rate of "
+            f"{forecast['write_bytes_per_second'] / 1e6:.2f}MB/s"
+        )
+    return alerts
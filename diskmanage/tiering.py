@@ -0,0 +1,364 @@
+"""Tiered retention: aging segments are re-encoded smaller instead of only ever
+being deleted whole, so the same drive holds several times more days of
+(lower fidelity) history
+
+    python tiering.py
+
+A segment moves to a tier of TIERS once it is `min_age_days` old, or
+`event_min_age_days` if the server saw motion events in it (from its activity
+stats), so footage with something happening in it keeps full quality longer.
+Each transcode:
+    - runs ffmpeg single threaded at idle CPU and IO priority, paced so it
+      averages at most TIERING_CPU_BUDGET cores over time
+    - writes next to the original, checks the result (playable, same
+      duration, actually smaller), then swaps it in with `os.replace`, so
+      readers only ever see the whole old file or the whole new one
+    - appends a fresh segments manifest record carrying the tier name, which
+      is also how the tier a segment is at is known
+Every pass logs the bytes reclaimed per CPU-second of ffmpeg for each tier.
+A segment that fails is retried with a growing backoff (kept across restarts
+in TIERING_FAILURES_FNAME), and left at its tier for good after
+TIERING_MAX_ATTEMPTS.
+retention.py still deletes the oldest segments when the drive fills up, there
+are just more days before it has to.
+"""
+
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import NamedTuple
+
+sys.path.append(r"/home/brend/Documents")
+import mediaindex
+import timestamping
+
+# USB_DEVICE_NAME = "E657-3701"
+USB_DEVICE_NAME = "DYNABOOK"
+USB_PATH = os.path.join("/media/brend", USB_DEVICE_NAME)
+USB_VID_PATH = os.path.join(USB_PATH, "vidfiles")
+LOGS_DIR_PATH = "/home/brend/Documents/diskmanage/logs"
+# written by the server as it builds thumbnails, see server/activity.py
+ACTIVITY_STATS_PATH = "/home/brend/Documents/server/_activity_stats.jsonl"
+# same as server/activity.py ACTIVITY_EVENT_MOTION_THRESHOLD
+EVENT_MOTION_THRESHOLD = 12.0
+
+MB = 1024 * 1024
+
+
+class Tier(NamedTuple):
+    name: str
+    min_age_days: float
+    event_min_age_days: float
+    input_args: tuple[str, ...]
+    output_args: tuple[str, ...]
+    # decodes keyframes only, so the output ends at the last keyframe
+    keyframes_only: bool = False
+
+
+# youngest first, a segment goes straight to the oldest tier it is due for
+TIERS = (
+    Tier(
+        "reduced", 7, 30,
+        (),
+        ("-vf", "scale=-2:min(ih\\,480),fps=10", "-c:v", "libx264", "-preset", "veryfast", "-crf", "30", "-an"),
+    ),
+    # decoding only the keyframes is also far cheaper than a full decode
+    Tier(
+        "keyframes", 30, 90,
+        ("-skip_frame", "nokey"),
+        ("-vf", "scale=-2:min(ih\\,480)", "-fps_mode", "vfr", "-c:v", "libx264", "-preset", "veryfast", "-crf", "32", "-an"),
+        keyframes_only=True,
+    ),
+)
+# same container as the recorder writes, the server relies on the fragments
+FRAGMENTED_MP4_FFMPEG_ARGS = ("-movflags", "+frag_keyframe+empty_moov+default_base_moof")
+TIERING_TMP_SUFFIX = ".tiering.tmp"
+# average cores ffmpeg may use, enforced by sleeping between transcodes
+TIERING_CPU_BUDGET = 0.5
+TIERING_PASS_SECONDS = 60 * 60
+TIERING_TIMEOUT_SECONDS = 30 * 60
+# a transcode may come out this much shorter / longer and still be swapped in
+TIERING_DURATION_TOLERANCE_SECONDS = 1.0
+# the recorder's keyframe interval (libx264's default keyint), a keyframes
+# only transcode may come out up to this many frames shorter on top
+SOURCE_KEYINT_FRAMES = 250
+TIERING_FAILURES_FNAME = "_tiering_failures.jsonl"
+# a failed segment is retried this long after its first failure, doubling
+# after each further one
+TIERING_RETRY_SECONDS = 24 * 60 * 60
+TIERING_MAX_ATTEMPTS = 4
+
+
+class TierReport(NamedTuple):
+    segments: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    cpu_seconds: float = 0.0
+
+    def add(self, bytes_before: int, bytes_after: int, cpu_seconds: float) -> "TierReport":
+        return TierReport(
+            self.segments + 1,
+            self.bytes_before + bytes_before,
+            self.bytes_after + bytes_after,
+            self.cpu_seconds + cpu_seconds,
+        )
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    def __str__(self) -> str:
+        per_cpu_second = self.bytes_reclaimed / self.cpu_seconds if self.cpu_seconds else 0.0
+        kept = self.bytes_after / self.bytes_before if self.bytes_before else 1.0
+        return (
+            f"{self.segments} segments, {self.bytes_reclaimed / MB:.0f}MB reclaimed in {self.cpu_seconds:.0f} CPU-s "
+            f"({per_cpu_second / MB:.2f}MB per CPU-second), now {kept:.0%} of their original size"
+        )
+
+
+def load_event_segments(activity_stats_path: str, threshold: float = EVENT_MOTION_THRESHOLD) -> set[str]:
+    """Filenames of segments with a thumbnail tile whose motion score crosses
+    `threshold`, empty if the server has not written any stats
+    """
+    events = set()
+    try:
+        f = open(activity_stats_path, "r")
+    except FileNotFoundError:
+        logging.warning(f"`load_event_segments()`: no activity stats at {activity_stats_path}, no segments treated as events")
+        return events
+    with f:
+        for line in f:
+            try:
+                filename, stats = json.loads(line)
+            except ValueError:
+                continue  # partially written last line
+            if any(m >= threshold for m in stats["motion"]):
+                events.add(filename)
+            else:
+                events.discard(filename)  # later lines replace earlier ones
+    return events
+
+
+def _idle_priority():
+    # in the ffmpeg child: only get the CPU when nothing else wants it
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        os.nice(19)
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Tiering:
+    def __init__(
+        self,
+        videos_dir: str,
+        *,
+        activity_stats_path: str = ACTIVITY_STATS_PATH,
+        tiers: tuple[Tier, ...] = TIERS,
+        cpu_budget: float = TIERING_CPU_BUDGET,
+    ):
+        assert os.path.isdir(videos_dir)
+        assert 0 < cpu_budget, "`cpu_budget` is in cores and must be positive"
+        assert [t.min_age_days for t in tiers] == sorted(t.min_age_days for t in tiers), "tiers must be youngest first"
+        self.videos_dir = videos_dir
+        self.activity_stats_path = activity_stats_path
+        self.tiers = tiers
+        self.cpu_budget = cpu_budget
+        # idle IO priority too where util-linux is installed
+        self._ionice = ["ionice", "-c", "3"] if shutil.which("ionice") else []
+        self._failures_path = os.path.join(videos_dir, TIERING_FAILURES_FNAME)
+        self._failures = self._load_failures()  # filename -> (attempts, unix time of the last)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _load_failures(self) -> dict[str, tuple[int, float]]:
+        failures = {}
+        try:
+            f = open(self._failures_path, "r")
+        except FileNotFoundError:
+            return failures
+        with f:
+            for line in f:
+                try:
+                    fname, attempts, failed_at = json.loads(line)
+                except ValueError:
+                    continue  # partially written last line
+                # later lines replace earlier ones, 0 attempts once it succeeded
+                if attempts:
+                    failures[fname] = (attempts, failed_at)
+                else:
+                    failures.pop(fname, None)
+        return failures
+
+    def _record_attempt(self, fname: str, failed: bool):
+        if not failed and fname not in self._failures:
+            return
+        if failed:
+            attempts = self._failures.get(fname, (0, 0.0))[0] + 1
+            self._failures[fname] = (attempts, time.time())
+        else:
+            attempts = 0
+            del self._failures[fname]
+        if attempts >= TIERING_MAX_ATTEMPTS:
+            logging.error(f"`Tiering`: {fname} failed {attempts} times, no longer retried")
+        try:
+            with open(self._failures_path, "a") as f:
+                f.write(json.dumps([fname, attempts, time.time()]) + "\n")
+        except OSError:
+            logging.error(f"`Tiering`: unable to record the failure of {fname}", exc_info=True)
+
+    def _backing_off(self, fname: str) -> bool:
+        if fname not in self._failures:
+            return False
+        attempts, failed_at = self._failures[fname]
+        if attempts >= TIERING_MAX_ATTEMPTS:
+            return True
+        return time.time() - failed_at < TIERING_RETRY_SECONDS * 2 ** (attempts - 1)
+
+    def _due_tier(self, age_days: float, has_event: bool) -> int:
+        """Index of the oldest tier a segment this old is due for, -1 for none"""
+        due = -1
+        for i, tier in enumerate(self.tiers):
+            if age_days >= (tier.event_min_age_days if has_event else tier.min_age_days):
+                due = i
+        return due
+
+    def _transcode(self, fpath: str, tier: Tier, record: dict) -> tuple[int, int] | None:
+        """Re-encodes `fpath` (with manifest `record`) for `tier` and swaps it in
+        if it came out smaller, returns (bytes before, bytes after) or None if
+        it failed
+        """
+        tmp_path = fpath + TIERING_TMP_SUFFIX
+        cmd = [
+            *self._ionice,
+            "ffmpeg", "-loglevel", "error", "-y",
+            "-threads", "1",
+            *tier.input_args,
+            "-i", fpath,
+            *tier.output_args,
+            "-threads", "1",
+            *FRAGMENTED_MP4_FFMPEG_ARGS,
+            "-f", "mp4",
+            tmp_path,
+        ]
+        st = os.stat(fpath)
+        try:
+            proc = subprocess.run(
+                cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, preexec_fn=_idle_priority,
+                timeout=TIERING_TIMEOUT_SECONDS,
+            )
+            if proc.returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {proc.stderr.decode(errors='replace')}")
+            duration, fps = record.get("duration_seconds"), record.get("fps")
+            if not duration or not fps:
+                info = mediaindex.probe_path(fpath)
+                duration, fps = info.duration, info.fps
+            shorter_by = longer_by = TIERING_DURATION_TOLERANCE_SECONDS
+            if tier.keyframes_only and fps:
+                shorter_by += SOURCE_KEYINT_FRAMES / fps  # from the last keyframe to the end
+            new_duration = mediaindex.probe_path(tmp_path).duration
+            if not duration - shorter_by <= new_duration <= duration + longer_by:
+                raise RuntimeError(f"transcode is {new_duration:.1f}s long, the original {duration:.1f}s")
+            new_size = os.path.getsize(tmp_path)
+            if new_size >= st.st_size:
+                logging.info(f"`Tiering`: {os.path.basename(fpath)} is no smaller at tier {tier.name}, kept as is")
+                os.remove(tmp_path)
+                return st.st_size, st.st_size
+            # keep the original mtime, retention goes oldest first by it
+            os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            os.replace(tmp_path, fpath)
+        except:
+            logging.error(f"`Tiering`: transcoding {fpath} to tier {tier.name} FAILED", exc_info=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return st.st_size, new_size
+
+    def run_pass(self) -> dict[str, TierReport]:
+        """Moves every segment that is due into its tier, oldest first"""
+        records = mediaindex.load_manifest(self.videos_dir)
+        events = load_event_segments(self.activity_stats_path)
+        tier_index = {tier.name: i for i, tier in enumerate(self.tiers)}
+        youngest_due_days = min(min(t.min_age_days, t.event_min_age_days) for t in self.tiers)
+        reports = {tier.name: TierReport() for tier in self.tiers}
+        now = datetime.now()
+
+        for reldir, fname in timestamping.iter_segments(self.videos_dir):
+            if self._stop.is_set():
+                break
+            dt, camera_name = timestamping.parse_filename(fname)
+            if dt is None:
+                continue
+            age_days = (now - dt).total_seconds() / (24 * 60 * 60)
+            if age_days < youngest_due_days:
+                break  # oldest first, so the rest are younger still
+            record = records.get(fname, {})
+            due = self._due_tier(age_days, fname in events)
+            if due <= tier_index.get(record.get("tier"), -1) or self._backing_off(fname):
+                continue
+
+            tier = self.tiers[due]
+            fpath = os.path.join(self.videos_dir, reldir, fname)
+            started, cpu_before = time.monotonic(), _children_cpu_seconds()
+            sizes = self._transcode(fpath, tier, record)
+            cpu_seconds = _children_cpu_seconds() - cpu_before
+            self._record_attempt(fname, failed=not sizes)
+            if sizes:
+                reports[tier.name] = reports[tier.name].add(*sizes, cpu_seconds)
+                try:
+                    new_record = mediaindex.build_record(
+                        fpath, start=dt, camera_name=camera_name, recorded_fps=record.get("recorded_fps")
+                    )
+                    new_record["tier"] = tier.name
+                    mediaindex.append_record(self.videos_dir, new_record)
+                except:
+                    logging.error(f"`Tiering`: unable to add {fname} to segments manifest", exc_info=True)
+                logging.debug(f"`Tiering`: {fname} now at tier {tier.name}, {sizes[0]} -> {sizes[1]} bytes")
+
+            # stay within the CPU budget on average, failed attempts count too
+            self._stop.wait(max(0.0, cpu_seconds / self.cpu_budget - (time.monotonic() - started)))
+
+        for name, report in reports.items():
+            if report.segments:
+                logging.info(f"`Tiering`: tier {name}: {report}")
+        return reports
+
+    def run(self):
+        logging.info(f"`Tiering`: started on {self.videos_dir}, CPU budget {self.cpu_budget} cores")
+        totals = {tier.name: TierReport() for tier in self.tiers}
+        while not self._stop.is_set():
+            try:
+                for name, report in self.run_pass().items():
+                    totals[name] = TierReport(*(a + b for a, b in zip(totals[name], report)))
+                for name, report in totals.items():
+                    logging.info(f"`Tiering`: since start, tier {name}: {report}")
+            except:
+                logging.critical("`Tiering`: exception caught in tiering loop", exc_info=True)
+            self._stop.wait(TIERING_PASS_SECONDS)
+
+
+if __name__ == "__main__":
+    timestamped_log_fname = timestamping.generate_filename(
+        camera_name=USB_DEVICE_NAME+"_TIERINGLOG",
+        extension=".log"
+    )
+    assert os.path.exists(LOGS_DIR_PATH) and os.path.isdir(LOGS_DIR_PATH)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[logging.FileHandler(os.path.join(LOGS_DIR_PATH, timestamped_log_fname))]
+    )
+    Tiering(USB_VID_PATH).run()
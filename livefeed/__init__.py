@@ -0,0 +1,2 @@
+from .framering import FrameRingReader, FrameRingWriter, LIVE_FRAME_RING_PATH
+from .hls import LiveHlsSegmenter, h264_input_cmd, rawvideo_input_cmd, LIVE_HLS_DIR, LIVE_HLS_PLAYLIST
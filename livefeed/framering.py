@@ -0,0 +1,210 @@
+"""Shared memory ring for handing the recorder's latest frame to other
+processes (i.e. the web server live view) without them opening the camera.
+
+Layout of the backing file (lives in /dev/shm so it is just RAM):
+    [ring header][slot 0 header][slot 0 data]...[slot N-1 header][slot N-1 data]
+
+There is exactly one writer (the recorder) and any number of readers. No locks
+are used, each slot is guarded by a pair of sequence numbers (a seqlock), so a
+reader copies a slot and then checks the writer did not start overwriting it
+mid-copy, and retries if so.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+LIVE_FRAME_RING_PATH = "/dev/shm/pi_live_frames"
+LIVE_FRAME_RING_SLOTS = 3
+LIVE_FRAME_MAX_WIDTH = 640
+LIVE_FRAME_MAX_BYTES = 640 * 480 * 3
+
+_MAGIC = b"PIFR"
+# magic, n_slots, slot_capacity, latest_seq
+_RING_HEADER = struct.Struct("<4sIIQ")
+# seq_begin, width, height, channels, nbytes, timestamp, seq_end
+_SLOT_HEADER = struct.Struct("<QIIIIdQ")
+_SEQ_END_OFFSET = _SLOT_HEADER.size - 8
+_LATEST_SEQ_OFFSET = _RING_HEADER.size - 8
+
+
+def _slot_offset(slot: int, slot_capacity: int) -> int:
+    return _RING_HEADER.size + slot * (_SLOT_HEADER.size + slot_capacity)
+
+
+def downscale_for_live(frame: np.ndarray, max_width: int = LIVE_FRAME_MAX_WIDTH) -> np.ndarray:
+    """Cheap integer stride downscale (no interpolation, no copy until the
+    ring write) and drop any alpha/padding channel so readers always get
+    1 or 3 channel frames
+    """
+    if frame.ndim == 3 and frame.shape[2] == 4:
+        frame = frame[:, :, :3]
+    step = -(-frame.shape[1] // max_width)  # ceil division
+    if step > 1:
+        frame = frame[::step, ::step]
+    return frame
+
+
+class FrameRingWriter:
+    """Owned by the recorder, call `publish()` with every frame (or as often
+    as is convenient), it throttles itself to `max_fps`
+    """
+
+    def __init__(
+        self,
+        path: str = LIVE_FRAME_RING_PATH,
+        *,
+        n_slots: int = LIVE_FRAME_RING_SLOTS,
+        slot_capacity: int = LIVE_FRAME_MAX_BYTES,
+        max_width: int = LIVE_FRAME_MAX_WIDTH,
+        max_fps: float = 15,
+    ):
+        self.path = path
+        self.n_slots = n_slots
+        self.slot_capacity = slot_capacity
+        self.max_width = max_width
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.seq = 0
+        self._last_publish_time = 0.0
+
+        size = _slot_offset(n_slots, slot_capacity)
+        # write into a temp file then rename, so a reader never maps a half
+        # initialised ring, and a restarted recorder gets a fresh inode that
+        # readers can detect
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        _RING_HEADER.pack_into(self._mm, 0, _MAGIC, n_slots, slot_capacity, 0)
+        self._buf = np.frombuffer(self._mm, dtype=np.uint8)
+        os.replace(tmp_path, path)
+        logging.info(f"`FrameRingWriter`: live frame ring created at {path}")
+
+    def publish(self, frame: np.ndarray) -> bool:
+        """Returns True if the frame was written, False if throttled or too
+        big for a slot
+        """
+        now = time.monotonic()
+        if now - self._last_publish_time < self.min_interval:
+            return False
+
+        frame = downscale_for_live(frame, self.max_width)
+        nbytes = frame.size * frame.itemsize
+        if nbytes > self.slot_capacity:
+            logging.warning(
+                f"`FrameRingWriter`: frame of {nbytes} bytes exceeds slot capacity of {self.slot_capacity}"
+            )
+            return False
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        seq = self.seq + 1
+        off = _slot_offset(seq % self.n_slots, self.slot_capacity)
+        data_off = off + _SLOT_HEADER.size
+        # seqlock: bump seq_begin first, then data, then seq_end
+        _SLOT_HEADER.pack_into(self._mm, off, seq, width, height, channels, nbytes, time.time(), 0)
+        self._buf[data_off : data_off + nbytes].reshape(frame.shape)[...] = frame
+        struct.pack_into("<Q", self._mm, off + _SEQ_END_OFFSET, seq)
+        struct.pack_into("<Q", self._mm, _LATEST_SEQ_OFFSET, seq)
+
+        self.seq = seq
+        self._last_publish_time = now
+        return True
+
+    def close(self):
+        try:
+            del self._buf
+            self._mm.close()
+            os.remove(self.path)
+        except:
+            logging.warning("`FrameRingWriter`: issue closing live frame ring", exc_info=True)
+
+
+class FrameRingReader:
+    """Read side of the ring, safe to use from many processes. Opens the ring
+    lazily so the reader can be created before the recorder is running
+    """
+
+    def __init__(self, path: str = LIVE_FRAME_RING_PATH, *, max_retries: int = 5):
+        self.path = path
+        self.max_retries = max_retries
+        self._mm = None
+        self._ino = None
+        self._last_inode_check = 0.0
+
+    def _open(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            self._ino = os.fstat(fd).st_ino
+            self._mm = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        magic, self.n_slots, self.slot_capacity, _ = _RING_HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            logging.error(f"`FrameRingReader`: {self.path} is not a live frame ring")
+            self.close()
+            return False
+        return True
+
+    def _ring_replaced(self) -> bool:
+        """The recorder recreates the ring on restart, check the inode at most
+        once a second so we notice without a stat() on every read
+        """
+        now = time.monotonic()
+        if now - self._last_inode_check < 1.0:
+            return False
+        self._last_inode_check = now
+        try:
+            return os.stat(self.path).st_ino != self._ino
+        except FileNotFoundError:
+            return True
+
+    def latest_seq(self) -> int:
+        if self._mm is None and not self._open():
+            return 0
+        return struct.unpack_from("<Q", self._mm, _LATEST_SEQ_OFFSET)[0]
+
+    def read_latest(self, after_seq: int = 0) -> tuple[int, float, np.ndarray] | None:
+        """Returns (seq, unix timestamp, frame copy) for the newest frame if it
+        is newer than `after_seq`, otherwise None
+        """
+        if self._mm is None and not self._open():
+            return None
+        for _ in range(self.max_retries):
+            seq = struct.unpack_from("<Q", self._mm, _LATEST_SEQ_OFFSET)[0]
+            if seq == after_seq or seq == 0:
+                if self._ring_replaced():
+                    self.close()
+                return None
+            off = _slot_offset(seq % self.n_slots, self.slot_capacity)
+            _, width, height, channels, nbytes, timestamp, seq_end = _SLOT_HEADER.unpack_from(self._mm, off)
+            if seq_end != seq:
+                continue
+            data_off = off + _SLOT_HEADER.size
+            frame = np.frombuffer(self._mm, dtype=np.uint8, count=nbytes, offset=data_off).copy()
+            seq_begin = struct.unpack_from("<Q", self._mm, off)[0]
+            if seq_begin != seq:
+                continue  # writer lapped us mid-copy
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            return seq, timestamp, frame.reshape(shape)
+        logging.debug("`FrameRingReader`: gave up after repeated torn reads")
+        return None
+
+    def close(self):
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except:
+                pass
+        self._mm = None
+        self._ino = None
@@ -0,0 +1,152 @@
+"""Rolling live HLS playlist cut from the recorder's video, for a low bandwidth
+live view that the browser can buffer
+
+A single long lived ffmpeg process is fed either
+    - "h264": the H.264 elementary stream the picamera2 encoder already
+      produces, which is only remuxed (-c copy, next to no CPU), or
+    - "rawvideo": raw BGR frames from the OpenCV capture loop, which are
+      encoded with a zero latency x264 preset
+and writes short .ts segments plus a rolling .m3u8 into RAM backed storage.
+
+Writes go through a bounded queue drained by a background thread, so a
+stalled or dead ffmpeg can never hold up the recording loop, it just drops
+live data until ffmpeg is restarted.
+"""
+
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+
+LIVE_HLS_DIR = "/dev/shm/pi_live_hls"
+LIVE_HLS_PLAYLIST = "live.m3u8"
+LIVE_HLS_SEGMENT_SECONDS = 2
+LIVE_HLS_LIST_SIZE = 6
+LIVE_HLS_QUEUE_SIZE = 120
+LIVE_HLS_RESTART_BACKOFF_SECONDS = 5
+
+
+def _hls_output_args(out_dir: str, segment_secs: int, list_size: int) -> list[str]:
+    return [
+        "-f", "hls",
+        "-hls_time", str(segment_secs),
+        "-hls_list_size", str(list_size),
+        # delete segments that fall off the playlist, never write an end tag,
+        # and write to temp files then rename so the server never serves a
+        # partial segment or playlist
+        "-hls_flags", "delete_segments+omit_endlist+temp_file+independent_segments",
+        "-hls_segment_filename", os.path.join(out_dir, "live_%06d.ts"),
+        os.path.join(out_dir, LIVE_HLS_PLAYLIST),
+    ]
+
+
+def h264_input_cmd(framerate: int) -> list[str]:
+    return [
+        "ffmpeg", "-loglevel", "error",
+        "-f", "h264",
+        "-framerate", str(framerate),
+        "-i", "pipe:0",
+        "-c:v", "copy",
+    ]
+
+
+def rawvideo_input_cmd(width: int, height: int, framerate: int) -> list[str]:
+    return [
+        "ffmpeg", "-loglevel", "error",
+        "-f", "rawvideo",
+        "-pix_fmt", "bgr24",
+        "-video_size", f"{width}x{height}",
+        "-framerate", str(framerate),
+        "-i", "pipe:0",
+        "-c:v", "libx264",
+        "-preset", "ultrafast",
+        "-tune", "zerolatency",
+        "-g", str(framerate * LIVE_HLS_SEGMENT_SECONDS),  # a keyframe to cut every segment on
+        "-pix_fmt", "yuv420p",
+    ]
+
+
+class LiveHlsSegmenter:
+    def __init__(
+        self,
+        input_cmd: list[str],
+        *,
+        out_dir: str = LIVE_HLS_DIR,
+        segment_secs: int = LIVE_HLS_SEGMENT_SECONDS,
+        list_size: int = LIVE_HLS_LIST_SIZE,
+        queue_size: int = LIVE_HLS_QUEUE_SIZE,
+    ):
+        self.out_dir = out_dir
+        self.cmd = input_cmd + _hls_output_args(out_dir, segment_secs, list_size)
+        self._queue: queue.Queue[bytes | None] = queue.Queue(maxsize=queue_size)
+        self._proc = None
+        self._last_start_time = 0.0
+        self._dropped = 0
+        os.makedirs(out_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._drain, name="LiveHlsSegmenter", daemon=True)
+        self._thread.start()
+
+    def write(self, data) -> None:
+        """Non-blocking, drops `data` if ffmpeg is not keeping up"""
+        try:
+            self._queue.put_nowait(bytes(data))
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped % 100 == 1:
+                logging.warning(f"`LiveHlsSegmenter`: ffmpeg not keeping up, {self._dropped} writes dropped")
+
+    def _start_ffmpeg(self) -> bool:
+        if time.monotonic() - self._last_start_time < LIVE_HLS_RESTART_BACKOFF_SECONDS:
+            return False
+        self._last_start_time = time.monotonic()
+        try:
+            self._proc = subprocess.Popen(
+                self.cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=os.setsid,
+            )
+            logging.info(f"`LiveHlsSegmenter`: ffmpeg PID {self._proc.pid} writing live HLS to {self.out_dir}")
+            return True
+        except:
+            logging.error("`LiveHlsSegmenter`: unable to start ffmpeg", exc_info=True)
+            self._proc = None
+            return False
+
+    def _drain(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._proc is None or self._proc.poll() is not None:
+                if self._proc is not None:
+                    logging.error(f"`LiveHlsSegmenter`: ffmpeg exited with {self._proc.returncode}, restarting")
+                    self._proc = None
+                if not self._start_ffmpeg():
+                    continue
+            try:
+                self._proc.stdin.write(data)
+            except (BrokenPipeError, OSError):
+                logging.error("`LiveHlsSegmenter`: ffmpeg pipe broken")
+                self._kill()
+        self._kill()
+
+    def _kill(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+            proc.wait(timeout=5)
+        except:
+            proc.kill()
+
+    def close(self):
+        try:
+            self._queue.put(None, timeout=1)
+            self._thread.join(timeout=10)
+        except:
+            logging.warning("`LiveHlsSegmenter`: issue closing live HLS segmenter", exc_info=True)
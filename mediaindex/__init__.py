@@ -0,0 +1,2 @@
+from .mp4box import Mp4ParseError, Mp4Info, FragmentIndex, fragment_index, fragment_index_from_path, probe, probe_path
+from .manifest import MANIFEST_FNAME, append_record, build_record, compact_manifest, load_manifest, read_manifest_since
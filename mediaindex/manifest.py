@@ -0,0 +1,224 @@
+"""Append only manifest of finished segments, written by the recorder as each
+conversion completes so the server never has to list, parse or probe files
+
+One JSON record per line in `_segments_manifest.jsonl` inside the videos dir.
+Several conversion worker processes append concurrently, so every append is a
+single write of a whole line under an exclusive flock. Readers never need the
+lock, a half written trailing line is simply skipped.
+
+Running this file directly will test the functions within it
+"""
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Container
+
+import timestamping
+
+from .mp4box import probe_path
+
+MANIFEST_FNAME = "_segments_manifest.jsonl"
+CHECKSUM_CHUNK_BYTES = 1024 * 1024
+
+
+def manifest_path(videos_dir: str) -> str:
+    return os.path.join(videos_dir, MANIFEST_FNAME)
+
+
+def file_checksum(fpath: str) -> str:
+    crc = 0
+    with open(fpath, "rb") as f:
+        while chunk := f.read(CHECKSUM_CHUNK_BYTES):
+            crc = zlib.crc32(chunk, crc)
+    return f"crc32:{crc:08x}"
+
+
+def build_record(
+    fpath: str,
+    *,
+    start: datetime,
+    camera_name: str,
+    recorded_fps: float | None = None,
+) -> dict:
+    """Metadata record for a finished segment, field names match the /playlist
+    JSON so records can be handed straight to the player
+    """
+    info = probe_path(fpath)
+    return {
+        "filename": os.path.basename(fpath),
+        "start": timestamping.dt_strfmt(start),
+        "camera_name": camera_name,
+        "duration_seconds": info.duration,
+        "size_bytes": os.path.getsize(fpath),
+        "frame_count": info.frame_count,
+        "fps": info.fps,
+        "recorded_fps": recorded_fps,
+        "codec": info.codec,
+        "width": info.width,
+        "height": info.height,
+        "fragmented": info.fragmented,
+        "checksum": file_checksum(fpath),
+        "published_at": time.time(),
+    }
+
+
+@contextmanager
+def _locked_manifest(videos_dir: str, mode: str):
+    """Yields the manifest opened and exclusively locked, reopening if it was
+    swapped out by `compact_manifest()` while we waited for the lock
+    """
+    path = manifest_path(videos_dir)
+    while True:
+        f = open(path, mode)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield f
+    finally:
+        f.close()  # also releases the lock
+
+
+def append_record(videos_dir: str, record: dict) -> None:
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with _locked_manifest(videos_dir, "a") as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_manifest_since(videos_dir: str, offset: int = 0, inode: int | None = None) -> tuple[dict[str, dict], int, int | None]:
+    """Incremental read for tailing the manifest, returns (records appended
+    since `offset`, offset to resume from, manifest inode). Pass back the inode
+    from the previous call, if the manifest has since been compacted (new
+    inode) it is re-read from the start. Only whole lines are consumed.
+    """
+    records = {}
+    try:
+        with open(manifest_path(videos_dir), "rb") as f:
+            current_inode = os.fstat(f.fileno()).st_ino
+            if current_inode != inode:
+                offset = 0
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # still being written, pick it up next time
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                    records[record["filename"]] = record
+                except (ValueError, KeyError):
+                    logging.warning("Skipping malformed segments manifest line")
+    except FileNotFoundError:
+        return {}, 0, None
+    return records, offset, current_inode
+
+
+def load_manifest(videos_dir: str) -> dict[str, dict]:
+    """filename -> record, later records for the same filename win"""
+    records, _, _ = read_manifest_since(videos_dir)
+    return records
+
+
+def compact_manifest(videos_dir: str, keep: Container[str] | Callable[[str], bool]) -> int:
+    """Rewrite the manifest with only the latest record for each kept file
+    (e.g. dropping files removed by diskmanage), returns records dropped.
+    `keep` is the filenames to keep, or a predicate on a filename. A predicate
+    is called with the manifest locked, so it sees every record appended up
+    to the rewrite (e.g. check the file still exists, rather than comparing
+    against a listing taken before)
+    """
+    is_kept = keep if callable(keep) else keep.__contains__
+    with _locked_manifest(videos_dir, "a") as locked:
+        records = load_manifest(videos_dir)
+        kept = [r for name, r in records.items() if is_kept(name)]
+        fd, tmp_path = tempfile.mkstemp(dir=videos_dir, prefix=".manifest_")
+        with os.fdopen(fd, "w") as tmp:
+            for record in kept:
+                tmp.write(json.dumps(record, separators=(",", ":")) + "\n")
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.replace(tmp_path, locked.name)
+    return len(records) - len(kept)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_append_and_load(self):
+        append_record(self.dir, {"filename": "a.mp4", "duration_seconds": 1})
+        append_record(self.dir, {"filename": "b.mp4", "duration_seconds": 2})
+        append_record(self.dir, {"filename": "a.mp4", "duration_seconds": 3})
+        records = load_manifest(self.dir)
+        self.assertEqual(list(records), ["a.mp4", "b.mp4"])
+        self.assertEqual(records["a.mp4"]["duration_seconds"], 3)
+
+    def test_missing_manifest_is_empty(self):
+        self.assertEqual(load_manifest(self.dir), {})
+
+    def test_partial_trailing_line_skipped(self):
+        append_record(self.dir, {"filename": "a.mp4"})
+        with open(manifest_path(self.dir), "a") as f:
+            f.write('{"filename": "b.mp')
+        self.assertEqual(list(load_manifest(self.dir)), ["a.mp4"])
+
+    def test_read_since_is_incremental(self):
+        append_record(self.dir, {"filename": "a.mp4"})
+        records, offset, inode = read_manifest_since(self.dir)
+        self.assertEqual(list(records), ["a.mp4"])
+        append_record(self.dir, {"filename": "b.mp4"})
+        records, offset, inode = read_manifest_since(self.dir, offset, inode)
+        self.assertEqual(list(records), ["b.mp4"])
+        self.assertEqual(read_manifest_since(self.dir, offset, inode)[0], {})
+        # compaction swaps the file, tailing starts over
+        compact_manifest(self.dir, {"b.mp4"})
+        records, _, _ = read_manifest_since(self.dir, offset, inode)
+        self.assertEqual(list(records), ["b.mp4"])
+
+    def test_compact_then_append(self):
+        for name in ["a.mp4", "b.mp4", "c.mp4"]:
+            append_record(self.dir, {"filename": name})
+        self.assertEqual(compact_manifest(self.dir, {"b.mp4"}), 2)
+        append_record(self.dir, {"filename": "d.mp4"})
+        self.assertEqual(list(load_manifest(self.dir)), ["b.mp4", "d.mp4"])
+
+    def test_compact_with_predicate(self):
+        for name in ["a.mp4", "b.mp4"]:
+            append_record(self.dir, {"filename": name})
+        seen = []
+        def keep(name):
+            seen.append(name)
+            return name != "a.mp4"
+        self.assertEqual(compact_manifest(self.dir, keep), 1)
+        self.assertEqual(seen, ["a.mp4", "b.mp4"])
+        self.assertEqual(list(load_manifest(self.dir)), ["b.mp4"])
+
+    def test_checksum_changes_with_content(self):
+        fpath = os.path.join(self.dir, "x.bin")
+        with open(fpath, "wb") as f:
+            f.write(b"abc")
+        first = file_checksum(fpath)
+        with open(fpath, "ab") as f:
+            f.write(b"d")
+        self.assertNotEqual(first, file_checksum(fpath))
+
+
+if __name__ == "__main__":
+    unittest.main()
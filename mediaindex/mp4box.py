@@ -0,0 +1,371 @@
+"""Minimal MP4 (ISO BMFF) box reader, standard library only
+
+Only reads box headers and the handful of small boxes we need, the media data
+itself is always skipped with a seek, so even a 5 minute file costs a few
+small reads. Used instead of spawning ffprobe for every file.
+
+Running this file directly will test the functions within it
+"""
+
+import io
+import os
+import struct
+import unittest
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator
+
+class Mp4ParseError(ValueError):
+    pass
+
+
+@dataclass
+class Box:
+    type: bytes
+    offset: int  # of the box header
+    size: int  # including the header
+    header_size: int
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+@dataclass(slots=True)  # the server keeps one per fragment of every segment it has served as HLS
+class Fragment:
+    offset: int  # of the moof
+    size: int  # moof + its mdat, i.e. one self contained HLS byte range
+    duration: float  # seconds
+    n_samples: int = 0
+
+
+@dataclass
+class FragmentIndex:
+    init_size: int  # ftyp + moov, the HLS EXT-X-MAP
+    timescale: int
+    fragments: list[Fragment] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return sum(f.duration for f in self.fragments)
+
+    @property
+    def n_samples(self) -> int:
+        return sum(f.n_samples for f in self.fragments)
+
+
+@dataclass
+class Mp4Info:
+    duration: float  # seconds
+    width: int
+    height: int
+    frame_count: int
+    codec: str  # sample entry fourcc, e.g. "avc1"
+    fragmented: bool
+
+    @property
+    def fps(self) -> float:
+        return self.frame_count / self.duration if self.duration > 0 else 0.0
+
+
+def iter_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """Yields the boxes laid out back to back between `start` and `end`"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset  # box runs to the end of the file
+        if size < header_size:
+            raise Mp4ParseError(f"Bad size {size} for box {box_type!r} at {offset}")
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def find_box(f: BinaryIO, parent: Box, path: list[bytes]) -> Box | None:
+    """Find the first box at `path` (e.g. [b"trak", b"mdia", b"mdhd"]) under `parent`"""
+    for box in iter_boxes(f, parent.payload_offset, parent.end):
+        if box.type == path[0]:
+            if len(path) == 1:
+                return box
+            found = find_box(f, box, path[1:])
+            if found:
+                return found
+    return None
+
+
+def read_payload(f: BinaryIO, box: Box) -> bytes:
+    f.seek(box.payload_offset)
+    return f.read(box.size - box.header_size)
+
+
+def _file_size(f: BinaryIO) -> int:
+    return f.seek(0, os.SEEK_END)
+
+
+def _video_trak(f: BinaryIO, moov: Box) -> Box | None:
+    for trak in iter_boxes(f, moov.payload_offset, moov.end):
+        if trak.type != b"trak":
+            continue
+        hdlr = find_box(f, trak, [b"mdia", b"hdlr"])
+        # version/flags (4) + pre_defined (4) + handler_type (4)
+        if hdlr and read_payload(f, hdlr)[8:12] == b"vide":
+            return trak
+    return None
+
+
+def _timescale_and_duration(payload: bytes) -> tuple[int, int]:
+    """mvhd and mdhd share this layout; version 1 has 64 bit times/duration"""
+    if payload[0] == 1:
+        return struct.unpack_from(">IQ", payload, 20)
+    return struct.unpack_from(">II", payload, 12)
+
+
+def _traf_ticks_and_samples(f: BinaryIO, traf: Box, trex_default_duration: int) -> tuple[int, int]:
+    default_duration = trex_default_duration
+    ticks = 0
+    n_samples = 0
+    for box in iter_boxes(f, traf.payload_offset, traf.end):
+        payload = read_payload(f, box) if box.type in (b"tfhd", b"trun") else b""
+        if box.type == b"tfhd":
+            flags = int.from_bytes(payload[1:4], "big")
+            pos = 8  # version/flags + track_ID
+            if flags & 0x01:
+                pos += 8  # base_data_offset
+            if flags & 0x02:
+                pos += 4  # sample_description_index
+            if flags & 0x08:
+                default_duration = struct.unpack_from(">I", payload, pos)[0]
+        elif box.type == b"trun":
+            flags = int.from_bytes(payload[1:4], "big")
+            sample_count = struct.unpack_from(">I", payload, 4)[0]
+            n_samples += sample_count
+            pos = 8
+            if flags & 0x01:
+                pos += 4  # data_offset
+            if flags & 0x04:
+                pos += 4  # first_sample_flags
+            if not flags & 0x100:
+                ticks += sample_count * default_duration
+                continue
+            # per sample records, duration is always the first field present
+            record_size = 4 * bin(flags & 0xF00).count("1")
+            for i in range(sample_count):
+                ticks += struct.unpack_from(">I", payload, pos + i * record_size)[0]
+    return ticks, n_samples
+
+
+def _top_level(f: BinaryIO) -> tuple[list[Box], Box]:
+    top = list(iter_boxes(f, 0, _file_size(f)))
+    moov = next((b for b in top if b.type == b"moov"), None)
+    if moov is None:
+        raise Mp4ParseError("No moov box")
+    return top, moov
+
+
+def fragment_index(f: BinaryIO) -> FragmentIndex | None:
+    """For a fragmented MP4 returns the init segment size and the byte range and
+    duration of every moof+mdat pair, or None for a regular (progressive) MP4
+    """
+    top, moov = _top_level(f)
+    return _fragment_index(f, top, moov)
+
+
+def _fragment_index(f: BinaryIO, top: list[Box], moov: Box) -> FragmentIndex | None:
+    if not any(b.type == b"moof" for b in top):
+        return None
+
+    trak = _video_trak(f, moov)
+    mdhd = trak and find_box(f, trak, [b"mdia", b"mdhd"])
+    if not mdhd:
+        raise Mp4ParseError("No video track")
+    timescale, _ = _timescale_and_duration(read_payload(f, mdhd))
+    if not timescale:
+        raise Mp4ParseError("Zero timescale")
+    trex = find_box(f, moov, [b"mvex", b"trex"])
+    # version/flags + track_ID + default_sample_description_index + default_sample_duration
+    trex_default_duration = struct.unpack_from(">I", read_payload(f, trex), 12)[0] if trex else 0
+
+    index = FragmentIndex(init_size=moov.end, timescale=timescale)
+    for i, box in enumerate(top):
+        if box.type != b"moof":
+            continue
+        traf = find_box(f, box, [b"traf"])
+        ticks, n_samples = _traf_ticks_and_samples(f, traf, trex_default_duration) if traf else (0, 0)
+        # the fragment runs up to and including the mdat that follows it
+        frag_end = box.end
+        if i + 1 < len(top) and top[i + 1].type == b"mdat":
+            frag_end = top[i + 1].end
+        index.fragments.append(Fragment(box.offset, frag_end - box.offset, ticks / timescale, n_samples))
+    return index
+
+
+def fragment_index_from_path(path: str) -> FragmentIndex | None:
+    with open(path, "rb") as f:
+        return fragment_index(f)
+
+
+def probe(f: BinaryIO) -> Mp4Info:
+    """Duration, resolution, frame count and codec of the video track, read
+    from moov/mvhd, tkhd and stbl, or summed over the fragments when the moov
+    is empty (fragmented files written with +empty_moov)
+    """
+    top, moov = _top_level(f)
+    trak = _video_trak(f, moov)
+    if trak is None:
+        raise Mp4ParseError("No video track")
+
+    width = height = 0
+    tkhd = find_box(f, trak, [b"tkhd"])
+    if tkhd:
+        # width and height are 16.16 fixed point, the last 8 bytes of tkhd
+        payload = read_payload(f, tkhd)
+        width, height = (v >> 16 for v in struct.unpack_from(">II", payload, len(payload) - 8))
+
+    codec = ""
+    stsd = find_box(f, trak, [b"mdia", b"minf", b"stbl", b"stsd"])
+    if stsd:
+        # version/flags + entry_count, then the first sample entry's header
+        codec = read_payload(f, stsd)[12:16].decode("ascii", errors="replace")
+
+    frame_count = 0
+    stsz = find_box(f, trak, [b"mdia", b"minf", b"stbl", b"stsz"])
+    if stsz:
+        # version/flags + sample_size + sample_count
+        frame_count = struct.unpack_from(">I", read_payload(f, stsz), 8)[0]
+
+    duration = 0.0
+    mdhd = find_box(f, trak, [b"mdia", b"mdhd"])
+    if mdhd:
+        timescale, ticks = _timescale_and_duration(read_payload(f, mdhd))
+        duration = ticks / timescale if timescale else 0.0
+    if not duration:
+        mvhd = find_box(f, moov, [b"mvhd"])
+        if mvhd:
+            timescale, ticks = _timescale_and_duration(read_payload(f, mvhd))
+            duration = ticks / timescale if timescale else 0.0
+
+    fragments = _fragment_index(f, top, moov)
+    if fragments:
+        duration = duration or fragments.duration
+        frame_count += fragments.n_samples
+
+    if duration <= 0:
+        raise Mp4ParseError("Unable to determine duration")
+    return Mp4Info(duration, width, height, frame_count, codec, fragments is not None)
+
+
+def probe_path(path: str) -> Mp4Info:
+    with open(path, "rb") as f:
+        return probe(f)
+
+
+###############################################################################
+# tests: build tiny synthetic files, we only care about box structure
+###############################################################################
+
+
+def _box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _full(version: int, flags: int) -> bytes:
+    return bytes([version]) + flags.to_bytes(3, "big")
+
+
+def _make_moov(
+    timescale: int,
+    trex_duration: int | None = None,
+    *,
+    duration: int = 0,
+    n_samples: int = 0,
+    size: tuple[int, int] = (640, 480),
+) -> bytes:
+    mdhd = _box(b"mdhd", _full(0, 0) + struct.pack(">IIII", 0, 0, timescale, duration) + b"\0" * 4)
+    hdlr = _box(b"hdlr", _full(0, 0) + b"\0" * 4 + b"vide" + b"\0" * 12)
+    tkhd = _box(b"tkhd", _full(0, 3) + b"\0" * 72 + struct.pack(">II", size[0] << 16, size[1] << 16))
+    stsd = _box(b"stsd", _full(0, 0) + struct.pack(">I", 1) + _box(b"avc1", b"\0" * 78))
+    stsz = _box(b"stsz", _full(0, 0) + struct.pack(">II", 0, n_samples) + b"\0" * 4 * n_samples)
+    stbl = _box(b"stbl", stsd + stsz)
+    trak = _box(b"trak", tkhd + _box(b"mdia", mdhd + hdlr + _box(b"minf", stbl)))
+    mvex = b""
+    if trex_duration is not None:
+        mvex = _box(b"mvex", _box(b"trex", _full(0, 0) + struct.pack(">IIIII", 1, 1, trex_duration, 0, 0)))
+    return _box(b"moov", trak + mvex)
+
+
+def _make_fragment(durations: list[int], mdat_size: int) -> bytes:
+    trun = _box(
+        b"trun",
+        _full(0, 0x001 | 0x100 | 0x200)
+        + struct.pack(">Ii", len(durations), 0)
+        + b"".join(struct.pack(">II", d, 100) for d in durations),
+    )
+    tfhd = _box(b"tfhd", _full(0, 0x020000) + struct.pack(">I", 1))
+    moof = _box(b"moof", _box(b"traf", tfhd + trun))
+    return moof + _box(b"mdat", b"\0" * mdat_size)
+
+
+class TestMp4Box(unittest.TestCase):
+    def test_progressive_file_has_no_fragment_index(self):
+        data = _box(b"ftyp", b"isom") + _make_moov(1000) + _box(b"mdat", b"\0" * 50)
+        self.assertIsNone(fragment_index(io.BytesIO(data)))
+
+    def test_fragment_byte_ranges_and_durations(self):
+        ftyp = _box(b"ftyp", b"isom")
+        moov = _make_moov(90000)
+        frag1 = _make_fragment([3000] * 30, 500)
+        frag2 = _make_fragment([3000] * 15, 200)
+        data = ftyp + moov + frag1 + frag2
+        index = fragment_index(io.BytesIO(data))
+        self.assertEqual(index.init_size, len(ftyp) + len(moov))
+        self.assertEqual([f.offset for f in index.fragments], [index.init_size, index.init_size + len(frag1)])
+        self.assertEqual([f.size for f in index.fragments], [len(frag1), len(frag2)])
+        self.assertAlmostEqual(index.fragments[0].duration, 1.0)
+        self.assertAlmostEqual(index.duration, 1.5)
+
+    def test_trex_default_duration(self):
+        trun = _box(b"trun", _full(0, 0) + struct.pack(">I", 10))
+        moof = _box(b"moof", _box(b"traf", _box(b"tfhd", _full(0, 0) + struct.pack(">I", 1)) + trun))
+        data = _box(b"ftyp") + _make_moov(1000, trex_duration=50) + moof + _box(b"mdat")
+        self.assertAlmostEqual(fragment_index(io.BytesIO(data)).duration, 0.5)
+
+    def test_probe_progressive(self):
+        data = _box(b"ftyp", b"isom") + _make_moov(1000, duration=300_000, n_samples=5700, size=(1920, 1080)) + _box(b"mdat")
+        info = probe(io.BytesIO(data))
+        self.assertEqual((info.width, info.height), (1920, 1080))
+        self.assertEqual(info.codec, "avc1")
+        self.assertEqual(info.frame_count, 5700)
+        self.assertAlmostEqual(info.duration, 300.0)
+        self.assertAlmostEqual(info.fps, 19.0)
+        self.assertFalse(info.fragmented)
+
+    def test_probe_fragmented_empty_moov(self):
+        data = _box(b"ftyp") + _make_moov(90000) + _make_fragment([3000] * 30, 10) + _make_fragment([3000] * 15, 10)
+        info = probe(io.BytesIO(data))
+        self.assertTrue(info.fragmented)
+        self.assertEqual(info.frame_count, 45)
+        self.assertAlmostEqual(info.duration, 1.5)
+        self.assertAlmostEqual(info.fps, 30.0)
+
+    def test_probe_no_duration_raises(self):
+        with self.assertRaises(Mp4ParseError):
+            probe(io.BytesIO(_box(b"ftyp") + _make_moov(1000)))
+
+    def test_garbage_raises(self):
+        with self.assertRaises(Mp4ParseError):
+            fragment_index(io.BytesIO(b"\0\0\0\x02abcd" + b"\0" * 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
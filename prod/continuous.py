@@ -30,6 +30,7 @@ from dotenv import load_dotenv
 from typing import Callable, cast
 
 sys.path.append(r"/home/brend/Documents")
+import mediaindex
 import timestamping
 
 ###############################################################################
@@ -66,6 +67,14 @@ JOB_QUEUE_SIZE_UNTIL_SYS_EXIT = WORKERS_LIMIT * 5
 # around the mean
 SUBPROCESS_TIMEOUT_SECONDS = VID_LENGTH_SECONDS * 2
 
+# -- output container
+# fragmented mp4 (a moof+mdat pair per keyframe) still plays as a normal file,
+# but also lets the server hand out byte ranges of it as HLS VOD segments
+FRAGMENTED_MP4_FFMPEG_ARGS = [
+    "-movflags",
+    "+frag_keyframe+empty_moov+default_base_moof",
+]
+
 # -- cleanup
 CLEANUP_STRAGGLER_GLOB = "*_TEMP.avi"
 
@@ -101,6 +110,7 @@ def ffmpeg_template_processing_function(
     in_extension: str,
     camera_name: str,
     function_logging_label: str,
+    recorded_fps: float | None = None,
 ) -> None:
     """Templace for a function that matches the signature required by the
     driver below, once the keyword arguments have been frozen to a
@@ -112,6 +122,9 @@ def ffmpeg_template_processing_function(
     It expects the base_cmd to leave exactly two None placeholders, the first
     will be replaced by the input fpath, and the second by the output fpath
 
+    Once converted, a metadata record for the mp4 is appended to the segments
+    manifest in `out_dirpath`, so the web server never has to probe it
+
     e.g.
     base_cmd = [
         "ffmpeg",  # command-line tool ffmpeg for multimedia processing
@@ -148,7 +161,12 @@ def ffmpeg_template_processing_function(
         out_fname = timestamping.generate_filename(
             for_time=timestamp, camera_name=camera_name, extension=".mp4"
         )
-        out_fpath = os.path.join(out_dirpath, out_fname)
+        # flat, or the hour directory of a partitioned archive (which the
+        # manifest still sits at the root of)
+        out_fpath = timestamping.segment_path(
+            out_dirpath, out_fname, timestamping.read_layout(out_dirpath)
+        )
+        os.makedirs(os.path.dirname(out_fpath), exist_ok=True)
         cmd = base_cmd.copy()
         cmd[cmd.index(None)] = in_fname
         cmd[cmd.index(None)] = out_fpath
@@ -181,6 +199,24 @@ def ffmpeg_template_processing_function(
             os.killpg(proc.pid, signal.SIGTERM)
         raise RuntimeError(f"Processing job for {in_fname} FAILED.")
 
+    # the video itself is safe at this point, a manifest failure only means the
+    # server falls back to probing this file
+    try:
+        mediaindex.append_record(
+            out_dirpath,
+            mediaindex.build_record(
+                out_fpath,
+                start=timestamp,
+                camera_name=camera_name,
+                recorded_fps=recorded_fps,
+            ),
+        )
+    except:
+        logging.error(
+            f"`{function_logging_label}()` PID {os.getpid()}: unable to add {out_fpath} to segments manifest",
+            exc_info=True,
+        )
+
 
 ###############################################################################
 # abtract driver function
@@ -8,6 +8,7 @@ import threading
 import time
 
 from continuous import (
+    FRAGMENTED_MP4_FFMPEG_ARGS,
     continuous_record_driver,
     ffmpeg_template_processing_function,
     ok_dir,
@@ -15,6 +16,7 @@ from continuous import (
 from processing import is_over_mean_bright_threshold
 
 sys.path.append(r"/home/brend/Documents")
+import livefeed
 import timestamping
 
 # -- basic camera config
@@ -37,6 +39,12 @@ EVENT_LOG_FILE_LOG_LEVEL = logging.ERROR
 MEAN_BRIGHTNESS_THRESHOLD = 15
 FRAMES_IN_A_ROW_FOR_BRIGHTNESS_EVENT = OPENCV_FPS * 2
 
+# -- live view, frames are handed to the web server through shared memory
+LIVE_FRAME_FPS = 15
+# raw frames are also x264 encoded into a rolling HLS playlist, this costs a
+# second (ultrafast) encode so it can be switched off on a struggling Pi
+LIVE_HLS_ENABLED = True
+
 
 def initialise_opencv(shutdown_flag: threading.Event) -> dict:
     logging.debug("Configuring cv2 camera...")
@@ -64,7 +72,22 @@ def initialise_opencv(shutdown_flag: threading.Event) -> dict:
     except:
         logging.critical("Exception while configuring opencv capture settings")
         shutdown_flag.set()
-    return dict(cap=cap)
+    live_frames = None
+    try:
+        live_frames = livefeed.FrameRingWriter(max_fps=LIVE_FRAME_FPS)
+    except:
+        # live view is a nice to have, never stop recording because of it
+        logging.error("Unable to create live frame ring", exc_info=True)
+    live_hls = None
+    if LIVE_HLS_ENABLED:
+        try:
+            live_hls = livefeed.LiveHlsSegmenter(
+                livefeed.rawvideo_input_cmd(OPENCV_WIDTH, OPENCV_HEIGHT, OPENCV_FPS),
+                queue_size=OPENCV_FPS,  # raw frames are big, hold at most ~1s
+            )
+        except:
+            logging.error("Unable to start live HLS segmenter", exc_info=True)
+    return dict(cap=cap, live_frames=live_frames, live_hls=live_hls)
 
 
 # global vars to persist between each recording call
@@ -89,6 +112,8 @@ def record_to_temp_avi(
     # -- initialise hardware and file writer
     try:
         cap = hardware["cap"]
+        live_frames = hardware.get("live_frames")
+        live_hls = hardware.get("live_hls")
     except:
         logging.critical("`record_to_temp_avi`: Error in USB hardware objects passed")
         raise RuntimeError("Error in USB hardware objects passed")
@@ -143,6 +168,10 @@ def record_to_temp_avi(
             # put all processing into try block to avoid crashing on processing
             # code
             try:
+                if live_frames:
+                    live_frames.publish(frame)
+                if live_hls:
+                    live_hls.write(frame)
                 if is_over_mean_bright_threshold(frame, MEAN_BRIGHTNESS_THRESHOLD):
                     if over_brightness_threshold_frame_count_local_copy == 0:
                         events_logger.debug(
@@ -226,6 +255,7 @@ def avi_convert_to_mp4(
         "23",  # constant rate factor — lower = better quality & bigger file; 23 is default
         "-pix_fmt",
         "yuv420p",  # output pixel format: yuv420p generally compatible with most browsers
+        *FRAGMENTED_MP4_FFMPEG_ARGS,
         None,  # output placeholder
     ]
 
@@ -256,6 +286,7 @@ def avi_convert_to_mp4(
         in_extension=".avi",
         camera_name=CAMERA_LABEL,
         function_logging_label="avi_convert_to_mp4",
+        recorded_fps=dynamic_configs.get("mean_fps"),
     )
 
 
@@ -266,6 +297,10 @@ def cleanup_opencv(hardware: dict):
         logging.critical("`cleanup_opencv`: Error in USB hardware objects passed")
         raise RuntimeError("Error in USB hardware objects passed")
     cap.release()
+    if hardware.get("live_frames"):
+        hardware["live_frames"].close()
+    if hardware.get("live_hls"):
+        hardware["live_hls"].close()
 
 
 if __name__ == "__main__":
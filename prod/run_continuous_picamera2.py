@@ -1,7 +1,8 @@
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
-from picamera2.outputs import FileOutput
+from picamera2.outputs import FileOutput, Output
 from libcamera import Transform  # type: ignore
+import cv2
 
 import logging
 import sys
@@ -10,31 +11,84 @@ import time
 
 from functools import partial
 
-from continuous import continuous_record_driver, ffmpeg_template_processing_function
+from continuous import (
+    FRAGMENTED_MP4_FFMPEG_ARGS,
+    continuous_record_driver,
+    ffmpeg_template_processing_function,
+)
 
 sys.path.append(r"/home/brend/Documents")
+import livefeed
 import timestamping
 
 PICAM_WIDTH = 1920
 PICAM_HEIGHT = 1080
 CAMERA_LABEL = "PI_CAMERA"
 
+# -- live view, the lores stream is handed to the web server through shared
+# memory; lores is always YUV420 on the Pi, so we convert it before publishing
+LIVE_FRAME_WIDTH = 640
+LIVE_FRAME_HEIGHT = 360
+LIVE_FRAME_FPS = 15
+# the encoder's H.264 output is also remuxed (no re-encode) into a rolling
+# HLS playlist; an I-frame every 2s lets the segmenter cut 2s segments, and
+# repeating the SPS/PPS headers lets it resync after every recording restart
+LIVE_HLS_ENABLED = True
+PICAM_FPS = 30
+H264_IPERIOD_FRAMES = PICAM_FPS * 2
+
+
+class LiveHlsOutput(Output):
+    """picamera2 output that forwards encoded frames to the HLS segmenter,
+    used alongside the FileOutput of each recording
+    """
+
+    def __init__(self, segmenter: livefeed.LiveHlsSegmenter):
+        super().__init__()
+        self.segmenter = segmenter
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        self.segmenter.write(frame)
+
 
 def initialise_picamera2(shutdown_flag: threading.Event):
     logging.debug("Configuring picamera2 and h264 encoder objects...")
     picam2 = Picamera2()
     video_config = picam2.create_video_configuration(
         main={"size": (PICAM_WIDTH, PICAM_HEIGHT)},
+        lores={"size": (LIVE_FRAME_WIDTH, LIVE_FRAME_HEIGHT)},
         transform=Transform(hflip=True, vflip=True),
     )
     picam2.configure(video_config)
-    h264_encoder = H264Encoder()
+    h264_encoder = H264Encoder(repeat=True, iperiod=H264_IPERIOD_FRAMES)
     try:
         picam2.start()
     except:
         logging.critical("Cannot start picamera")
         shutdown_flag.set()
-    return dict(picam2=picam2, h264_encoder=h264_encoder)
+    live_frames = None
+    try:
+        live_frames = livefeed.FrameRingWriter(max_fps=LIVE_FRAME_FPS)
+    except:
+        # live view is a nice to have, never stop recording because of it
+        logging.error("Unable to create live frame ring", exc_info=True)
+    live_hls = None
+    if LIVE_HLS_ENABLED:
+        try:
+            live_hls = livefeed.LiveHlsSegmenter(livefeed.h264_input_cmd(PICAM_FPS))
+        except:
+            logging.error("Unable to start live HLS segmenter", exc_info=True)
+    return dict(
+        picam2=picam2,
+        h264_encoder=h264_encoder,
+        live_frames=live_frames,
+        live_hls=live_hls,
+    )
+
+
+def publish_live_frame(picam2, live_frames: livefeed.FrameRingWriter):
+    yuv = picam2.capture_array("lores")
+    live_frames.publish(cv2.cvtColor(yuv, cv2.COLOR_YUV420p2BGR))
 
 
 def record_to_temp_h264(
@@ -44,6 +98,8 @@ def record_to_temp_h264(
     try:
         picam2 = hardware["picam2"]
         h264_encoder = hardware["h264_encoder"]
+        live_frames = hardware.get("live_frames")
+        live_hls = hardware.get("live_hls")
     except:
         logging.critical(
             f"`record_to_temp_h264`: Error in picamera2 hardware objects passed"
@@ -55,8 +111,13 @@ def record_to_temp_h264(
     )
     logging.info(f"`record_to_temp_h264` {h264_fname}: recording {secs}s video now...")
     start_time = time.monotonic()
+    # without a live frame consumer we only need to wake up once a second
+    poll_secs = 1.0 / LIVE_FRAME_FPS if live_frames else 1
     try:
-        picam2.start_recording(h264_encoder, FileOutput(h264_fname))
+        outputs = [FileOutput(h264_fname)]
+        if live_hls:
+            outputs.append(LiveHlsOutput(live_hls))
+        picam2.start_recording(h264_encoder, outputs)
         while True:
             time_elapsed = time.monotonic() - start_time
             if time_elapsed >= secs:
@@ -69,7 +130,14 @@ def record_to_temp_h264(
                     f"`record_to_temp_avi()` {h264_fname}: interrupted after {time_elapsed:.1f}s"
                 )
                 break
-            time.sleep(1)
+            if live_frames:
+                try:
+                    publish_live_frame(picam2, live_frames)
+                except:
+                    logging.error(
+                        f"`record_to_temp_h264()` {h264_fname}: live frame publish FAILED"
+                    )
+            time.sleep(poll_secs)
     except:
         logging.error(
             f"`record_to_temp_h264()` {h264_fname}: exception raise in recording call",
@@ -89,6 +157,10 @@ def cleanup_picamera2(hardware: dict):
         )
         raise RuntimeError("Error in picamera hardware objects passed")
     picam2.close()
+    if hardware.get("live_frames"):
+        hardware["live_frames"].close()
+    if hardware.get("live_hls"):
+        hardware["live_hls"].close()
 
 
 if __name__ == "__main__":
@@ -98,11 +170,12 @@ if __name__ == "__main__":
             "ffmpeg",  # command-line tool ffmpeg for multimedia processing
             "-y",  # output overwrites any files with same name
             "-framerate",
-            "30",  # picamera2 records at 30fps, ensures output matches
+            str(PICAM_FPS),  # picamera2 records at 30fps, ensures output matches
             "-i",
             None,  # input placeholder
             "-c:v",
             "copy",  # copy input codec without re-encoding; speeds up conversion and avoids quality loss
+            *FRAGMENTED_MP4_FFMPEG_ARGS,
             None,  # output placeholder
         ],
         in_extension=".h264",
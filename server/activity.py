@@ -0,0 +1,252 @@
+"""Per bucket activity over the archive, for drawing a heatmap under the
+timeline so dead hours can be skipped without loading any video
+
+Every thumbnail tile (one keyframe every ~10 s, see thumbnails.py) gives a
+mean brightness, and a motion score from its difference with the previous
+tile. These are journalled per segment, and flattened into one table of
+numpy columns whenever the media index or the stats change. A query is then
+a handful of vectorised reductions:
+    - coverage: seconds recorded in each bucket, from prefix sums over sorted
+      segment starts and ends evaluated at every bucket edge
+    - events: tiles whose motion score crosses ACTIVITY_EVENT_MOTION_THRESHOLD
+    - brightness / motion: per bucket means of the tiles (`np.bincount`)
+Results are computed over the whole archive once per bucket size and sliced
+for each request, until the table changes.
+
+Times are "wall clock epoch" seconds, see `timestamping.dt_to_epoch`.
+"""
+
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+import timestamping
+from thumbnails import THUMBNAIL_COLUMNS, THUMBNAIL_HEIGHT, THUMBNAIL_WIDTH
+
+# mean absolute difference (0-255) between consecutive thumbnails
+ACTIVITY_EVENT_MOTION_THRESHOLD = 12.0
+ACTIVITY_MAX_BUCKETS = 20_000
+# archive wide results are cached for the player's bucket sizes only (see
+# ACTIVITY_BUCKETS in player.js), one entry each of at most
+# ACTIVITY_MAX_CACHED_BUCKETS buckets (~8MB), so memory stays bounded however
+# many sizes clients ask for. Anything else only computes the range asked for
+ACTIVITY_CACHED_BUCKET_SECONDS = (10, 30, 60, 300, 900, 3600, 6 * 3600, 24 * 3600)
+ACTIVITY_MAX_CACHED_BUCKETS = 250_000
+ACTIVITY_COMPACT_RATIO = 2
+
+
+def tile_stats(sprite_path: str, n_tiles: int) -> tuple[list[float], list[float]]:
+    """(brightness, motion) per tile of a thumbnail sprite sheet"""
+    import cv2  # only needed once thumbnails are being built
+
+    sprite = cv2.imread(sprite_path, cv2.IMREAD_GRAYSCALE)
+    if sprite is None:
+        raise ValueError(f"Unable to read {sprite_path}")
+    rows = sprite.shape[0] // THUMBNAIL_HEIGHT
+    tiles = (
+        sprite[: rows * THUMBNAIL_HEIGHT, : THUMBNAIL_COLUMNS * THUMBNAIL_WIDTH]
+        .reshape(rows, THUMBNAIL_HEIGHT, THUMBNAIL_COLUMNS, THUMBNAIL_WIDTH)
+        .swapaxes(1, 2)
+        .reshape(-1, THUMBNAIL_HEIGHT, THUMBNAIL_WIDTH)[:n_tiles]
+        .astype(np.int16)
+    )
+    brightness = tiles.mean(axis=(1, 2))
+    motion = np.concatenate(([0.0], np.abs(np.diff(tiles, axis=0)).mean(axis=(1, 2))))
+    return brightness.round(1).tolist(), motion.round(1).tolist()
+
+
+# value of a bucket without any recordings
+_EMPTY_BUCKET = {"coverage": 0.0, "events": 0.0, "brightness": np.nan, "motion": np.nan}
+
+
+def _window(values: np.ndarray, offset: int, n: int, fill: float) -> np.ndarray:
+    """values[offset:offset + n], `fill` where that runs outside `values`"""
+    out = np.full(n, fill, dtype=np.float64)
+    lo, hi = max(offset, 0), min(offset + n, len(values))
+    if lo < hi:
+        out[lo - offset : hi - offset] = values[lo:hi]
+    return out
+
+
+class _Table:
+    """The flattened, numpy form of the index + stats"""
+
+    def __init__(self, segments: list[tuple[int, float]], tiles: list[tuple[np.ndarray, list, list]]):
+        starts = np.array([s for s, _ in segments], dtype=np.float64)
+        ends = starts + np.array([d for _, d in segments], dtype=np.float64)
+        self.starts = np.sort(starts)
+        self.ends = np.sort(ends)
+        self.start_sums = np.concatenate(([0.0], np.cumsum(self.starts)))
+        self.end_sums = np.concatenate(([0.0], np.cumsum(self.ends)))
+        if tiles:
+            self.tile_times = np.concatenate([t for t, _, _ in tiles])
+            self.brightness = np.concatenate([np.asarray(b, dtype=np.float64) for _, b, _ in tiles])
+            self.motion = np.concatenate([np.asarray(m, dtype=np.float64) for _, _, m in tiles])
+        else:
+            self.tile_times = self.brightness = self.motion = np.empty(0)
+        self.first = float(self.starts[0]) if len(self.starts) else 0.0
+        self.last = float(self.ends.max()) if len(self.ends) else 0.0
+
+    def covered_until(self, t: np.ndarray) -> np.ndarray:
+        """Total seconds recorded before each time in `t`, summed over every
+        segment as min(max(t - start, 0), duration)
+        """
+        n_started = np.searchsorted(self.starts, t, side="right")
+        n_ended = np.searchsorted(self.ends, t, side="right")
+        return (n_started * t - self.start_sums[n_started]) - (n_ended * t - self.end_sums[n_ended])
+
+    def aggregate(self, origin: float, bucket: int, n_buckets: int) -> dict[str, np.ndarray]:
+        edges = origin + bucket * np.arange(n_buckets + 1, dtype=np.float64)
+        coverage = np.diff(self.covered_until(edges)) / bucket
+
+        idx = np.floor((self.tile_times - origin) / bucket).astype(np.int64)
+        inside = (idx >= 0) & (idx < n_buckets)
+        idx = idx[inside]
+        n_tiles = np.bincount(idx, minlength=n_buckets)
+        events = np.bincount(
+            idx, weights=(self.motion[inside] >= ACTIVITY_EVENT_MOTION_THRESHOLD).astype(np.float64), minlength=n_buckets
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            brightness = np.bincount(idx, weights=self.brightness[inside], minlength=n_buckets) / n_tiles
+            motion = np.bincount(idx, weights=self.motion[inside], minlength=n_buckets) / n_tiles
+        return {"coverage": coverage, "events": events, "brightness": brightness, "motion": motion}
+
+
+class ActivityIndex:
+    def __init__(self, path: str, entries: Callable[[], list[dict]], version: Callable[[], int]):
+        """`entries()` / `version()` are the media index's playlist entries and
+        change counter, stats for segments not in it are ignored
+        """
+        self.path = path
+        self.entries = entries
+        self.version = version
+        self._lock = threading.Lock()
+        # filename -> {"times": [...], "brightness": [...], "motion": [...]}
+        self._stats: dict[str, dict] = {}
+        self._stats_version = 0
+        self._stats_changed_at = 0.0
+        self._journal_lines = 0
+        self._table = None
+        self._table_key = None
+        self._cache: dict[int, tuple[float, dict]] = {}  # bucket -> (origin, results)
+        self._load()
+
+    def add_sprite(self, filename: str, sprite_path: str, times: list[float]):
+        """Thumbnail builder callback, records the tile stats of a new sprite"""
+        brightness, motion = tile_stats(sprite_path, len(times))
+        stats = {"times": [round(t, 1) for t in times], "brightness": brightness, "motion": motion}
+        with self._lock:
+            self._stats[filename] = stats
+            self._stats_version += 1
+            self._stats_changed_at = time.time()
+            with open(self.path, "a") as f:
+                f.write(json.dumps([filename, stats], separators=(",", ":")) + "\n")
+            self._journal_lines += 1
+
+    def validators(self, media_validators: tuple[str, float]) -> tuple[str, float]:
+        """(etag, unix time of last change) for query results: the media
+        index's `media_validators` plus the tile stats, which change on their
+        own as thumbnails are built after a segment is published
+        """
+        etag, changed_at = media_validators
+        with self._lock:
+            return f"{etag}-{self._stats_version}", max(changed_at, self._stats_changed_at)
+
+    def query(self, start_epoch: float | None, end_epoch: float | None, bucket: int) -> dict:
+        """Per bucket lists over [start, end), both default to the archive
+        bounds. Buckets are aligned to multiples of `bucket` seconds
+        """
+        with self._lock:
+            table = self._current_table()
+            if start_epoch is None:
+                start_epoch = table.first
+            if end_epoch is None:
+                end_epoch = table.last
+            first = math.floor(start_epoch / bucket)
+            n_buckets = max(0, math.ceil(end_epoch / bucket) - first)
+            if n_buckets > ACTIVITY_MAX_BUCKETS:
+                raise ValueError(f"Too many buckets ({n_buckets}), use a bigger `bucket` or a shorter range")
+
+            cached = self._cache.get(bucket)
+            if cached is None and bucket in ACTIVITY_CACHED_BUCKET_SECONDS:
+                archive_first = math.floor(table.first / bucket)
+                archive_n = math.ceil(table.last / bucket) - archive_first + 1
+                if archive_n <= ACTIVITY_MAX_CACHED_BUCKETS:
+                    cached = self._cache[bucket] = (archive_first, table.aggregate(archive_first * bucket, bucket, archive_n))
+            if cached is not None:
+                archive_first, results = cached
+                results = {
+                    k: _window(v, first - archive_first, n_buckets, _EMPTY_BUCKET[k]) for k, v in results.items()
+                }
+            else:
+                results = table.aggregate(first * bucket, bucket, n_buckets)
+
+        def as_list(values: np.ndarray, digits: int) -> list:
+            return [None if np.isnan(v) else round(float(v), digits) for v in values]
+
+        return {
+            "from": timestamping.dt_strfmt(timestamping.epoch_to_dt(first * bucket)),
+            "bucket": bucket,
+            "coverage": as_list(results["coverage"], 3),
+            "events": [int(v) for v in results["events"]],
+            "brightness": as_list(results["brightness"], 1),
+            "motion": as_list(results["motion"], 1),
+        }
+
+    def _current_table(self) -> _Table:
+        # called with self._lock held
+        key = (self.version(), self._stats_version)
+        if key != self._table_key:
+            segments, tiles = [], []
+            live = set()
+            entries = self.entries()
+            parsed = timestamping.parse_filenames(entry["filename"] for entry in entries)
+            for entry, start, camera_id in zip(entries, parsed.epochs, parsed.camera_ids):
+                if camera_id < 0:
+                    continue
+                segments.append((start, entry["duration_seconds"]))
+                live.add(entry["filename"])
+                stats = self._stats.get(entry["filename"])
+                if stats:
+                    tiles.append((start + np.asarray(stats["times"]), stats["brightness"], stats["motion"]))
+            self._table = _Table(segments, tiles)
+            self._table_key = key
+            self._cache.clear()
+            if self._journal_lines > ACTIVITY_COMPACT_RATIO * max(len(live), 1):
+                self._compact(live)
+        return self._table
+
+    def _compact(self, live: set[str]):
+        # called with self._lock held, drops stats of deleted segments
+        self._stats = {f: s for f, s in self._stats.items() if f in live}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), prefix=".activity_")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for filename, stats in self._stats.items():
+                    f.write(json.dumps([filename, stats], separators=(",", ":")) + "\n")
+            os.replace(tmp_path, self.path)
+            self._journal_lines = len(self._stats)
+        except:
+            os.remove(tmp_path)
+            logging.error(f"Issue compacting activity stats {self.path}", exc_info=True)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    filename, stats = json.loads(line)
+                except ValueError:
+                    continue  # partially written last line
+                self._stats[filename] = stats
+                self._journal_lines += 1
+        self._stats_changed_at = os.path.getmtime(self.path)
+        logging.debug(f"Activity stats loaded for {len(self._stats)} segments")
@@ -1,11 +1,8 @@
-from flask import Flask, render_template, send_file, abort, jsonify, Response
+from flask import Flask, render_template, send_file, abort, jsonify, request, url_for, Response
 from werkzeug.utils import safe_join # type: ignore
 
-from picamera2 import Picamera2
-from libcamera import Transform # type: ignore
-import cv2
-
 import atexit
+import bisect
 import json
 import logging
 import os
@@ -13,27 +10,72 @@ import signal
 import subprocess 
 import sys
 import time
+from datetime import datetime, timedelta
 from typing import List
 
 sys.path.append(r"/home/brend/Documents")
+import livefeed
+import mediaindex
 import timestamping
-
+from diskmanage.retention import HIGH_WATERMARK
+from diskmanage.telemetry import StorageTelemetry, forecast_alerts
+
+from broadcast import FrameBroadcaster
+import camerasrc
+import httpcache
+from indexer import MediaIndexer
+from metacache import MetadataCache
+import segserve
+from segfeed import SegmentFeed
+from activity import ActivityIndex
+from thumbnails import ThumbnailCache
+import vod
+
+VIDEO_METADATA_CACHE_PATH = "_video_metadata.jsonl"
+THUMBNAILS_CACHE_DIR = "_thumbnails"
+ACTIVITY_STATS_PATH = "_activity_stats.jsonl"
+# the media index as of its last full resync, served at start up until the
+# initial scan of the drive is done
+SEGMENT_INDEX_SNAPSHOT_PATH = "_segment_index.bin"
+# older whole-file cache, imported into the metadata cache on first run
 VIDEO_DURATIONS_CACHE_PATH = "_video_durations.json"
 
+# recordings are chunked into 5 minute files, so a file starting this long
+# before the requested range may still overlap it
+VOD_MAX_SEGMENT_SECONDS = 15 * 60
+PLAYLIST_MAX_LIMIT = 1000
+EXPORT_MAX_SECONDS = 6 * 60 * 60
+# recordings without a manifest record (older ones) are treated as finished,
+# and so cacheable forever, once untouched for this long
+SEGMENT_SETTLED_SECONDS = 15 * 60
+
 # USB_DEVICE_NAME = "E657-3701"
 USB_DEVICE_NAME = "DYNABOOK"
 USB_PATH = os.path.join("/media/brend", USB_DEVICE_NAME)
 USB_VID_PATH = os.path.join(USB_PATH, "vidfiles")
 
 app = Flask(__name__)
+app.after_request(httpcache.gzip_response)
+
+# where live frames come from: "ring" (the recorder's shared memory, it owns
+# the camera), "picamera2" (recorder not running) or "synthetic" (no camera,
+# for development and benchmarks). Opened on the first live client only, and
+# released again once nobody is watching
+LIVE_CAMERA_BACKEND = os.environ.get("PI_CAMERA_BACKEND", camerasrc.DEFAULT_CAMERA_BACKEND)
+
+# one broadcaster reads + encodes each frame once for every connected live client
+live_broadcaster = FrameBroadcaster(camerasrc.source_opener(LIVE_CAMERA_BACKEND))
+
+# open recordings, reused across the many range requests a seeking player makes
+segment_fds = segserve.FdCache()
 
 def cleanup():
     logging.info("Running `cleanup()`...")
-    try:
-        picam2.close()
-        logging.info("`cleanup`: picam2 closed")
-    except:
-        logging.critical("Error during picamera cleanup")
+    live_broadcaster.stop()
+    segment_feed.stop()
+    media_index.stop()
+    metadata_cache.flush()
+    segment_fds.close()
 
 atexit.register(cleanup)
 
@@ -52,43 +94,93 @@ def home():
 
 ###############################################################################
 
-def fetch_mp4_files(videos_path: str) -> List[str]:
-    return sorted([f for f in os.listdir(videos_path) if f.endswith(".mp4")])
+def describe_unmanifested_files(mp4_files: List[str]) -> dict:
+    """Playlist entries for mp4s the recorder did not write a manifest record
+    for (i.e. older recordings), called by the media indexer in batches
+    """
+    described = {}
+    for mp4_file in mp4_files:
+        described[mp4_file] = None
+        dt, camera_name = timestamping.parse_filename(mp4_file)
+        if not dt or not camera_name: 
+            logging.warning(f"Unable to parse file {mp4_file} for timestamp and camera name")
+            continue
 
-def try_load_json(path) -> dict:
-    if os.path.exists(path):
-        with open(path, "r") as f:
-            logging.debug("Durations cache successfully accessed")
-            return json.load(f)
-    else:
-        logging.warning("Durations cache not found")
-        return {}
-
-def save_json(path, dict_: dict) -> None:
-    with open(path, "w") as f:
-        json.dump(dict_, f, indent=2)
-        logging.info("Video durations cached")
-
-def get_video_duration(fpath: str, cache: dict) -> float:
-    fname = os.path.basename(fpath)
-    if fname in cache:
-        if cache[fname] == -1: # error code on second time around
-            try:
-                duration = get_video_duration_ffprobe(fpath)
-                cache[fname] = duration
-            except:
-                cache[fname] = 0 # give up on this
-                logging.warning(
-                    f"{fpath} ffprobe call for duration has errored twice,"
-                    "and permanently stored in cache as error'ed"
-                )
-        return cache[fname]
-    else: 
-        try:
-            cache[fname] = get_video_duration_ffprobe(fpath)
-        except:
-            cache[fname] = -1 # error code
-        return cache[fname]
+        logging.debug(f"Generating video metadata for {mp4_file}...")
+        vid_duration = metadata_cache.get_duration(media_index.path(mp4_file))
+        if vid_duration:
+            described[mp4_file] = {
+                "filename": mp4_file,
+                "start": timestamping.dt_strfmt(dt),
+                "duration_seconds": vid_duration,
+                "camera_name": camera_name
+            }
+        else:
+            logging.info(f"{mp4_file} has been processed as invalid length, and will be excluded from playback")
+
+    n_excluded = sum(1 for d in described.values() if d is None)
+    if n_excluded:
+        logging.warning(f"{n_excluded} videos in drive unable to be processed and displayed")
+    return described
+
+# per thumbnail brightness / motion, aggregated for the timeline heatmap
+activity_index = ActivityIndex(ACTIVITY_STATS_PATH, lambda: media_index.entries(), lambda: media_index.version)
+
+# sprite sheets for scrubbing previews, built as segments are published
+thumbnail_cache = ThumbnailCache(
+    THUMBNAILS_CACHE_DIR,
+    lambda f: media_index.path(f),
+    lambda f: media_index.duration(f),
+    on_built=activity_index.add_sprite,
+)
+
+# pushes every newly published segment to the open players
+segment_feed = SegmentFeed()
+
+def segment_published(filename: str):
+    thumbnail_cache.submit(filename)
+    entry = media_index.entry(filename)
+    if entry:
+        segment_feed.publish(entry)
+
+def segment_removed(filename: str):
+    metadata_cache.forget(filename)
+    vod.forget_fragment_index(filename)
+
+# built once in the background, then kept current from filesystem events
+media_index = MediaIndexer(
+    USB_VID_PATH,
+    describe_unmanifested_files,
+    on_published=segment_published,
+    on_removed=segment_removed,
+    snapshot_path=SEGMENT_INDEX_SNAPSHOT_PATH,
+)
+
+# written by diskmanage/retention.py, only read here
+storage_telemetry = StorageTelemetry(USB_VID_PATH)
+
+def video_path(filename: str) -> str | None:
+    """Where a segment is on the drive, in whichever layout it uses (see
+    timestamping/layout.py), None for names that could point outside it
+    """
+    if not safe_join(USB_VID_PATH, filename) or os.path.basename(filename) != filename:
+        return None
+    return media_index.path(filename)
+
+def probe_video_duration(fpath: str) -> float:
+    """Reads the duration straight out of the mp4 boxes, only spawning ffprobe
+    for files the in-process parser cannot handle
+    """
+    try:
+        return mediaindex.probe_path(fpath).duration
+    except:
+        logging.info(f"{fpath} could not be parsed in-process, falling back to ffprobe")
+        return get_video_duration_ffprobe(fpath)
+
+# shared by every request thread, probes each file at most once at a time
+metadata_cache = MetadataCache(
+    VIDEO_METADATA_CACHE_PATH, probe_video_duration, legacy_path=VIDEO_DURATIONS_CACHE_PATH
+)
 
 def get_video_duration_ffprobe(fpath: str) -> float:
     result = subprocess.run([
@@ -106,107 +198,305 @@ def get_video_duration_ffprobe(fpath: str) -> float:
     info = json.loads(result.stdout)
     return float(info["format"]["duration"])
     
-def generate_stream():
+def generate_stream(**stream_settings):
     logging.info("Stream initialized.")
-    error_last_frame_flag = False
     try:
-        while True:
-            try:
-                frame = picam2.capture_array()
-                error_last_frame_flag = False
-            except:
-                logging.warning("Issue capturing one frame in stream.")
-                if error_last_frame_flag:
-                    raise RuntimeError("Two corrupt stream frames in a row, aborting stream")
-                error_last_frame_flag = True
-                continue
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                logging.warning("Issue streaming frame in `generate_stream()`")
-                continue
-            yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-            time.sleep(0.06)  # about ~15fps ish
+        yield from live_broadcaster.client_stream(**stream_settings)
     except GeneratorExit:
         logging.info("Client disconnected from stream.")
     except:
         logging.critical(f"Exception caught in stream!", exc_info=True)
 
+def parse_range_args() -> tuple[datetime | None, datetime | None, str | None]:
+    """?from=&to=&camera=, shared by the playlist style endpoints"""
+    try:
+        range_from = vod.parse_time_arg(request.args.get("from"))
+        range_to = vod.parse_time_arg(request.args.get("to"))
+    except ValueError:
+        abort(400, description="`from` and `to` must be ISO format timestamps")
+    return range_from, range_to, request.args.get("camera")
+
 @app.route("/playlist")
+@httpcache.validated_by(lambda: media_index.validators())
 def playlist():
-    logging.info("Fetching all .mp4 files into list...")
-    try:
-        mp4_files = fetch_mp4_files(USB_VID_PATH)
-    except:
-        msg = "Error fetching + sorting .mp4 files for playback!"
-        logging.error(msg)
-        abort(404, description=msg)
+    """Every playable segment, or with any of ?from=&to=&camera=&limit=&cursor=
+    one window of them. The cursor for the next window is returned in the
+    `X-Next-Cursor` header, absent on the last window
+    """
+    if not request.args:
+        video_data = media_index.entries()
+        if not video_data:
+            logging.critical("Unable to populate any videos")
+            abort(404, description="Error parsing filenames or generating video metadata")
+        return jsonify(video_data)
+
+    range_from, range_to, camera = parse_range_args()
+    limit = request.args.get("limit", PLAYLIST_MAX_LIMIT, type=int)
+    if not 0 < limit <= PLAYLIST_MAX_LIMIT:
+        abort(400, description=f"`limit` must be between 1 and {PLAYLIST_MAX_LIMIT}")
+    cursor = request.args.get("cursor")
+    if cursor and not timestamping.parse_filename(cursor)[0]:
+        abort(400, description="Invalid `cursor`")
+    page, next_cursor = media_index.window(
+        start=range_from,
+        end=range_to,
+        camera=camera,
+        limit=limit,
+        cursor=cursor,
+        max_segment_seconds=VOD_MAX_SEGMENT_SECONDS,
+    )
+    response = jsonify(page)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+@app.route("/segments/stream")
+def segments_stream():
+    """Server-Sent Events, one `segment` event (a playlist entry) per newly
+    published recording
+    """
+    response = Response(
+        segment_feed.client_stream(request.headers.get("Last-Event-ID")), mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # in case of a buffering proxy in front
+    return response
 
-    durations_cache = try_load_json(VIDEO_DURATIONS_CACHE_PATH)
-    durations_cache_initial_size = len(durations_cache)
-    video_data = []
+@app.route("/browse")
+@httpcache.validated_by(lambda: media_index.validators())
+def browse():
+    """One day of recordings per page, ?day=YYYYMMDD (latest by default)"""
+    days = media_index.days()
+    day = request.args.get("day") or (days[-1] if days else None)
+    camera = request.args.get("camera")
+    files = []
+    if day:
+        try:
+            day_start = datetime.strptime(day, "%Y%m%d")
+        except ValueError:
+            abort(400, description="`day` must be formatted YYYYMMDD")
+        files = media_index.filenames(start=day_start, end=day_start + timedelta(days=1), camera=camera)
+    # neighbouring days with recordings, also when `day` itself has none
+    i = bisect.bisect_left(days, day) if day else 0
+    j = i + 1 if i < len(days) and days[i] == day else i
+    return render_template(
+        "browse.html",
+        files=files,
+        day=day,
+        days=days,
+        camera=camera,
+        prev_day=days[i - 1] if i > 0 else None,
+        next_day=days[j] if j < len(days) else None,
+    )
 
-    for mp4_file in mp4_files:
+@app.route("/vod")
+def vod_player():
+    return render_template("vod.html")
+
+@app.route("/vod.m3u8")
+def vod_playlist():
+    """HLS VOD manifest over ?from=&to=&camera=, all optional but `camera`
+    is needed when more than one camera recorded in the range
+    """
+    range_from, range_to, camera = parse_range_args()
+
+    parsed = []
+    for mp4_file in media_index.filenames(
+        start=range_from - timedelta(seconds=VOD_MAX_SEGMENT_SECONDS) if range_from else None,
+        end=range_to + timedelta(seconds=1) if range_to else None,  # `to` itself is inclusive
+        camera=camera,
+    ):
         dt, camera_name = timestamping.parse_filename(mp4_file)
-        if not dt or not camera_name: 
-            logging.warning(f"Unable to parse file {mp4_file} for timestamp and camera name")
-            continue
-
-        logging.debug(f"Generating video metadata for {mp4_file}...")
-        try:
-            full_path = os.path.join(USB_VID_PATH, mp4_file)
-            vid_duration = get_video_duration(full_path, durations_cache)
-            if vid_duration > 0:
-                video_data.append({
-                    "filename": mp4_file,
-                    "start": timestamping.dt_strfmt(dt),
-                    "duration_seconds": vid_duration,
-                    "camera_name": camera_name
-                })
-            else:
-                logging.info(f"{mp4_file} has been processed as invalid length, and will be excluded from playback")
-        except:
-            logging.error(f"Problem calculating / fetching {mp4_file} video duration")
-
-    logging.debug("Saving videos durations cache...")
-    try:
-        save_json(VIDEO_DURATIONS_CACHE_PATH, durations_cache)
-        logging.info(f"Durations cache: {durations_cache_initial_size} cache size updated to {len(durations_cache)}")
-    except:
-        logging.critical(f"Issue saving videos durations cache to {VIDEO_DURATIONS_CACHE_PATH}")
+        if dt and camera_name:
+            parsed.append((mp4_file, dt, camera_name))
+    # one timeline, the same minutes of two cameras cannot be in it
+    cameras = {camera_name for _, _, camera_name in parsed}
+    if len(cameras) > 1:
+        abort(400, description=f"Recordings from several cameras in range, pick one with `camera`: {sorted(cameras)}")
+
+    entries = []
+    for mp4_file, dt, camera_name in parsed:
+        fragments = vod.get_fragment_index(media_index.path(mp4_file))
+        entries.append(vod.VodEntry(
+            mp4_file, dt, camera_name, fragments.duration if fragments else 0, fragments
+        ))
 
-    if not video_data:
-        logging.critical("Unable to populate any videos")
-        abort(404, description="Error parsing filenames or generating video metadata")
+    if all(e.fragments for e in entries):
+        make_manifest = lambda entries: vod.build_fmp4_playlist(
+            entries, lambda f: url_for("serve_video", filename=f)
+        )
     else:
-        if len(video_data) < len(mp4_files):
-            logging.warning(f"{len(mp4_files) - len(video_data)} videos in drive unable to be processed and displayed")
-
-    return jsonify(video_data)
-
-@app.route("/browse")
-def browse(): 
+        # regular mp4s in range, fall back to one remuxed TS segment per file
+        for entry in entries:
+            if not entry.fragments:
+                entry.duration = metadata_cache.get_duration(media_index.path(entry.filename)) or 0
+        make_manifest = lambda entries: vod.build_ts_playlist(
+            entries, lambda f: url_for("serve_vod_ts_segment", filename=f)
+        )
+
+    entries = [
+        e for e in entries
+        if e.duration > 0
+        and not (range_from and e.start.timestamp() + e.duration < range_from.timestamp())
+    ]
+    if not entries:
+        abort(404, description="No recordings found in requested range")
+
+    response = Response(make_manifest(entries), mimetype="application/vnd.apple.mpegurl")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/vod/segment/<filename>")
+def serve_vod_ts_segment(filename):
+    safe_path = video_path(filename)
+    if not safe_path or not os.path.isfile(safe_path):
+        abort(404, description="Error fetching files from specified drive in Flask app.py")
+    return Response(vod.remux_to_ts(safe_path), mimetype="video/mp2t")
+
+@app.route("/export")
+def export_clip():
+    """Download ?from=&to=&camera= as one mp4, cut from the recordings with
+    stream copy and sent while it is being put together
+    """
+    range_from, range_to, camera = parse_range_args()
+    if not range_from or not range_to or range_to <= range_from:
+        abort(400, description="`from` and `to` are required, with `from` before `to`")
+    if (range_to - range_from).total_seconds() > EXPORT_MAX_SECONDS:
+        abort(400, description=f"Exports are limited to {EXPORT_MAX_SECONDS // 60} minutes")
+
+    entries, _ = media_index.window(
+        start=range_from, end=range_to, camera=camera, max_segment_seconds=VOD_MAX_SEGMENT_SECONDS
+    )
+    if not entries:
+        abort(404, description="No recordings found in requested range")
+    cameras = {e["camera_name"] for e in entries}
+    if len(cameras) > 1:
+        abort(400, description=f"Recordings from several cameras in range, pick one with `camera`: {sorted(cameras)}")
+
+    vod_entries = [
+        vod.VodEntry(
+            e["filename"],
+            timestamping.parse_filename(e["filename"])[0],
+            e["camera_name"],
+            e["duration_seconds"],
+            filepath=media_index.path(e["filename"]),
+        )
+        for e in entries
+    ]
+    download_name = timestamping.generate_filename(
+        for_time=range_from, camera_name=f"{cameras.pop()}_export", extension=".mp4"
+    )
     try:
-        mp4_files = fetch_mp4_files(USB_VID_PATH)
-    except:
-        abort(404, description="Error fetching + sorting .mp4 files in browse")
-
-    return render_template("browse.html", files=mp4_files)
+        clip = vod.export_clip(vod_entries, range_from, range_to)
+    except vod.ExportError as e:
+        logging.error(f"`export_clip()`: {e}")
+        abort(500, description="Could not put the clip together, see the server log")
+    if clip is None:
+        abort(404, description="No recordings found in requested range")
+    response = Response(clip, mimetype="video/mp4")
+    response.headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/thumbnails/<filename>")
+def serve_thumbnails(filename):
+    """<segment stem>.vtt is the WebVTT index of a segment's sprite sheet,
+    <segment stem>.jpg the sheet itself. Built on first request if need be
+    """
+    stem, ext = os.path.splitext(filename)
+    if ext not in (".vtt", ".jpg"):
+        abort(404)
+    segment = stem + ".mp4"
+    if not video_path(segment) or not thumbnail_cache.ensure(segment):
+        abort(404, description="No thumbnails available for this segment")
+    if ext == ".vtt":
+        return send_file(thumbnail_cache.vtt_path(segment), mimetype="text/vtt", max_age=0)
+    response = send_file(thumbnail_cache.sprite_path(segment), mimetype="image/jpeg")
+    # a segment's thumbnails never change once built
+    response.headers["Cache-Control"] = httpcache.IMMUTABLE_CACHE_CONTROL
+    return response
+
+@app.route("/activity")
+@httpcache.validated_by(lambda: activity_index.validators(media_index.validators()))
+def activity():
+    """?from=&to=&bucket=60 per bucket recording coverage (recorded seconds
+    per second, summed over cameras), motion event counts and mean brightness
+    / motion (null without thumbnails)
+    """
+    range_from, range_to, _ = parse_range_args()
+    bucket = request.args.get("bucket", 60, type=int)
+    if bucket <= 0:
+        abort(400, description="`bucket` must be a positive number of seconds")
+    try:
+        result = activity_index.query(
+            timestamping.dt_to_epoch(range_from) if range_from else None,
+            timestamping.dt_to_epoch(range_to) if range_to else None,
+            bucket,
+        )
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify(result)
+
+@app.route("/storage")
+def storage():
+    """Drive usage, write rate per camera and how long until the high
+    watermark / a full drive (see diskmanage/telemetry.py), plus ?hours=24 of
+    usage history in at most ?points=200 samples
+    """
+    hours = request.args.get("hours", 24, type=float)
+    points = request.args.get("points", 200, type=int)
+    if hours <= 0 or points <= 0:
+        abort(400, description="`hours` and `points` must be positive")
+    result = storage_telemetry.forecast(HIGH_WATERMARK)
+    result["alerts"] = [message for _, message in forecast_alerts(result).values()]
+    result["usage_history"] = storage_telemetry.usage_history(time.time() - hours * 3600, min(points, 2000))
+    response = jsonify(result)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route('/stream')
 def stream():
-    return render_template('stream.html')
+    return render_template('stream.html', hls_playlist=livefeed.LIVE_HLS_PLAYLIST)
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_stream(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # optional ?width=&quality=&fps= as a starting point, the broadcaster
+    # snaps them onto shared renditions and adapts them to the client
+    stream_settings = {}
+    for key, type_ in (("width", int), ("quality", int), ("fps", float)):
+        value = request.args.get(key, type=type_)
+        if value is not None:
+            if value <= 0:
+                abort(400, description=f"`{key}` must be positive")
+            stream_settings[key] = value
+    return Response(generate_stream(**stream_settings), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route("/live/<filename>")
+def serve_live_hls(filename):
+    # rolling playlist + segments written by the recorder into RAM
+    safe_path = safe_join(livefeed.LIVE_HLS_DIR, filename)
+    if not safe_path or not os.path.isfile(safe_path):
+        abort(404, description="Live HLS stream not available, is the recorder running?")
+    if filename.endswith(".m3u8"):
+        response = send_file(safe_path, mimetype="application/vnd.apple.mpegurl", max_age=0)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return send_file(safe_path, mimetype="video/mp2t")
+
+def segment_cache_control(filename: str, path: str) -> str:
+    finished = (
+        media_index.has_manifest_record(filename)
+        or time.time() - os.path.getmtime(path) > SEGMENT_SETTLED_SECONDS
+    )
+    # otherwise it may still be being written by the recorder
+    return httpcache.IMMUTABLE_CACHE_CONTROL if finished else "no-cache"
 
 @app.route("/video/<filename>")
 def serve_video(filename):
-    safe_path = safe_join(USB_VID_PATH, filename)
+    safe_path = video_path(filename)
     if not safe_path or not os.path.isfile(safe_path):
         abort(404, description="Error fetching files from specified drive in Flask app.py")
-    return send_file(safe_path, mimetype="video/mp4")
+    return segserve.serve_segment(segment_fds, safe_path, "video/mp4", segment_cache_control(filename, safe_path))
 
 if __name__ == "__main__": 
     # initialize logger
@@ -229,15 +519,9 @@ if __name__ == "__main__":
         flask_logger.handlers.clear()
         flask_logger.addHandler(flask_log_handler)
 
-    try:
-        # initialize picam for stream
-        picam2 = Picamera2()
-        picam2.configure(picam2.create_preview_configuration(
-            main={"size": (640, 480)},
-            transform=Transform(hflip=True, vflip=True)
-        ))
-        picam2.start()
-    except:
-        logging.error(f"Unable to initialize camera for stream")
+    # start building the index now rather than on the first request, without
+    # holding up the server (requests before it is ready wait for it)
+    media_index.start()
 
+    # one thread per request, see asgi.py to serve many streaming clients
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
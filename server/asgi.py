@@ -0,0 +1,316 @@
+"""Async (ASGI) entry point, for many concurrent live viewers and downloads
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --timeout-graceful-shutdown 5
+
+Under `app.run(threaded=True)` every open /video_feed, /segments/stream and
+segment download holds an OS thread for as long as it lasts. Here those run
+as tasks on one event loop instead, so memory use and context switching stay
+flat as clients are added:
+    - /video_feed and /segments/stream await the broadcaster / segment feed,
+      woken by their producer threads, no thread per client
+    - /video/<filename> is served with the same validators + ranges as the
+      Flask view (segserve.py). Chunks already in the page cache are read
+      right on the loop, the rest on a thread so the drive never blocks it
+    - the index APIs (/playlist, /browse, /activity) only read memory, so once
+      the index is built their Flask views are called straight on the loop
+Every other route is the existing Flask view, run on a small thread pool.
+
+Keep to ONE worker process: the broadcaster, index and caches live in it.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+# app.py installs signal handlers that `sys.exit()`, which would cut the ASGI
+# server's graceful shutdown short, so keep whatever the server installed
+_server_handlers = {s: signal.getsignal(s) for s in (signal.SIGINT, signal.SIGTERM)}
+import app as webapp
+for _sig, _handler in _server_handlers.items():
+    if _handler is not None:
+        signal.signal(_sig, _handler)
+
+import segserve
+
+# for the Flask views that may block (probing files, ffmpeg, thumbnails)
+ASGI_WSGI_THREADS = 8
+# index API views are called on the loop once the index is built
+ASGI_INLINE_ROUTES = ("/playlist", "/browse", "/activity")
+# each chunk is one hop to the executor, so bigger than the WSGI path's
+ASGI_SEGMENT_CHUNK_BYTES = segserve.SEGMENT_SENDFILE_CHUNK_BYTES
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class _Disconnect:
+    """Watches `receive()` for the client going away, which ASGI servers only
+    report there (sending to a closed connection is silently dropped)
+    """
+
+    def __init__(self, receive):
+        self.task = asyncio.create_task(self._watch(receive))
+
+    @staticmethod
+    async def _watch(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    def is_set(self) -> bool:
+        return self.task.done()
+
+    def cancel(self):
+        self.task.cancel()
+
+
+def _headers(scope: dict) -> dict[str, str]:
+    # repeated headers are joined, as in WSGI
+    headers: dict[str, str] = {}
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1").lower(), value.decode("latin-1")
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return headers
+
+
+async def _start(send, status: int, headers: list[tuple[str, str]]):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+
+
+async def _simple(send, status: int, text: str):
+    body = text.encode()
+    await _start(send, status, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))])
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _stream(send, receive, chunks, status: int, headers: list[tuple[str, str]]):
+    """Sends an async generator of chunks until it ends or the client leaves,
+    also while the generator is waiting for its next chunk
+    """
+
+    async def pump():
+        await _start(send, status, headers)
+        async for chunk in chunks:
+            body = chunk.encode() if isinstance(chunk, str) else chunk
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    disconnect = _Disconnect(receive)
+    pumping = asyncio.create_task(pump())
+    try:
+        await asyncio.wait((pumping, disconnect.task), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        if not pumping.done():
+            pumping.cancel()  # closes the generator
+            await asyncio.wait((pumping,))
+        await chunks.aclose()
+    if not pumping.cancelled():
+        pumping.result()  # raises what went wrong sending
+
+
+def _read_if_cached(fd: int, n: int, offset: int) -> bytes | None:
+    """Up to `n` bytes that are already in the page cache, None if reading
+    would have to wait on the drive (or the kernel cannot tell)
+    """
+    buf = bytearray(n)
+    try:
+        got = os.preadv(fd, [buf], offset, os.RWF_NOWAIT)
+    except (AttributeError, OSError):
+        return None
+    return bytes(buf[:got]) if got else None
+
+
+# -- native routes
+
+
+async def video_feed(scope, receive, send):
+    query = parse_qs(scope["query_string"].decode("latin-1"))
+    stream_settings = {}
+    for key, type_ in (("width", int), ("quality", int), ("fps", float)):
+        if key in query:
+            try:
+                value = type_(query[key][0])
+            except ValueError:
+                continue  # ignored like Flask's `request.args.get(type=...)`
+            if value <= 0:
+                return await _simple(send, 400, f"`{key}` must be positive")
+            stream_settings[key] = value
+    chunks = webapp.live_broadcaster.async_client_stream(**stream_settings)
+    try:
+        await _stream(
+            send, receive, chunks, 200, [("Content-Type", "multipart/x-mixed-replace; boundary=frame")]
+        )
+    except Exception:
+        logging.critical("Exception caught in stream!", exc_info=True)
+
+
+async def segments_stream(scope, receive, send):
+    chunks = webapp.segment_feed.async_client_stream(_headers(scope).get("last-event-id"))
+    await _stream(send, receive, chunks, 200, [
+        ("Content-Type", "text/event-stream; charset=utf-8"),
+        ("Cache-Control", "no-cache"),
+        ("X-Accel-Buffering", "no"),
+    ])
+
+
+async def serve_video(scope, receive, send, filename: str):
+    loop = asyncio.get_running_loop()
+    safe_path = webapp.video_path(filename)
+    if not safe_path or not os.path.isfile(safe_path):
+        return await _simple(send, 404, "Error fetching files from specified drive")
+    cache_control = webapp.segment_cache_control(filename, safe_path)
+    headers = _headers(scope)
+    segment = await loop.run_in_executor(None, webapp.segment_fds.acquire, safe_path)
+    disconnect = None
+    try:
+        plan = segserve.plan_response(
+            segment,
+            scope["method"],
+            cache_control,
+            "video/mp4",
+            if_none_match=headers.get("if-none-match"),
+            if_range=headers.get("if-range"),
+            range_header=headers.get("range"),
+        )
+        await _start(send, plan.status, plan.headers)
+        disconnect = _Disconnect(receive)
+        offset = plan.start
+        while offset < plan.stop and not disconnect.is_set():
+            n = min(ASGI_SEGMENT_CHUNK_BYTES, plan.stop - offset)
+            # a read that misses the page cache waits on the USB drive, so off the loop
+            chunk = _read_if_cached(segment.fd, n, offset) or await loop.run_in_executor(
+                None, os.pread, segment.fd, n, offset
+            )
+            if not chunk:
+                break  # file shrank under us
+            offset += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if disconnect:
+            disconnect.cancel()
+        webapp.segment_fds.release(segment)
+
+
+# -- everything else, through Flask
+
+
+def _environ(scope: dict, body: bytes) -> dict:
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in _headers(scope).items():
+        key = name.upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        environ[key] = value
+    return environ
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def wsgi(scope, receive, send, inline: bool):
+    """Runs the Flask app for one request, on the loop if `inline` (for quick,
+    buffered views) otherwise on the WSGI thread pool, chunk by chunk so
+    streamed responses (exports, remuxes) do not pin a thread between chunks
+    """
+    loop = asyncio.get_running_loop()
+    environ = _environ(scope, await _read_body(receive))
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    async def run(fn, *args):
+        if inline:
+            return fn(*args)
+        return await loop.run_in_executor(_wsgi_executor, fn, *args)
+
+    iterable = await run(webapp.app, environ, start_response)
+    disconnect = None
+    try:
+        iterator = iter(iterable)
+        first = await run(next, iterator, None)
+        await _start(send, *started)
+        disconnect = _Disconnect(receive)
+        chunk = first
+        while chunk is not None and not disconnect.is_set():
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await run(next, iterator, None)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if disconnect:
+            disconnect.cancel()
+        if hasattr(iterable, "close"):
+            await run(iterable.close)
+
+
+# -- routing
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # start building the index now rather than on the first request
+            webapp.media_index.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # the rest is `app.cleanup()` at exit
+            _wsgi_executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return  # no websockets
+
+    start = time.monotonic()
+    path, method = scope["path"], scope["method"]
+    if method in ("GET", "HEAD"):
+        if path == "/video_feed" and method == "GET":
+            return await video_feed(scope, receive, send)
+        if path == "/segments/stream" and method == "GET":
+            return await segments_stream(scope, receive, send)
+        if path.startswith("/video/") and "/" not in path[len("/video/"):]:
+            return await serve_video(scope, receive, send, path[len("/video/"):])
+    inline = path in ASGI_INLINE_ROUTES and webapp.media_index.ready
+    await wsgi(scope, receive, send, inline)
+    logging.debug(f"{method} {path} took {time.monotonic() - start:.3f}s ({'inline' if inline else 'threaded'})")
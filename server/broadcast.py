@@ -0,0 +1,401 @@
+"""Single producer broadcast of the live JPEG feed
+
+One thread reads the newest frame from a frame source (normally the
+recorder's live frame ring, see camerasrc.py), opened on the first client and
+closed again once idle. Every connected /video_feed client then just picks up
+the latest frame. A client
+that falls behind simply skips to the newest frame, so it never holds up the
+producer or any other client.
+
+Clients can ask for a smaller width, lower JPEG quality and lower fps. Each
+distinct (width, quality) rendition is encoded at most once per frame and
+shared between every client that wants it. Clients that drain their socket
+slowly are stepped down the rendition ladder and fps automatically, and back
+up again once they keep up.
+
+Clients are either generators iterated by a WSGI server thread
+(`client_stream()`), or async generators on an event loop
+(`async_client_stream()`, see asgi.py), which the producer wakes through a
+callback instead of the condition variable.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import camerasrc
+
+# how long the producer keeps running with no clients before it parks itself
+BROADCAST_IDLE_STOP_SECONDS = 5
+BROADCAST_POLL_SECONDS = 0.01
+BROADCAST_STALE_SECONDS = 10
+# after the frame source fails to open or read, wait this long before the next
+# try, doubling with each further failure up to the max
+BROADCAST_RETRY_SECONDS = 1.0
+BROADCAST_RETRY_MAX_SECONDS = 60.0
+
+# -- renditions, requested values are snapped onto these so clients share encodes
+RENDITION_WIDTHS = (640, 480, 320, 160)
+RENDITION_QUALITIES = (90, 75, 60, 45, 30)
+DEFAULT_WIDTH = 640
+DEFAULT_QUALITY = 75
+DEFAULT_FPS = 15
+MIN_FPS = 1
+MAX_FPS = 30
+
+# -- adaptation: compare how long the last few chunks took to be written out
+# to the client against the frame interval we are trying to hold
+ADAPT_EMA_ALPHA = 0.3
+ADAPT_CONGESTED_RATIO = 0.6
+ADAPT_RECOVERED_RATIO = 0.15
+ADAPT_COOLDOWN_SECONDS = 2.0
+
+
+def _snap(value: int, allowed: tuple[int, ...]) -> int:
+    return min(allowed, key=lambda a: abs(a - value))
+
+
+@dataclass(frozen=True)
+class Rendition:
+    width: int = DEFAULT_WIDTH
+    quality: int = DEFAULT_QUALITY
+
+    @classmethod
+    def snapped(cls, width: int, quality: int) -> "Rendition":
+        return cls(_snap(width, RENDITION_WIDTHS), _snap(quality, RENDITION_QUALITIES))
+
+    def step_down(self) -> "Rendition":
+        """Cheaper rendition, lower the quality first then the resolution"""
+        qi = RENDITION_QUALITIES.index(self.quality)
+        if qi + 1 < len(RENDITION_QUALITIES) and self.quality > 45:
+            return Rendition(self.width, RENDITION_QUALITIES[qi + 1])
+        wi = RENDITION_WIDTHS.index(self.width)
+        if wi + 1 < len(RENDITION_WIDTHS):
+            return Rendition(RENDITION_WIDTHS[wi + 1], self.quality)
+        if qi + 1 < len(RENDITION_QUALITIES):
+            return Rendition(self.width, RENDITION_QUALITIES[qi + 1])
+        return self
+
+    def step_up(self, ceiling: "Rendition") -> "Rendition":
+        """Reverse of `step_down()`, never going past what the client asked for"""
+        if self.width < ceiling.width:
+            wi = RENDITION_WIDTHS.index(self.width)
+            return Rendition(RENDITION_WIDTHS[wi - 1], self.quality)
+        if self.quality < ceiling.quality:
+            qi = RENDITION_QUALITIES.index(self.quality)
+            return Rendition(self.width, RENDITION_QUALITIES[qi - 1])
+        return self
+
+
+class _ClientPacer:
+    """Per client rendition + fps state, adapted from measured send times"""
+
+    def __init__(self, rendition: Rendition, fps: float):
+        self.ceiling = rendition
+        self.max_fps = fps
+        self.rendition = rendition
+        self.fps = fps
+        self.ema_send = 0.0
+        self._last_change = time.monotonic()
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.fps
+
+    def record_send(self, send_secs: float):
+        self.ema_send = ADAPT_EMA_ALPHA * send_secs + (1 - ADAPT_EMA_ALPHA) * self.ema_send
+        now = time.monotonic()
+        if now - self._last_change < ADAPT_COOLDOWN_SECONDS:
+            return
+        if self.ema_send > ADAPT_CONGESTED_RATIO * self.interval:
+            lower = self.rendition.step_down()
+            if lower != self.rendition:
+                self.rendition = lower
+            else:
+                self.fps = max(MIN_FPS, self.fps / 1.5)
+            self._last_change = now
+            logging.debug(f"`_ClientPacer`: congested, stepped down to {self.rendition} at {self.fps:.1f}fps")
+        elif self.ema_send < ADAPT_RECOVERED_RATIO * self.interval:
+            # recover fps first, it is the cheapest thing to give back
+            if self.fps < self.max_fps:
+                self.fps = min(self.max_fps, self.fps * 1.5)
+            elif self.rendition != self.ceiling:
+                self.rendition = self.rendition.step_up(self.ceiling)
+            else:
+                return
+            self._last_change = now
+            logging.debug(f"`_ClientPacer`: recovered, stepped up to {self.rendition} at {self.fps:.1f}fps")
+
+
+class FrameBroadcaster:
+    def __init__(self, open_source: Callable | None = None):
+        """`open_source()` returns a new frame source, see camerasrc.py"""
+        self.open_source = open_source or camerasrc.source_opener(camerasrc.DEFAULT_CAMERA_BACKEND)
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._frame = None
+        self._n_clients = 0
+        self._last_client_time = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        # failures since frames last flowed, the producer backs off until _retry_at
+        self._failures = 0
+        self._retry_at = 0.0
+        # rendition -> (seq, jpeg bytes), plus a lock per rendition so clients
+        # sharing settings wait on one encode instead of each doing their own
+        self._encoded: dict[Rendition, tuple[int, bytes]] = {}
+        self._encode_locks: dict[Rendition, threading.Lock] = {}
+        # called from the producer thread after every new frame
+        self._listeners: set[Callable[[], None]] = set()
+
+    # -- producer side
+
+    def _ensure_running(self):
+        # called with self._cond held
+        if time.monotonic() < self._retry_at:
+            return  # backing off from a frame source that failed
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._produce, name="FrameBroadcaster", daemon=True
+            )
+            self._thread.start()
+            logging.info("`FrameBroadcaster`: producer thread started")
+
+    def _producer_failed(self, what: str):
+        # called from the producer thread, with self._cond held. Logged once,
+        # until frames flow again
+        self._thread = None
+        self._failures += 1
+        retry_secs = min(BROADCAST_RETRY_MAX_SECONDS, BROADCAST_RETRY_SECONDS * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + retry_secs
+        if self._failures == 1:
+            logging.critical(f"`FrameBroadcaster`: {what}, retrying", exc_info=True)
+        else:
+            logging.debug(f"`FrameBroadcaster`: {what}, retrying in {retry_secs:.0f}s")
+
+    def _produce(self):
+        try:
+            reader = self.open_source()
+        except:
+            with self._cond:
+                self._producer_failed("unable to open frame source")
+            return
+        last_seq = 0
+        last_frame_time = time.monotonic()
+        stale_warned = False
+        try:
+            while not self._stop.is_set():
+                with self._cond:
+                    if (
+                        self._n_clients == 0
+                        and time.monotonic() - self._last_client_time > BROADCAST_IDLE_STOP_SECONDS
+                    ):
+                        self._thread = None
+                        self._encoded.clear()
+                        logging.info("`FrameBroadcaster`: no clients, frame source released")
+                        return
+
+                latest = reader.read_latest(after_seq=last_seq)
+                if latest is None:
+                    if not stale_warned and time.monotonic() - last_frame_time > BROADCAST_STALE_SECONDS:
+                        logging.warning("No live frames recently, is the recorder (or camera) running?")
+                        stale_warned = True
+                    time.sleep(BROADCAST_POLL_SECONDS)
+                    continue
+                last_seq, _, frame = latest
+                last_frame_time = time.monotonic()
+                stale_warned = False
+
+                with self._cond:
+                    if self._failures:
+                        logging.info(f"`FrameBroadcaster`: frames flowing again after {self._failures} failed attempts")
+                        self._failures = 0
+                    self._seq += 1
+                    self._frame = frame
+                    self._cond.notify_all()
+                    listeners = list(self._listeners)
+                for listener in listeners:
+                    listener()
+        except:
+            with self._cond:
+                self._producer_failed("exception caught in producer")
+        finally:
+            reader.close()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    # -- client side
+
+    def wait_for_frame(self, after_seq: int, timeout: float = 1.0):
+        """Block until a frame newer than `after_seq` is available and return
+        (seq, frame) for the NEWEST one, or None on timeout
+        """
+        with self._cond:
+            self._ensure_running()
+            if self._cond.wait_for(lambda: self._seq != after_seq or self._stop.is_set(), timeout):
+                if self._seq != after_seq:
+                    return self._seq, self._frame
+            return None
+
+    def encoded_if_cached(self, seq: int, rendition: Rendition) -> bytes | None:
+        """The shared JPEG if some client already had it encoded, without
+        waiting on any encode
+        """
+        cached = self._encoded.get(rendition)
+        return cached[1] if cached and cached[0] >= seq else None
+
+    def encoded(self, seq: int, frame, rendition: Rendition) -> bytes | None:
+        """JPEG for `frame` in `rendition`, encoded once and shared between
+        every client asking for the same rendition of the same frame
+        """
+        with self._cond:
+            lock = self._encode_locks.setdefault(rendition, threading.Lock())
+        import cv2  # only once someone watches, keeps server start up fast
+
+        with lock:
+            cached = self._encoded.get(rendition)
+            if cached and cached[0] >= seq:
+                return cached[1]
+            height, width = frame.shape[:2]
+            if rendition.width < width:
+                size = (rendition.width, round(height * rendition.width / width))
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, rendition.quality])
+            if not ret:
+                logging.warning(f"`FrameBroadcaster`: issue encoding live frame for {rendition}")
+                return None
+            jpeg = buffer.tobytes()
+            self._encoded[rendition] = (seq, jpeg)
+            return jpeg
+
+    def _attach(self, width: int, quality: int, fps: float, listener: Callable | None = None) -> _ClientPacer:
+        pacer = _ClientPacer(
+            Rendition.snapped(width, quality), min(MAX_FPS, max(MIN_FPS, fps))
+        )
+        with self._cond:
+            self._n_clients += 1
+            if listener:
+                self._listeners.add(listener)
+        logging.info(
+            f"`FrameBroadcaster`: client connected wanting {pacer.rendition} at {pacer.fps}fps, {self._n_clients} watching"
+        )
+        return pacer
+
+    def _detach(self, listener: Callable | None = None):
+        with self._cond:
+            self._n_clients -= 1
+            self._last_client_time = time.monotonic()
+            self._listeners.discard(listener)
+        logging.info(f"`FrameBroadcaster`: client disconnected, {self._n_clients} watching")
+
+    @staticmethod
+    def _chunk(jpeg: bytes) -> bytes:
+        return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+
+    def client_stream(
+        self,
+        *,
+        width: int = DEFAULT_WIDTH,
+        quality: int = DEFAULT_QUALITY,
+        fps: float = DEFAULT_FPS,
+    ):
+        """Generator of multipart MJPEG chunks for one client, registers the
+        client for as long as it is being iterated
+        """
+        pacer = self._attach(width, quality, fps)
+        cursor = 0
+        next_frame_time = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                wait_secs = next_frame_time - time.monotonic()
+                if wait_secs > 0:
+                    time.sleep(wait_secs)
+                latest = self.wait_for_frame(cursor)
+                if latest is None:
+                    continue
+                cursor, frame = latest
+                jpeg = self.encoded(cursor, frame, pacer.rendition)
+                if jpeg is None:
+                    continue
+                next_frame_time = time.monotonic() + pacer.interval
+                # the WSGI server writes the chunk out before resuming us, so
+                # the time spent suspended here is how long the client took to
+                # drain it
+                send_start = time.monotonic()
+                yield self._chunk(jpeg)
+                pacer.record_send(time.monotonic() - send_start)
+        finally:
+            self._detach()
+
+    async def async_client_stream(
+        self,
+        *,
+        width: int = DEFAULT_WIDTH,
+        quality: int = DEFAULT_QUALITY,
+        fps: float = DEFAULT_FPS,
+    ):
+        """`client_stream()` for an event loop: waiting for frames costs no
+        thread, encodes run in the loop's default executor (and are still
+        shared). The caller awaits sending each chunk before asking for the
+        next, which is what the pacing measures
+        """
+        loop = asyncio.get_running_loop()
+        new_frame = asyncio.Event()
+        waiting = False
+
+        def wake():
+            # clients slower than the camera rarely wait, and then cost no wake up
+            if waiting:
+                try:
+                    loop.call_soon_threadsafe(new_frame.set)
+                except RuntimeError:
+                    pass  # loop closed under a client that has not detached yet
+
+        pacer = self._attach(width, quality, fps, wake)
+        cursor = 0
+        next_frame_time = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                wait_secs = next_frame_time - time.monotonic()
+                if wait_secs > 0:
+                    await asyncio.sleep(wait_secs)
+                # set before looking, so a frame arriving in between still wakes us
+                new_frame.clear()
+                waiting = True
+                with self._cond:
+                    self._ensure_running()
+                    seq, frame = self._seq, self._frame
+                if seq == cursor:
+                    timeout = loop.call_later(1.0, new_frame.set)
+                    try:
+                        await new_frame.wait()
+                    finally:
+                        timeout.cancel()
+                        waiting = False
+                    continue
+                waiting = False
+                cursor = seq
+                # most clients find their rendition already encoded, only the
+                # first one for each frame hops to a thread
+                jpeg = self.encoded_if_cached(cursor, pacer.rendition) or await asyncio.to_thread(
+                    self.encoded, cursor, frame, pacer.rendition
+                )
+                if jpeg is None:
+                    continue
+                # timers on a busy loop fire late, so keep to the schedule
+                # instead of restarting it from now (without bursting to catch up)
+                now = time.monotonic()
+                next_frame_time = max(next_frame_time + pacer.interval, now)
+                send_start = time.monotonic()
+                yield self._chunk(jpeg)
+                pacer.record_send(time.monotonic() - send_start)
+        finally:
+            self._detach(wake)
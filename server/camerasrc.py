@@ -0,0 +1,117 @@
+"""Where the live feed's frames come from, picked by name and only opened once
+someone is actually watching (the broadcaster closes it again when idle)
+
+    - "ring":      the recorder's shared memory frame ring, the normal setup,
+                   the recorder keeps the camera and we only read its frames
+    - "picamera2": drive the camera directly, for when the recorder is not
+                   running. Picamera2 / libcamera are imported on open only
+    - "synthetic": generated test frames, for development off the Pi and for
+                   benchmarking the broadcast path without hardware
+
+Every source has `read_latest(after_seq)` -> (seq, unix time, BGR frame) or
+None, like `livefeed.FrameRingReader`, and `close()`. Nothing here imports
+numpy, cv2 or camera libraries until a source is opened, so the web server
+starts fast and runs anywhere.
+"""
+
+import logging
+import time
+from typing import Callable
+
+CAMERA_BACKENDS = ("ring", "picamera2", "synthetic")
+DEFAULT_CAMERA_BACKEND = "ring"
+PICAMERA2_LIVE_SIZE = (640, 480)
+SYNTHETIC_SIZE = (640, 480)
+SYNTHETIC_FPS = 15
+
+
+class _RingSource:
+    def __init__(self):
+        import livefeed
+
+        self._reader = livefeed.FrameRingReader(livefeed.LIVE_FRAME_RING_PATH)
+
+    def read_latest(self, after_seq: int = 0):
+        return self._reader.read_latest(after_seq=after_seq)
+
+    def close(self):
+        self._reader.close()
+
+
+class _Picamera2Source:
+    def __init__(self):
+        from picamera2 import Picamera2  # type: ignore
+
+        self._picam2 = Picamera2()
+        self._picam2.configure(
+            self._picam2.create_video_configuration(main={"size": PICAMERA2_LIVE_SIZE, "format": "BGR888"})
+        )
+        self._picam2.start()
+        self._seq = 0
+        logging.info("`_Picamera2Source`: camera opened for the live feed")
+
+    def read_latest(self, after_seq: int = 0):
+        # blocks until the next frame, so this paces itself at the camera fps
+        frame = self._picam2.capture_array("main")
+        self._seq += 1
+        return self._seq, time.time(), frame
+
+    def close(self):
+        self._picam2.stop()
+        self._picam2.close()
+        logging.info("`_Picamera2Source`: camera released")
+
+
+class _SyntheticSource:
+    """Moving gradient + clock, so frames differ every time like real video"""
+
+    def __init__(self, size: tuple[int, int] = SYNTHETIC_SIZE, fps: float = SYNTHETIC_FPS):
+        import numpy as np
+
+        self._np = np
+        self.width, self.height = size
+        self.interval = 1.0 / fps
+        self._seq = 0
+        self._next_time = time.monotonic()
+        x = np.linspace(0, 255, self.width, dtype=np.float32)
+        y = np.linspace(0, 255, self.height, dtype=np.float32)
+        self._base = (x[None, :] + y[:, None]) / 2
+
+    def read_latest(self, after_seq: int = 0):
+        now = time.monotonic()
+        if now < self._next_time:
+            time.sleep(min(self._next_time - now, 0.05))
+            return None
+        self._next_time = max(self._next_time + self.interval, now)
+        self._seq += 1
+        np = self._np
+        shift = (self._seq * 4) % 256
+        channel = ((self._base + shift) % 256).astype(np.uint8)
+        frame = np.dstack((channel, 255 - channel, np.roll(channel, self._seq * 8, axis=1)))
+        import cv2
+
+        cv2.putText(
+            frame, time.strftime("%H:%M:%S") + f" #{self._seq}", (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2,
+        )
+        return self._seq, time.time(), frame
+
+    def close(self):
+        pass
+
+
+_BACKENDS: dict[str, Callable] = {
+    "ring": _RingSource,
+    "picamera2": _Picamera2Source,
+    "synthetic": _SyntheticSource,
+}
+
+
+def source_opener(name: str) -> Callable:
+    """Factory for the named backend, raises ValueError for unknown names.
+    Calling it opens the source
+    """
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown camera backend {name!r}, choose from {CAMERA_BACKENDS}") from None
@@ -0,0 +1,77 @@
+"""HTTP validators and compression, so repeat visits cost neither rebuilding
+responses nor reading from the USB drive
+
+    - index backed pages (/playlist, /browse) are validated against the media
+      index version: an unchanged index answers 304 before any work is done
+    - finished segments never change, so they are cached as immutable
+    - text responses are gzipped when the client accepts it
+"""
+
+import functools
+import gzip
+from datetime import datetime, timezone
+
+from flask import Response, request
+
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+GZIP_MIMETYPES = {
+    "application/json",
+    "text/html",
+    "application/vnd.apple.mpegurl",
+    "text/vtt",
+}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def validated_by(get_validators):
+    """Decorator for views whose output only depends on the request and some
+    versioned state. `get_validators()` returns (etag, last modified unix
+    time) for that state, matching requests get a 304 without calling the view
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag, changed_at = get_validators()
+            last_modified = datetime.fromtimestamp(int(changed_at), tz=timezone.utc)
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                fresh = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+            if fresh:
+                response = Response(status=304)
+            else:
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response):
+                    response = Response(response)
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            # may be reused, but only once revalidated
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def gzip_response(response: Response) -> Response:
+    """`after_request` hook, compresses buffered text responses in place"""
+    if response.mimetype not in GZIP_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or "gzip" not in request.accept_encodings
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
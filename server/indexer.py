@@ -0,0 +1,634 @@
+"""In memory index of the recordings directory, kept up to date in the
+background so requests never list, sort or probe the drive themselves
+
+The directory is scanned once at startup, after that only deltas are applied:
+    - inotify events for the videos directory (via ctypes, no extra deps),
+      mp4s appear on IN_CLOSE_WRITE/IN_MOVED_TO and go on IN_DELETE/IN_MOVED_FROM
+    - the segments manifest is tailed from the last offset read whenever it
+      is written to
+If inotify is unavailable (or forced off) the directory is polled instead.
+Either way a slow full resync runs now and then to catch anything missed.
+
+Archives in the partitioned layout (see timestamping/layout.py) are watched
+recursively, new partition directories are watched as they are created. Should
+that run out of inotify watches, polling takes over, only listing the current
+hour directories (deletions elsewhere then wait for the next full resync).
+"""
+
+import bisect
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import mediaindex
+import timestamping
+from timestamping.utils import TIMESTAMP_FMT
+
+INDEX_POLL_SECONDS = 10
+INDEX_FULL_RESYNC_SECONDS = 30 * 60
+# give the recorder a moment to append the manifest record of a freshly closed
+# mp4 before falling back to describing it ourselves
+INDEX_MANIFEST_GRACE_SECONDS = 5
+MANIFEST_COMPACT_STALE_RECORDS = 500
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+_INOTIFY_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE | _IN_CREATE
+
+# fields of each segments manifest record handed to the player
+PLAYLIST_FIELDS = ("filename", "start", "duration_seconds", "camera_name")
+
+
+class _Inotify:
+    def __init__(self, root: str):
+        self.root = root
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: dict[int, str] = {}  # watch descriptor -> dir relative to root
+        try:
+            self.add_watch("")
+        except:
+            os.close(self.fd)
+            raise
+
+    def add_watch(self, reldir: str):
+        path = os.path.join(self.root, reldir)
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _INOTIFY_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {path}: {os.strerror(errno)}")
+        self._dirs[wd] = reldir
+
+    def read_events(self, timeout: float) -> list[tuple[int, str, str]] | None:
+        """(mask, dir relative to root, name) triples, or None if the kernel
+        queue overflowed
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + _INOTIFY_EVENT.size <= len(buf):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(buf, pos)
+            pos += _INOTIFY_EVENT.size
+            name = buf[pos : pos + name_len].rstrip(b"\0").decode(errors="replace")
+            pos += name_len
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if mask & _IN_IGNORED:  # the directory went away
+                self._dirs.pop(wd, None)
+            elif wd in self._dirs:
+                events.append((mask, self._dirs[wd], name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class MediaIndexer:
+    def __init__(
+        self,
+        videos_dir: str,
+        describe: Callable[[list[str]], dict[str, dict | None]],
+        *,
+        use_inotify: bool = True,
+        on_published: Callable[[str], None] | None = None,
+        on_removed: Callable[[str], None] | None = None,
+        snapshot_path: str | None = None,
+    ):
+        """`describe(filenames)` is the fallback for mp4s without a manifest
+        record, returning a playlist entry (or None to exclude) for each.
+        `on_published(filename)` is called for every segment the recorder
+        publishes while we are running (not for those found at startup),
+        `on_removed(filename)` for every segment that is deleted (or moved
+        away, before it is found again where it went).
+        `snapshot_path` is where the index is saved (a timestamping segment
+        index) after every full resync. On start up it is loaded first and
+        served straight away, the initial scan then brings it up to date
+        """
+        self.videos_dir = videos_dir
+        self.describe = describe
+        self.use_inotify = use_inotify
+        self.on_published = on_published
+        self.on_removed = on_removed
+        self.snapshot_path = snapshot_path
+        self.layout = timestamping.read_layout(videos_dir)
+        self._inotify = None
+        self._lock = threading.Lock()
+        self._filenames: list[str] = []  # kept sorted
+        self._entries: dict[str, dict | None] = {}
+        self._dirs: dict[str, str] = {}  # filename -> dir relative to videos_dir
+        self._manifest: dict[str, dict] = {}
+        self._manifest_offset = 0
+        self._manifest_inode = None
+        self._pending: dict[str, float] = {}  # filename -> time seen
+        self._entries_snapshot = None
+        self._thread = None
+        self._started = threading.Event()
+        self._scanned = False  # initial scan done, so segments found are newly published
+        self._stop = threading.Event()
+        self.version = 0
+        self.changed_at = time.time()
+        # versions restart with the process, so tag them with when it started
+        self._generation = f"{time.time_ns():x}"
+
+    # -- queries, served straight from memory
+
+    def start(self):
+        """Kick off the initial scan in the background without waiting for it"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="MediaIndexer", daemon=True)
+                self._thread.start()
+
+    def ensure_started(self):
+        self.start()
+        self._started.wait()
+
+    @property
+    def ready(self) -> bool:
+        """Whether queries will not block: the snapshot is loaded or the
+        initial scan is done
+        """
+        return self._started.is_set()
+
+    def filenames(
+        self,
+        *,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        camera: str | None = None,
+    ) -> list[str]:
+        """Filenames starting in [start, end), optionally for one camera"""
+        self.ensure_started()
+        with self._lock:
+            lo, hi = self._bounds(start, end)
+            filenames = self._filenames[lo:hi]
+        if camera:
+            parsed = timestamping.parse_filenames(filenames)
+            if camera not in parsed.cameras:
+                return []
+            camera_id = parsed.cameras.index(camera)
+            filenames = [f for f, c in zip(filenames, parsed.camera_ids) if c == camera_id]
+        return filenames
+
+    def window(
+        self,
+        *,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        camera: str | None = None,
+        limit: int | None = None,
+        cursor: str | None = None,
+        max_segment_seconds: float = 0,
+    ) -> tuple[list[dict], str | None]:
+        """Playlist entries overlapping [start, end) in filename order, at most
+        `limit` of them, and the cursor to pass back for the next page (None
+        on the last page). Filenames begin with a fixed width timestamp, so
+        sorted filenames are sorted by time and the range is two bisections.
+        Segments may start up to `max_segment_seconds` before `start` and
+        still overlap it.
+        """
+        self.ensure_started()
+        lookbehind_start = start - timedelta(seconds=max_segment_seconds) if start else None
+        start_key = start.strftime(TIMESTAMP_FMT) if start else None
+        page = []
+        next_cursor = None
+        with self._lock:
+            lo, hi = self._bounds(lookbehind_start, end)
+            if cursor:
+                lo = max(lo, bisect.bisect_right(self._filenames, cursor))
+            for i in range(lo, hi):
+                filename = self._filenames[i]
+                entry = self._entries.get(filename)
+                if not entry or (camera and entry["camera_name"] != camera):
+                    continue
+                if start_key and filename < start_key:
+                    dt, _ = timestamping.parse_filename(filename)
+                    if dt + timedelta(seconds=entry["duration_seconds"]) <= start:
+                        continue
+                if limit is not None and len(page) == limit:
+                    next_cursor = page[-1]["filename"]
+                    break
+                page.append(entry)
+        return page, next_cursor
+
+    def days(self) -> list[str]:
+        """Distinct recording days as "YYYYMMDD", hopping over each day's
+        files with a bisection rather than visiting every filename
+        """
+        self.ensure_started()
+        days = []
+        with self._lock:
+            i = 0
+            while i < len(self._filenames):
+                day = self._filenames[i][:8]
+                if day.isdigit():
+                    days.append(day)
+                i = bisect.bisect_left(self._filenames, day + "~", i)  # "~" sorts after the rest of the name
+        return days
+
+    def entries(self) -> list[dict]:
+        """Playlist entries for every playable mp4, in filename order. The list
+        is rebuilt at most once per index change and shared between requests,
+        callers must not mutate it
+        """
+        self.ensure_started()
+        with self._lock:
+            if self._entries_snapshot is None:
+                self._entries_snapshot = [
+                    e for f in self._filenames if (e := self._entries.get(f))
+                ]
+            return self._entries_snapshot
+
+    def validators(self) -> tuple[str, float]:
+        """(etag, unix time of last change) for responses built from the index"""
+        self.ensure_started()
+        with self._lock:
+            return f"{self._generation}-{self.version}", self.changed_at
+
+    def entry(self, filename: str) -> dict | None:
+        """Playlist entry of one segment, None if unknown or not playable"""
+        with self._lock:
+            return self._entries.get(filename)
+
+    def duration(self, filename: str) -> float | None:
+        entry = self.entry(filename)
+        return entry["duration_seconds"] if entry else None
+
+    def path(self, filename: str) -> str:
+        """Where a segment is on disk: where it was found, or for one not
+        indexed (yet) where the archive's layout puts it
+        """
+        with self._lock:
+            reldir = self._dirs.get(filename)
+        if reldir is None:
+            reldir = timestamping.relative_dir(filename, self.layout) or ""
+        return os.path.join(self.videos_dir, reldir, filename)
+
+    def has_manifest_record(self, filename: str) -> bool:
+        """The recorder only writes a record once the file is complete"""
+        with self._lock:
+            return filename in self._manifest
+
+    def stop(self):
+        self._stop.set()
+
+    def _bounds(self, start: datetime | None, end: datetime | None) -> tuple[int, int]:
+        # called with self._lock held
+        lo = bisect.bisect_left(self._filenames, start.strftime(TIMESTAMP_FMT)) if start else 0
+        hi = bisect.bisect_left(self._filenames, end.strftime(TIMESTAMP_FMT)) if end else len(self._filenames)
+        return lo, hi
+
+    # -- maintenance, all on the background thread
+
+    def _changed(self):
+        # called with self._lock held
+        self.version += 1
+        self.changed_at = time.time()
+        self._entries_snapshot = None
+
+    def _add(self, filename: str, reldir: str = ""):
+        with self._lock:
+            if filename in self._entries and self._dirs[filename] != reldir:
+                self._dirs[filename] = reldir
+                return  # only moved, e.g. by a layout migration
+            self._dirs[filename] = reldir
+            if filename not in self._entries:
+                bisect.insort(self._filenames, filename)
+            record = self._manifest.get(filename)
+            if record:
+                self._entries[filename] = self._entry_from_record(record)
+            else:
+                self._entries.setdefault(filename, None)
+                self._pending[filename] = time.monotonic()
+            self._changed()
+
+    def _remove(self, filename: str, reldir: str | None = None):
+        """Drops `filename`, if given only if it was last seen in `reldir` (it
+        may just have moved somewhere else)
+        """
+        with self._lock:
+            if filename not in self._entries or reldir not in (None, self._dirs[filename]):
+                return
+            del self._entries[filename]
+            del self._dirs[filename]
+            del self._filenames[bisect.bisect_left(self._filenames, filename)]
+            self._pending.pop(filename, None)
+            self._changed()
+        if self.on_removed:
+            try:
+                self.on_removed(filename)
+            except:
+                logging.error(f"`MediaIndexer`: `on_removed` FAILED for {filename}", exc_info=True)
+
+    @staticmethod
+    def _entry_from_record(record: dict) -> dict | None:
+        if record.get("duration_seconds", 0) > 0:
+            return {key: record[key] for key in PLAYLIST_FIELDS}
+        return None
+
+    def _tail_manifest(self):
+        records, self._manifest_offset, self._manifest_inode = mediaindex.read_manifest_since(
+            self.videos_dir, self._manifest_offset, self._manifest_inode
+        )
+        if not records:
+            return
+        with self._lock:
+            # a segment re-encoded by diskmanage/tiering.py gets a new record,
+            # but it is not newly published
+            first_records = records.keys() - self._manifest.keys()
+            self._manifest.update(records)
+            for filename, record in records.items():
+                if filename in self._entries:
+                    self._entries[filename] = self._entry_from_record(record)
+                    self._pending.pop(filename, None)
+            self._changed()
+        if self.on_published and self._scanned:
+            for filename, record in records.items():
+                if filename in first_records and self._entry_from_record(record):
+                    try:
+                        self.on_published(filename)
+                    except:
+                        logging.error(f"`MediaIndexer`: `on_published` FAILED for {filename}", exc_info=True)
+
+    def _describe_pending(self, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                f for f, seen in self._pending.items()
+                if force or now - seen > INDEX_MANIFEST_GRACE_SECONDS
+            ]
+        if not due:
+            return
+        try:
+            described = self.describe(due)
+        except:
+            logging.error("`MediaIndexer`: describing new files FAILED", exc_info=True)
+            return
+        with self._lock:
+            for filename in due:
+                if filename in self._entries and filename not in self._manifest:
+                    self._entries[filename] = described.get(filename)
+                self._pending.pop(filename, None)
+            self._changed()
+
+    def _full_resync(self):
+        """Start up scan, also run now and then (and after an inotify overflow)
+        in case an event was missed
+        """
+        on_disk = {f: reldir for reldir, f in timestamping.iter_segments(self.videos_dir, self.layout)}
+        self._tail_manifest()
+        with self._lock:
+            known = dict(self._dirs)
+        for filename in known.keys() - on_disk.keys():
+            self._remove(filename)
+        for filename, reldir in sorted(on_disk.items()):
+            if known.get(filename) != reldir:
+                self._add(filename, reldir)
+        # nothing to wait for on files that were already there
+        self._describe_pending(force=True)
+        self._scanned = True
+        logging.info(f"`MediaIndexer`: full resync complete, {len(on_disk)} mp4 files indexed")
+        self._save_snapshot()
+
+        n_stale_records = len(self._manifest.keys() - on_disk.keys())
+        if n_stale_records > MANIFEST_COMPACT_STALE_RECORDS:
+            dropped_names = set()
+
+            def keep(filename: str) -> bool:
+                # checked again with the manifest locked: a segment published
+                # since the scan above is on disk by the time its record is
+                if filename in on_disk:
+                    return True
+                # where the layout puts it, or loose at the root
+                reldir = timestamping.relative_dir(filename, self.layout) or ""
+                if os.path.exists(os.path.join(self.videos_dir, reldir, filename)) or os.path.exists(
+                    os.path.join(self.videos_dir, filename)
+                ):
+                    return True
+                dropped_names.add(filename)
+                return False
+
+            try:
+                dropped = mediaindex.compact_manifest(self.videos_dir, keep)
+                logging.info(f"Segments manifest compacted, {dropped} stale records dropped")
+                with self._lock:
+                    self._manifest = {f: r for f, r in self._manifest.items() if f not in dropped_names}
+            except:
+                logging.error("Issue compacting segments manifest", exc_info=True)
+
+    def _load_snapshot(self):
+        """Fills the (still empty) index from the snapshot, if there is one"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            index = timestamping.SegmentIndex(self.snapshot_path)
+        except ValueError:
+            logging.warning(f"`MediaIndexer`: {self.snapshot_path} is unreadable, ignored", exc_info=True)
+            return
+        try:
+            with self._lock:
+                for i in range(len(index)):
+                    filename = index.filename(i)
+                    self._entries[filename] = {
+                        "filename": filename,
+                        "start": timestamping.dt_strfmt(timestamping.epoch_to_dt(index.starts[i])),
+                        "duration_seconds": float(index.durations[i]),
+                        "camera_name": index.cameras[index.camera_ids[i]],
+                    }
+                    self._dirs[filename] = timestamping.relative_dir(filename, self.layout) or ""
+                self._filenames = sorted(self._entries)
+                self._changed()
+        finally:
+            index.close()
+        logging.info(f"`MediaIndexer`: {len(self._filenames)} segments loaded from snapshot")
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            entries = [e for f in self._filenames if (e := self._entries.get(f))]
+            sizes = {f: r.get("size_bytes") or 0 for f, r in self._manifest.items()}
+        parsed = timestamping.parse_filenames(e["filename"] for e in entries)
+        segments = []
+        for entry, start, camera_id in zip(entries, parsed.epochs, parsed.camera_ids):
+            # only names the snapshot can give back exactly
+            if camera_id < 0 or timestamping.generate_filename(
+                for_time=timestamping.epoch_to_dt(start), camera_name=parsed.cameras[camera_id]
+            ) != entry["filename"]:
+                continue
+            segments.append(timestamping.Segment(
+                start, entry["duration_seconds"], sizes.get(entry["filename"], 0), parsed.cameras[camera_id]
+            ))
+        try:
+            timestamping.write_segment_index(self.snapshot_path, segments)
+        except:
+            logging.error(f"`MediaIndexer`: unable to save snapshot to {self.snapshot_path}", exc_info=True)
+
+    def _open_inotify(self):
+        """Watches the videos dir, and in the partitioned layout every
+        partition directory under it. Polling takes over if that fails
+        (e.g. out of watches, see /proc/sys/fs/inotify/max_user_watches)
+        """
+        self._close_inotify()
+        if not self.use_inotify:
+            return
+        try:
+            self._inotify = _Inotify(self.videos_dir)
+            if self.layout == timestamping.LAYOUT_PARTITIONED:
+                for camera_name in timestamping.list_cameras(self.videos_dir):
+                    self._watch_tree(camera_name, index_files=False)
+        except:
+            logging.warning("`MediaIndexer`: inotify unavailable, falling back to polling", exc_info=True)
+            self._close_inotify()
+
+    def _close_inotify(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _watch_tree(self, reldir: str, index_files: bool):
+        """Watches `reldir` and every directory under it. With `index_files`
+        (a directory that just appeared) also indexes mp4s already in it,
+        they may have landed before the watch was in place
+        """
+        self._inotify.add_watch(reldir)
+        try:
+            with os.scandir(os.path.join(self.videos_dir, reldir)) as it:
+                found = [(e.name, e.is_dir(follow_symlinks=False)) for e in it]
+        except FileNotFoundError:
+            return
+        for name, is_dir in found:
+            if is_dir:
+                self._watch_tree(os.path.join(reldir, name), index_files)
+            elif index_files and name.endswith(".mp4"):
+                with self._lock:
+                    known = self._dirs.get(name) == reldir
+                if not known:
+                    self._add(name, reldir)
+
+    def _check_layout(self):
+        """Picks up a layout change (a migration starting or finishing)"""
+        layout = timestamping.read_layout(self.videos_dir)
+        if layout == self.layout:
+            return
+        logging.info(f"`MediaIndexer`: videos directory layout changed from {self.layout} to {layout}")
+        self.layout = layout
+        self._open_inotify()
+        self._full_resync()
+
+    def _apply_events(self, events: list[tuple[int, str, str]]):
+        manifest_touched = layout_touched = False
+        for mask, reldir, name in events:
+            if mask & _IN_ISDIR:
+                if (
+                    mask & (_IN_CREATE | _IN_MOVED_TO)
+                    and self.layout == timestamping.LAYOUT_PARTITIONED
+                    and not name.startswith(("_", "."))
+                ):
+                    try:
+                        self._watch_tree(os.path.join(reldir, name), index_files=True)
+                    except OSError:
+                        logging.warning(
+                            "`MediaIndexer`: could not watch new directory, falling back to polling", exc_info=True
+                        )
+                        self._close_inotify()
+            elif reldir == "" and name == mediaindex.MANIFEST_FNAME:
+                manifest_touched = True
+            elif reldir == "" and name == timestamping.LAYOUT_MARKER_FNAME:
+                layout_touched = True
+            elif name.endswith(".mp4"):
+                if mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                    self._add(name, reldir)
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    self._remove(name, reldir)
+        if manifest_touched:
+            self._tail_manifest()
+        if layout_touched:
+            self._check_layout()
+
+    def _list_mp4s(self, reldir: str) -> list[str]:
+        try:
+            return [f for f in os.listdir(os.path.join(self.videos_dir, reldir)) if f.endswith(".mp4")]
+        except FileNotFoundError:
+            return []
+
+    def _poll_once(self):
+        self._check_layout()
+        scanned = [""]
+        if self.layout == timestamping.LAYOUT_PARTITIONED:
+            # only where the recorder is writing, the full resync sees the rest
+            now = datetime.now()
+            scanned += timestamping.partition_dirs(self.videos_dir, now - timedelta(hours=1), now + timedelta(minutes=1))
+        on_disk = {f: reldir for reldir in scanned for f in self._list_mp4s(reldir)}
+        scanned = set(scanned)
+        with self._lock:
+            known = {f: reldir for f, reldir in self._dirs.items() if reldir in scanned}
+        for filename in known.keys() - on_disk.keys():
+            self._remove(filename, known[filename])
+        for filename, reldir in sorted(on_disk.items()):
+            if known.get(filename) != reldir:
+                self._add(filename, reldir)
+        self._tail_manifest()
+
+    def _run(self):
+        try:
+            try:
+                self._load_snapshot()
+            except:
+                logging.error("`MediaIndexer`: loading snapshot FAILED", exc_info=True)
+            if self._filenames:
+                self._started.set()  # serve the snapshot while the initial scan runs
+            self._open_inotify()
+            try:
+                self._full_resync()
+            except:
+                logging.critical("`MediaIndexer`: initial scan FAILED", exc_info=True)
+            finally:
+                self._started.set()
+
+            last_resync = time.monotonic()
+            while not self._stop.is_set():
+                try:
+                    if self._inotify:
+                        events = self._inotify.read_events(timeout=1.0)
+                        if events is None:
+                            logging.warning("`MediaIndexer`: inotify queue overflowed, resyncing")
+                            self._full_resync()
+                        else:
+                            self._apply_events(events)
+                    else:
+                        self._stop.wait(INDEX_POLL_SECONDS)
+                        self._poll_once()
+                    self._describe_pending()
+                    if time.monotonic() - last_resync > INDEX_FULL_RESYNC_SECONDS:
+                        self._full_resync()
+                        last_resync = time.monotonic()
+                except:
+                    logging.error("`MediaIndexer`: exception caught in index loop", exc_info=True)
+                    self._stop.wait(INDEX_POLL_SECONDS)
+        finally:
+            self._close_inotify()
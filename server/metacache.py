@@ -0,0 +1,174 @@
+"""Process wide cache of probed video durations, safe to hit from many request
+threads at once
+
+    - single flight: concurrent lookups of the same uncached file share one
+      probe instead of each running their own
+    - failures are cached with a retry time that backs off, instead of being
+      given up on permanently
+    - persistence is debounced and incremental: changed entries are appended
+      to a JSON lines journal a few seconds after the first unsaved change
+      (not pushed back by further ones, so a steady stream of probes still
+      gets written out), and the journal is compacted (write temp file, fsync, rename) once it has grown
+      well past the number of live entries, so a crash never leaves a
+      half written cache behind
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+METADATA_SAVE_DELAY_SECONDS = 5
+METADATA_RETRY_SECONDS = 10 * 60  # doubles with every further failure
+METADATA_MAX_RETRY_SECONDS = 24 * 60 * 60
+METADATA_COMPACT_RATIO = 2
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        path: str,
+        probe: Callable[[str], float],
+        *,
+        legacy_path: str | None = None,
+    ):
+        """`legacy_path` is the old whole-file JSON durations cache, imported
+        once if the journal does not exist yet
+        """
+        self.path = path
+        self.probe = probe
+        self._lock = threading.Lock()
+        # fname -> {"duration": float} or {"failures": int, "retry_at": float}
+        self._entries: dict[str, dict] = {}
+        self._in_flight: dict[str, Future] = {}
+        self._dirty: set[str] = set()
+        self._journal_lines = 0
+        self._save_timer = None
+        self._load(legacy_path)
+
+    # -- lookups
+
+    def get_duration(self, fpath: str) -> float | None:
+        """Duration in seconds, or None if the file cannot be probed (right now)"""
+        fname = os.path.basename(fpath)
+        with self._lock:
+            entry = self._entries.get(fname)
+            if entry:
+                if "duration" in entry:
+                    return entry["duration"]
+                if time.time() < entry["retry_at"]:
+                    return None
+            future = self._in_flight.get(fname)
+            owner = future is None
+            if owner:
+                future = self._in_flight[fname] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            duration = self.probe(fpath)
+            if duration <= 0:
+                raise ValueError(f"non positive duration {duration}")
+            result = {"duration": duration}
+        except:
+            failures = (entry or {}).get("failures", 0) + 1
+            retry_secs = min(METADATA_RETRY_SECONDS * 2 ** (failures - 1), METADATA_MAX_RETRY_SECONDS)
+            result = {"failures": failures, "retry_at": time.time() + retry_secs}
+            logging.warning(
+                f"{fpath} duration probe failed {failures} time(s), retrying in {retry_secs}s", exc_info=True
+            )
+        with self._lock:
+            self._entries[fname] = result
+            self._dirty.add(fname)
+            del self._in_flight[fname]
+            self._schedule_save()
+        duration = result.get("duration")
+        future.set_result(duration)
+        return duration
+
+    def forget(self, fname: str):
+        """Drops the entry of a deleted file, called by the media index"""
+        with self._lock:
+            if self._entries.pop(fname, None) is not None:
+                self._dirty.add(fname)
+                self._schedule_save()
+
+    # -- persistence
+
+    def _load(self, legacy_path: str | None):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        fname, entry = json.loads(line)
+                    except ValueError:
+                        logging.warning("Skipping malformed metadata cache line")
+                        continue
+                    self._journal_lines += 1
+                    if entry is None:
+                        self._entries.pop(fname, None)
+                    else:
+                        self._entries[fname] = entry
+            logging.debug(f"Metadata cache loaded with {len(self._entries)} entries")
+        elif legacy_path and os.path.exists(legacy_path):
+            with open(legacy_path, "r") as f:
+                legacy = json.load(f)
+            for fname, duration in legacy.items():
+                # -1 / 0 were the old "errored" codes, let those be retried
+                if duration > 0:
+                    self._entries[fname] = {"duration": duration}
+            logging.info(f"Imported {len(self._entries)} durations from legacy cache {legacy_path}")
+            self._compact()
+        else:
+            logging.warning("Metadata cache not found")
+
+    def _schedule_save(self):
+        # called with self._lock held. Started by the first unsaved change
+        # and not restarted by later ones, so saves are never put off for long
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(METADATA_SAVE_DELAY_SECONDS, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        """Write out pending changes now, also called on shutdown"""
+        with self._lock:
+            self._save_timer = None
+            if not self._dirty:
+                return
+            try:
+                if self._journal_lines > METADATA_COMPACT_RATIO * max(len(self._entries), 1):
+                    self._compact()
+                else:
+                    with open(self.path, "a") as f:
+                        for fname in self._dirty:
+                            f.write(json.dumps([fname, self._entries.get(fname)]) + "\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._journal_lines += len(self._dirty)
+                self._dirty.clear()
+                logging.debug("Metadata cache saved")
+            except:
+                logging.critical(f"Issue saving metadata cache to {self.path}", exc_info=True)
+
+    def _compact(self):
+        # called with self._lock held (or during __init__)
+        dir_path = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".metadata_")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for fname, entry in self._entries.items():
+                    f.write(json.dumps([fname, entry]) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except:
+            os.remove(tmp_path)
+            raise
+        self._journal_lines = len(self._entries)
+        self._dirty.clear()
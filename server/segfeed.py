@@ -0,0 +1,123 @@
+"""Server-Sent Events feed of newly published segments
+
+Open players subscribe once and get one small message per segment the
+recorder publishes, instead of polling or reloading the whole playlist.
+Every message carries an increasing id and the last few are kept, so a
+browser reconnecting with `Last-Event-ID` is sent what it missed.
+
+Subscribers are generators on a server thread (`client_stream()`) or async
+generators on an event loop (`async_client_stream()`, see asgi.py).
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import threading
+
+SEGFEED_BACKLOG = 256
+SEGFEED_HEARTBEAT_SECONDS = 15  # also how quickly a dead client is noticed
+SEGFEED_RETRY_MS = 5000
+
+
+class SegmentFeed:
+    def __init__(self, backlog: int = SEGFEED_BACKLOG):
+        self._cond = threading.Condition()
+        self._recent: collections.deque[tuple[int, dict]] = collections.deque(maxlen=backlog)
+        self._last_id = 0
+        self._stop = threading.Event()
+        # called after every publish, for subscribers on an event loop
+        self._listeners: set = set()
+
+    def publish(self, record: dict):
+        with self._cond:
+            self._last_id += 1
+            self._recent.append((self._last_id, record))
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+    def _since(self, last_id: int) -> list[tuple[int, dict]]:
+        # called with self._cond held
+        return [(i, r) for i, r in self._recent if i > last_id]
+
+    def _cursor(self, last_event_id: str | None) -> int:
+        with self._cond:
+            try:
+                cursor = int(last_event_id) if last_event_id else self._last_id
+            except ValueError:
+                cursor = self._last_id
+            if cursor > self._last_id:
+                cursor = 0  # ids from before a server restart
+        return cursor
+
+    @staticmethod
+    def _message(event_id: int, record: dict) -> str:
+        return f"id: {event_id}\nevent: segment\ndata: {json.dumps(record)}\n\n"
+
+    def client_stream(self, last_event_id: str | None = None):
+        """Generator of SSE chunks for one client. Without `last_event_id`
+        only segments published from now on are sent
+        """
+        cursor = self._cursor(last_event_id)
+        logging.info("`SegmentFeed`: client subscribed")
+        try:
+            yield f"retry: {SEGFEED_RETRY_MS}\n\n"
+            while not self._stop.is_set():
+                with self._cond:
+                    pending = self._since(cursor)
+                    if not pending:
+                        self._cond.wait(SEGFEED_HEARTBEAT_SECONDS)
+                        pending = self._since(cursor)
+                if not pending:
+                    yield ": heartbeat\n\n"
+                    continue
+                for event_id, record in pending:
+                    yield self._message(event_id, record)
+                    cursor = event_id
+        finally:
+            logging.info("`SegmentFeed`: client unsubscribed")
+
+    async def async_client_stream(self, last_event_id: str | None = None):
+        """`client_stream()` for an event loop, waiting costs no thread"""
+        loop = asyncio.get_running_loop()
+        published = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(published.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+        cursor = self._cursor(last_event_id)
+        with self._cond:
+            self._listeners.add(wake)
+        logging.info("`SegmentFeed`: client subscribed")
+        try:
+            yield f"retry: {SEGFEED_RETRY_MS}\n\n"
+            while not self._stop.is_set():
+                published.clear()
+                with self._cond:
+                    pending = self._since(cursor)
+                if not pending:
+                    try:
+                        await asyncio.wait_for(published.wait(), SEGFEED_HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                    continue
+                for event_id, record in pending:
+                    yield self._message(event_id, record)
+                    cursor = event_id
+        finally:
+            with self._cond:
+                self._listeners.discard(wake)
+            logging.info("`SegmentFeed`: client unsubscribed")
@@ -0,0 +1,241 @@
+"""Serving recorded segments straight from the page cache to the socket
+
+Seeking in the player turns into Range requests at arbitrary offsets of files
+on a slow USB drive, so this path:
+    - keeps a small LRU of open file descriptors (revalidated with a stat), so
+      a burst of seeks in the same file does not reopen it every time
+    - advises the kernel the file is read sequentially (larger readahead) and
+      asks it to start reading the requested range before we need it
+    - hands the range to `os.sendfile`, so the bytes never pass through Python.
+      This needs the raw client socket, which Werkzeug's server exposes; under
+      any other server the range is streamed with `os.pread` instead
+
+The header handling is plain functions of the request headers, so the async
+entry point (asgi.py) serves segments the same way on its event loop.
+"""
+
+import collections
+import logging
+import os
+import select
+import threading
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_etags, parse_if_range_header, parse_range_header, quote_etag
+
+SEGMENT_FD_CACHE_SIZE = 16
+SEGMENT_READAHEAD_BYTES = 4 * 1024 * 1024
+SEGMENT_SENDFILE_CHUNK_BYTES = 1024 * 1024
+SEGMENT_PREAD_CHUNK_BYTES = 256 * 1024
+
+
+class _OpenSegment:
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        self.stat = os.fstat(self.fd)
+        self.refs = 0
+        self.evicted = False
+        try:
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except (AttributeError, OSError):
+            pass  # advisory only
+
+    def matches(self, st: os.stat_result) -> bool:
+        return (st.st_ino, st.st_mtime_ns, st.st_size) == (
+            self.stat.st_ino, self.stat.st_mtime_ns, self.stat.st_size
+        )
+
+
+class FdCache:
+    """LRU of open segments. Entries are refcounted, one evicted while a
+    response is still sending from it is closed when that response finishes
+    """
+
+    def __init__(self, max_open: int = SEGMENT_FD_CACHE_SIZE):
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._open: collections.OrderedDict[str, _OpenSegment] = collections.OrderedDict()
+
+    def acquire(self, path: str) -> _OpenSegment:
+        st = os.stat(path)
+        with self._lock:
+            segment = self._open.get(path)
+            if segment and not segment.matches(st):
+                self._evict(path)  # rewritten or replaced since we opened it
+                segment = None
+            if segment:
+                self._open.move_to_end(path)
+            else:
+                segment = self._open[path] = _OpenSegment(path)
+                while len(self._open) > self.max_open:
+                    self._evict(next(iter(self._open)))
+            segment.refs += 1
+            return segment
+
+    def release(self, segment: _OpenSegment):
+        with self._lock:
+            segment.refs -= 1
+            if segment.evicted and segment.refs == 0:
+                os.close(segment.fd)
+
+    def close(self):
+        with self._lock:
+            for path in list(self._open):
+                self._evict(path)
+
+    def _evict(self, path: str):
+        # called with self._lock held
+        segment = self._open.pop(path)
+        segment.evicted = True
+        if segment.refs == 0:
+            os.close(segment.fd)
+
+
+class _SegmentBody:
+    """WSGI response iterable for one byte range of an open segment"""
+
+    def __init__(self, cache: FdCache, segment: _OpenSegment, offset: int, count: int, environ: dict):
+        self.cache = cache
+        self.segment = segment
+        self.offset = offset
+        self.count = count
+        self.socket = environ.get("werkzeug.socket")
+        self._released = False
+
+    def __iter__(self):
+        if self.socket is None:
+            yield from self._pread()
+            return
+        # an empty chunk makes the server send the status line and headers,
+        # after that the body goes straight onto the socket
+        yield b""
+        self._sendfile()
+
+    def _pread(self):
+        offset, end = self.offset, self.offset + self.count
+        while offset < end:
+            chunk = os.pread(self.segment.fd, min(SEGMENT_PREAD_CHUNK_BYTES, end - offset), offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+    def _sendfile(self):
+        offset, end = self.offset, self.offset + self.count
+        out_fd = self.socket.fileno()
+        try:
+            while offset < end:
+                try:
+                    sent = os.sendfile(out_fd, self.segment.fd, offset, min(SEGMENT_SENDFILE_CHUNK_BYTES, end - offset))
+                except BlockingIOError:
+                    # socket has a timeout set, so is non blocking underneath
+                    if not select.select([], [out_fd], [], self.socket.gettimeout())[1]:
+                        raise TimeoutError("Timed out sending segment")
+                    continue
+                if sent == 0:
+                    return  # file shrank under us
+                offset += sent
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            logging.debug(f"Client went away while sending {self.segment.path}")
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self.cache.release(self.segment)
+
+
+def _readahead(segment: _OpenSegment, offset: int, count: int):
+    # start reading the requested range in the background
+    try:
+        os.posix_fadvise(segment.fd, offset, min(count, SEGMENT_READAHEAD_BYTES), os.POSIX_FADV_WILLNEED)
+    except (AttributeError, OSError):
+        pass
+
+
+class ResponsePlan(NamedTuple):
+    status: int
+    headers: list[tuple[str, str]]
+    start: int  # byte range of the file to send, empty for HEAD / 304 / 416
+    stop: int
+
+
+def plan_response(
+    segment: _OpenSegment,
+    method: str,
+    cache_control: str,
+    mimetype: str,
+    *,
+    if_none_match: str | None = None,
+    if_range: str | None = None,
+    range_header: str | None = None,
+) -> ResponsePlan:
+    """Validators, single byte ranges (multi range requests get the whole
+    file), 304 and 416, from the raw request headers. Shared by the WSGI and
+    ASGI paths
+    """
+    size = segment.stat.st_size
+    etag = f"{segment.stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(int(segment.stat.st_mtime), tz=timezone.utc)
+    headers = [
+        ("ETag", quote_etag(etag)),
+        ("Last-Modified", http_date(last_modified)),
+        ("Accept-Ranges", "bytes"),
+        ("Cache-Control", cache_control),
+    ]
+
+    if parse_etags(if_none_match).contains(etag):
+        return ResponsePlan(304, headers, 0, 0)
+
+    byte_range = None
+    # If-Range: only send the range if the client's copy is still current
+    parsed_if_range = parse_if_range_header(if_range)
+    range_current = (
+        parsed_if_range.etag == etag
+        if parsed_if_range.etag
+        else parsed_if_range.date is None or parsed_if_range.date == last_modified
+    )
+    ranges = parse_range_header(range_header)
+    if ranges and range_current:
+        byte_range = ranges.range_for_length(size)
+        if byte_range is None and len(ranges.ranges) == 1:
+            headers.append(("Content-Range", f"bytes */{size}"))
+            return ResponsePlan(416, headers, 0, 0)
+    start, stop = byte_range or (0, size)
+
+    headers += [("Content-Type", mimetype), ("Content-Length", str(stop - start))]
+    if byte_range:
+        headers.append(("Content-Range", f"bytes {start}-{stop - 1}/{size}"))
+    if method == "HEAD":
+        stop = start
+    elif stop > start:
+        _readahead(segment, start, stop - start)
+    return ResponsePlan(206 if byte_range else 200, headers, start, stop)
+
+
+def serve_segment(cache: FdCache, path: str, mimetype: str, cache_control: str) -> Response:
+    """Full GET/HEAD handling for a file on disk, see `plan_response()`"""
+    segment = cache.acquire(path)
+    body = None  # once created, the body releases the segment when closed
+    try:
+        plan = plan_response(
+            segment,
+            request.method,
+            cache_control,
+            mimetype,
+            if_none_match=request.headers.get("If-None-Match"),
+            if_range=request.headers.get("If-Range"),
+            range_header=request.headers.get("Range"),
+        )
+        if plan.stop > plan.start:
+            body = _SegmentBody(cache, segment, plan.start, plan.stop - plan.start, request.environ)
+        response = Response(body or [], status=plan.status, direct_passthrough=True)
+        # replaces the defaults, e.g. Content-Length stays that of the range for HEAD
+        response.headers.clear()
+        response.headers.extend(plan.headers)
+        return response
+    finally:
+        if body is None:
+            cache.release(segment)
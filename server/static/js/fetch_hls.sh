@@ -0,0 +1,11 @@
+#!/bin/sh
+# Fetches the pinned hls.js build the templates load as js/hls.min.js, so the
+# pages work offline and always get the version they were tested against.
+# Run once on setup (and again after changing HLS_JS_VERSION):
+#     sh server/static/js/fetch_hls.sh
+set -eu
+HLS_JS_VERSION=1.5.20
+cd "$(dirname "$0")"
+curl -fsSL -o hls.min.js.tmp "https://cdn.jsdelivr.net/npm/hls.js@${HLS_JS_VERSION}/dist/hls.min.js"
+mv hls.min.js.tmp hls.min.js
+echo "hls.js ${HLS_JS_VERSION} -> $(pwd)/hls.min.js"
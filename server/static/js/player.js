@@ -1,20 +1,112 @@
 let videoList = [];
+// offsets[i] is the global time at which videoList[i] starts, offsets has one
+// extra trailing entry holding the total duration of all videos
+let offsets = [0];
 let currentGlobalTime = 0;
 let currentVideoIndex = 0;
 let player = document.getElementById("player");
 let timestampDisplay = document.getElementById("timestamp");
 
-async function loadPlaylist() {
-    const response = await fetch("/playlist");
-    videoList = await response.json();
+// double buffering: a hidden second <video> preloads the next video so that
+// `ended` can swap to it instantly instead of fetching + parsing from scratch
+let preloader = player.cloneNode(false);
+preloader.removeAttribute("id");
+preloader.style.display = "none";
+preloader.preload = "auto";
+player.after(preloader);
+let preloadedIndex = -1;
+
+// the playlist is fetched a window at a time, the next window is requested
+// once playback gets within PREFETCH_MARGIN videos of the end of what we have
+const PLAYLIST_WINDOW_SIZE = 100;
+const PREFETCH_MARGIN = 5;
+let nextCursor = null;
+let pendingWindow = null;
+
+function playlistUrl(cursor) {
+    // ?from=&to=&camera= on the page itself narrow down the playlist
+    const params = new URLSearchParams(window.location.search);
+    params.set("limit", PLAYLIST_WINDOW_SIZE);
+    if (cursor) params.set("cursor", cursor);
+    return "/playlist?" + params.toString();
+}
+
+async function fetchWindow(cursor) {
+    const response = await fetch(playlistUrl(cursor));
+    if (!response.ok) {
+        nextCursor = null;  // give up rather than retrying in a loop
+        return [];
+    }
+    nextCursor = response.headers.get("X-Next-Cursor");
+    return await response.json();
+}
+
+// resolves once the next window (if any) has been appended, concurrent callers
+// share the one request
+function fetchNextWindow() {
+    if (!nextCursor) return Promise.resolve();
+    if (!pendingWindow) {
+        pendingWindow = fetchWindow(nextCursor)
+            .then(appendVideos)
+            .finally(() => { pendingWindow = null; });
+    }
+    return pendingWindow;
+}
 
-    if (videoList.length === 0) {
+async function loadPlaylist() {
+    const firstWindow = await fetchWindow(null);
+    if (firstWindow.length === 0) {
         alert("No videos found.");
         return;
     }
 
+    appendVideos(firstWindow);
     loadVideoAtTime(0);
     setInterval(updateTimestamp, 100);  // live update
+    subscribeToNewSegments();
+}
+
+// the server pushes each segment as the recorder publishes it, appended here
+// once every window has been fetched (before that paging will pick it up)
+function subscribeToNewSegments() {
+    const filters = new URLSearchParams(window.location.search);
+    const camera = filters.get("camera");
+    const to = filters.get("to");
+    const source = new EventSource("/segments/stream");
+    source.addEventListener("segment", (event) => {
+        const video = JSON.parse(event.data);
+        if (nextCursor || pendingWindow) return;
+        if (camera && video.camera_name !== camera) return;
+        if (to && new Date(video.start) >= new Date(to)) return;
+        const last = videoList[videoList.length - 1];
+        if (last && video.filename <= last.filename) return;  // already have it
+        const wasAtEnd = player.ended && currentVideoIndex === videoList.length - 1;
+        appendVideos([video]);
+        if (wasAtEnd) loadVideoAtTime(offsets[currentVideoIndex + 1]);  // resume playback
+    });
+}
+
+// extends videoList and its offsets, existing offsets never change
+function appendVideos(videos) {
+    for (const video of videos) {
+        videoList.push(video);
+        offsets.push(offsets[offsets.length - 1] + video.duration_seconds);
+    }
+    if (videos.length) loadActivity();
+}
+
+// index of the video playing at globalTime, i.e. the last i with
+// offsets[i] <= globalTime, or -1 if globalTime is past the end
+function findVideoIndex(globalTime) {
+    if (globalTime < 0 || globalTime >= offsets[videoList.length]) return -1;
+    let lo = 0;
+    let hi = videoList.length - 1;
+    while (lo < hi) {
+        const mid = (lo + hi + 1) >> 1;
+        if (offsets[mid] <= globalTime) lo = mid;
+        else hi = mid - 1;
+    }
+    return lo;
 }
 
 function getSeekStep() {
@@ -23,25 +115,68 @@ function getSeekStep() {
     return isNaN(val) || val <= 0 ? 0.5 : val;
 }
 
+function videoUrl(index) {
+    return `/video/${videoList[index].filename}`;
+}
+
+function preloadVideo(index) {
+    if (index >= videoList.length || index === preloadedIndex) return;
+    preloader.onloadedmetadata = null;
+    preloader.src = videoUrl(index);
+    preloader.dataset.index = index;
+    preloader.load();
+    preloadedIndex = index;
+}
+
+// make the hidden preloader the visible player and vice versa
+function swapToPreloaded() {
+    const previous = player;
+    player = preloader;
+    preloader = previous;
+    player.controls = true;
+    player.style.display = "";
+    preloader.pause();
+    preloader.style.display = "none";
+    currentVideoIndex = preloadedIndex;
+    preloadedIndex = -1;
+}
+
 function loadVideoAtTime(globalTime, preservePause = false) {
-    let accumulated = 0;
-    for (let i = 0; i < videoList.length; i++) {
-        let vid = videoList[i];
-        if (globalTime < accumulated + vid.duration_seconds) {
-            currentVideoIndex = i;
-            let localTime = globalTime - accumulated;
-            player.src = `/video/${vid.filename}`;
-            player.onloadedmetadata = () => {
-                player.currentTime = localTime;
-                if (!preservePause) player.play(); // only autoplay if not preserving pause
-            };
-            currentGlobalTime = globalTime;
-            return;
+    const index = findVideoIndex(globalTime);
+    if (index === -1) {
+        if (nextCursor && globalTime >= 0) {
+            // seeked past the loaded windows, fetch more and try again
+            fetchNextWindow().then(() => loadVideoAtTime(globalTime, preservePause));
+        } else {
+            console.log("Reached end of all videos");
         }
-        accumulated += vid.duration_seconds;
+        return;
     }
+    const localTime = globalTime - offsets[index];
+    currentGlobalTime = globalTime;
 
-    console.log("Reached end of all videos");
+    if (player.dataset.index === String(index)) {
+        // seeking within the video already loaded, no refetch needed
+        player.currentTime = localTime;
+        if (!preservePause) player.play();
+    } else {
+        if (index === preloadedIndex) {
+            swapToPreloaded();
+        } else {
+            currentVideoIndex = index;
+            player.src = videoUrl(index);
+            player.dataset.index = index;
+        }
+        player.onloadedmetadata = null;
+        const start = () => {
+            player.currentTime = localTime;
+            if (!preservePause) player.play(); // only autoplay if not preserving pause
+        };
+        if (player.readyState >= HTMLMediaElement.HAVE_METADATA) start();
+        else player.onloadedmetadata = start;
+    }
+    preloadVideo(index + 1);
+    if (index >= videoList.length - PREFETCH_MARGIN) fetchNextWindow();
 }
 
 function seek(seconds) {
@@ -67,24 +202,156 @@ function updateTimestamp() {
     cameraNameDisplay.textContent = "Camera: " + (vid.camera_name || "Unknown camera");
 
     currentGlobalTime = computeGlobalTime();
+    updateTimelineProgress();
 }
 
 function computeGlobalTime() {
-    let time = 0;
-    for (let i = 0; i < currentVideoIndex; i++) {
-        time += videoList[i].duration_seconds;
-    }
-    return time + player.currentTime;
+    return offsets[currentVideoIndex] + player.currentTime;
 }
 
-player.addEventListener("ended", () => {
+function onEnded(event) {
+    // the hidden element never plays, but guard against stale events anyway
+    if (event.target !== player) return;
     const nextIndex = currentVideoIndex + 1;
     if (nextIndex < videoList.length) {
-        currentVideoIndex = nextIndex;
-        loadVideoAtTime(computeGlobalTime()); // continue playback
+        loadVideoAtTime(offsets[nextIndex]); // continue playback
+    } else if (nextCursor) {
+        fetchNextWindow().then(() => {
+            if (nextIndex < videoList.length) loadVideoAtTime(offsets[nextIndex]);
+        });
     }
+}
+
+// -- scrubbing previews, thumbnails come from per video WebVTT sprite indexes
+
+const timeline = document.getElementById("timeline");
+const timelineProgress = document.getElementById("timelineProgress");
+const thumbnailPreview = document.getElementById("thumbnailPreview");
+const thumbnailCues = new Map();  // filename -> Promise of cues
+
+function parseVttTime(text) {
+    const [h, m, s] = text.split(":");
+    return parseInt(h) * 3600 + parseInt(m) * 60 + parseFloat(s);
+}
+
+function parseThumbnailVtt(text) {
+    const cues = [];
+    for (const block of text.split(/\n\n+/)) {
+        const lines = block.trim().split("\n");
+        if (lines.length < 2 || !lines[0].includes("-->")) continue;
+        const [start, end] = lines[0].split("-->").map(t => parseVttTime(t.trim()));
+        const [image, xywh] = lines[1].split("#xywh=");
+        const [x, y, w, h] = xywh.split(",").map(Number);
+        cues.push({ start, end, image, x, y, w, h });
+    }
+    return cues;
+}
+
+function getThumbnailCues(filename) {
+    if (!thumbnailCues.has(filename)) {
+        const stem = filename.replace(/\.mp4$/, "");
+        thumbnailCues.set(filename, fetch(`/thumbnails/${stem}.vtt`)
+            .then(response => response.ok ? response.text() : "")
+            .then(parseThumbnailVtt)
+            .catch(() => []));
+    }
+    return thumbnailCues.get(filename);
+}
+
+function timelineTimeAt(event) {
+    const rect = timeline.getBoundingClientRect();
+    const fraction = Math.min(Math.max((event.clientX - rect.left) / rect.width, 0), 1);
+    return { globalTime: fraction * offsets[videoList.length], x: event.clientX - rect.left, width: rect.width };
+}
+
+async function showThumbnail(event) {
+    if (videoList.length === 0) return;
+    const { globalTime, x, width } = timelineTimeAt(event);
+    const index = findVideoIndex(Math.min(globalTime, offsets[videoList.length] - 0.001));
+    if (index === -1) return;
+    const localTime = globalTime - offsets[index];
+    const cues = await getThumbnailCues(videoList[index].filename);
+    const cue = cues.find(c => c.start <= localTime && localTime < c.end) || cues[cues.length - 1];
+    if (!cue) {
+        thumbnailPreview.style.display = "none";
+        return;
+    }
+    thumbnailPreview.style.backgroundImage = `url(/thumbnails/${cue.image})`;
+    thumbnailPreview.style.backgroundPosition = `-${cue.x}px -${cue.y}px`;
+    thumbnailPreview.style.left = Math.min(Math.max(x - cue.w / 2, 0), width - cue.w) + "px";
+    thumbnailPreview.style.display = "block";
+}
+
+timeline.addEventListener("mousemove", showThumbnail);
+timeline.addEventListener("mouseleave", () => { thumbnailPreview.style.display = "none"; });
+timeline.addEventListener("click", (event) => {
+    if (videoList.length === 0) return;
+    loadVideoAtTime(timelineTimeAt(event).globalTime, player.paused);
 });
 
+// -- activity heatmap behind the timeline, darker red where there is more motion
+
+const heatmap = document.getElementById("heatmap");
+// bucket sizes the server caches results for (ACTIVITY_CACHED_BUCKET_SECONDS
+// in activity.py), the smallest giving at most one bucket per pixel is used
+const ACTIVITY_BUCKETS = [10, 30, 60, 300, 900, 3600, 6 * 3600, 24 * 3600];
+let activity = null;
+
+function videoStartMs(index) {
+    return new Date(videoList[index].start).getTime();
+}
+
+async function loadActivity() {
+    if (videoList.length === 0) return;
+    const last = videoList.length - 1;
+    const fromMs = videoStartMs(0);
+    const toMs = videoStartMs(last) + videoList[last].duration_seconds * 1000;
+    const span = (toMs - fromMs) / 1000;
+    const bucket = ACTIVITY_BUCKETS.find(b => span / b <= heatmap.width) || ACTIVITY_BUCKETS[ACTIVITY_BUCKETS.length - 1];
+    const params = new URLSearchParams({
+        from: videoList[0].start,
+        to: new Date(toMs - new Date(toMs).getTimezoneOffset() * 60000).toISOString().slice(0, 19),
+        bucket: bucket,
+    });
+    const response = await fetch("/activity?" + params.toString());
+    if (!response.ok) return;
+    activity = await response.json();
+    activity.fromMs = new Date(activity.from).getTime();
+    drawHeatmap();
+}
+
+// the timeline is the loaded videos back to back, so each pixel is mapped to
+// the wall clock time playing there and coloured by that time's bucket
+function drawHeatmap() {
+    const ctx = heatmap.getContext("2d");
+    ctx.clearRect(0, 0, heatmap.width, heatmap.height);
+    const total = offsets[videoList.length];
+    if (!activity || total <= 0) return;
+    const maxMotion = Math.max(1, ...activity.motion.filter(m => m !== null));
+    for (let x = 0; x < heatmap.width; x++) {
+        const globalTime = (x + 0.5) / heatmap.width * total;
+        const index = findVideoIndex(globalTime);
+        if (index === -1) continue;
+        const wallMs = videoStartMs(index) + (globalTime - offsets[index]) * 1000;
+        const b = Math.floor((wallMs - activity.fromMs) / 1000 / activity.bucket);
+        if (b < 0 || b >= activity.motion.length) continue;
+        const motion = activity.motion[b];
+        const level = motion === null ? 0 : motion / maxMotion;
+        ctx.fillStyle = activity.events[b] > 0
+            ? `rgba(200, 0, 0, ${0.4 + 0.6 * level})`
+            : `rgba(0, 100, 200, ${0.15 + 0.5 * level})`;
+        ctx.fillRect(x, 0, 1, heatmap.height);
+    }
+}
+
+function updateTimelineProgress() {
+    const total = offsets[videoList.length];
+    if (total > 0) timelineProgress.style.left = (100 * currentGlobalTime / total) + "%";
+}
+
+player.addEventListener("ended", onEnded);
+preloader.addEventListener("ended", onEnded);
+
 document.addEventListener("keydown", (e) => {
     if (e.key === "ArrowLeft") seek(-getSeekStep());
     if (e.key === "ArrowRight") seek(getSeekStep());
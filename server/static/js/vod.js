@@ -0,0 +1,71 @@
+// Plays a whole time range of recordings as one HLS VOD stream built by the
+// server, the browser (or hls.js) then handles seeking and segment prefetch.
+let player = document.getElementById("player");
+let timestampDisplay = document.getElementById("timestamp");
+let hls = null;
+// wall clock of the fragment currently playing, from EXT-X-PROGRAM-DATE-TIME
+let fragDateMs = null;
+let fragStart = 0;
+
+function buildRangeUrl(baseUrl) {
+    const params = new URLSearchParams();
+    for (const key of ["from", "to", "camera"]) {
+        const value = document.getElementById(key).value;
+        if (value) params.set(key, value);
+    }
+    const query = params.toString();
+    return query ? `${baseUrl}?${query}` : baseUrl;
+}
+
+function buildPlaylistUrl() {
+    return buildRangeUrl(VOD_PLAYLIST_URL);
+}
+
+// the server streams the clip as it cuts it, so the download starts at once
+function exportRange() {
+    if (!document.getElementById("from").value || !document.getElementById("to").value) {
+        alert("Pick both a from and a to time to export.");
+        return;
+    }
+    window.location.href = buildRangeUrl(EXPORT_URL);
+}
+
+function loadRange() {
+    const src = buildPlaylistUrl();
+    fragDateMs = null;
+    if (hls) {
+        hls.destroy();
+        hls = null;
+    }
+    if (window.Hls && Hls.isSupported()) {
+        hls = new Hls();
+        hls.on(Hls.Events.FRAG_CHANGED, (_, data) => {
+            fragDateMs = data.frag.programDateTime;
+            fragStart = data.frag.start;
+        });
+        hls.on(Hls.Events.ERROR, (_, data) => {
+            if (data.fatal) alert("Unable to load recordings for this range.");
+        });
+        hls.loadSource(src);
+        hls.attachMedia(player);
+    } else if (player.canPlayType("application/vnd.apple.mpegurl")) {
+        player.src = src;  // Safari / iOS play HLS natively
+    } else {
+        alert("HLS is not supported in this browser, use the dashboard player instead.");
+    }
+}
+
+function updateTimestamp() {
+    let displayMs = null;
+    if (fragDateMs !== null) {
+        displayMs = fragDateMs + (player.currentTime - fragStart) * 1000;
+    } else if (player.getStartDate && !isNaN(player.getStartDate().getTime())) {
+        displayMs = player.getStartDate().getTime() + player.currentTime * 1000;
+    }
+    if (displayMs !== null) {
+        timestampDisplay.textContent = "Timestamp: " + new Date(displayMs).toLocaleString();
+    }
+}
+
+setInterval(updateTimestamp, 250);
+loadRange();
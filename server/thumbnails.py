@@ -0,0 +1,234 @@
+"""Thumbnail sprite sheets + WebVTT indexes for scrubbing through recordings
+
+For each segment one small JPEG holds a grid of thumbnails, one per keyframe
+roughly every THUMBNAIL_INTERVAL_SECONDS, and a WebVTT file maps time ranges
+of the segment to a tile of it (`sprite.jpg#xywh=x,y,w,h`), the format video
+players use for seek previews. Only keyframes are decoded, so building a
+sprite costs a fraction of decoding the segment.
+
+Sprites are built in the background as the recorder publishes segments, and
+on demand for older ones. They live in a disk cache bounded in bytes, least
+recently used pairs are evicted first.
+"""
+
+import collections
+import logging
+import math
+import os
+import queue
+import re
+import subprocess
+import threading
+from concurrent.futures import Future
+
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_HEIGHT = 120
+THUMBNAIL_COLUMNS = 10
+THUMBNAIL_INTERVAL_SECONDS = 10
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMBNAIL_QUEUE_SIZE = 100
+
+_PTS_TIME_REGEX = re.compile(rb"pts_time:\s*([0-9.]+)")
+
+
+def _vtt_time(seconds: float) -> str:
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}"
+
+
+def build_vtt(sprite_name: str, times: list[float], duration: float) -> str:
+    """Cue i covers [times[i], times[i + 1]) and points at tile i"""
+    lines = ["WEBVTT", ""]
+    for i, start in enumerate(times):
+        end = times[i + 1] if i + 1 < len(times) else max(duration, start + 0.001)
+        row, col = divmod(i, THUMBNAIL_COLUMNS)
+        lines.append(f"{_vtt_time(start)} --> {_vtt_time(end)}")
+        lines.append(
+            f"{sprite_name}#xywh={col * THUMBNAIL_WIDTH},{row * THUMBNAIL_HEIGHT},"
+            f"{THUMBNAIL_WIDTH},{THUMBNAIL_HEIGHT}"
+        )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def build_sprite(fpath: str, sprite_path: str, duration: float) -> list[float]:
+    """Writes the sprite sheet, returns the time of each tile in it"""
+    max_tiles = max(1, math.ceil(duration / THUMBNAIL_INTERVAL_SECONDS) + 1)
+    rows = math.ceil(max_tiles / THUMBNAIL_COLUMNS)
+    select = f"isnan(prev_selected_t)+gte(t-prev_selected_t\\,{THUMBNAIL_INTERVAL_SECONDS})"
+    fit = (
+        f"scale={THUMBNAIL_WIDTH}:{THUMBNAIL_HEIGHT}:force_original_aspect_ratio=decrease,"
+        f"pad={THUMBNAIL_WIDTH}:{THUMBNAIL_HEIGHT}:(ow-iw)/2:(oh-ih)/2"
+    )
+    result = subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "info", "-nostats",
+            "-threads", "1",
+            "-skip_frame", "nokey",  # decode keyframes only
+            "-i", fpath,
+            "-an",
+            "-vf", f"select='{select}',showinfo,{fit},tile={THUMBNAIL_COLUMNS}x{rows}",
+            "-fps_mode", "vfr",
+            "-frames:v", "1",
+            "-q:v", "5",
+            sprite_path,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed building thumbnails for {fpath}: {result.stderr[-500:]!r}")
+    # showinfo logs one line per selected frame, before it is tiled
+    times = [float(t) for t in _PTS_TIME_REGEX.findall(result.stderr)][:max_tiles]
+    if not times:
+        raise RuntimeError(f"No keyframes found in {fpath}")
+    return times
+
+
+class ThumbnailCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        get_path,
+        get_duration,
+        *,
+        max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+        on_built=None,
+    ):
+        """`get_path(filename)` returns where the segment is on disk,
+        `get_duration(filename)` its duration in seconds, or None if it is not
+        (yet) known to be playable.
+        `on_built(filename, sprite_path, tile_times)` is called after each build
+        """
+        self.cache_dir = cache_dir
+        self.get_path = get_path
+        self.get_duration = get_duration
+        self.max_bytes = max_bytes
+        self.on_built = on_built
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # stem -> bytes on disk of the sprite + vtt, least recently used first
+        self._lru: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self._total_bytes = 0
+        self._in_flight: dict[str, Future] = {}
+        self._queue: queue.Queue[str] = queue.Queue(maxsize=THUMBNAIL_QUEUE_SIZE)
+        self._worker = None
+        self._load()
+
+    # -- paths
+
+    def vtt_path(self, filename: str) -> str:
+        return os.path.join(self.cache_dir, os.path.splitext(filename)[0] + ".vtt")
+
+    def sprite_path(self, filename: str) -> str:
+        return os.path.join(self.cache_dir, os.path.splitext(filename)[0] + ".jpg")
+
+    # -- lookups
+
+    def ensure(self, filename: str) -> bool:
+        """Builds the sprite + vtt of `filename` unless already cached, returns
+        whether they are available. Concurrent callers share one build
+        """
+        stem = os.path.splitext(filename)[0]
+        with self._lock:
+            if stem in self._lru:
+                self._lru.move_to_end(stem)
+                touch = True
+            else:
+                touch = False
+                future = self._in_flight.get(stem)
+                owner = future is None
+                if owner:
+                    future = self._in_flight[stem] = Future()
+        if touch:
+            try:
+                os.utime(self.vtt_path(filename))  # recency survives restarts
+            except FileNotFoundError:
+                pass
+            return True
+        if not owner:
+            return future.result()
+
+        ok = False
+        try:
+            ok = self._build(filename)
+        except:
+            logging.warning(f"Building thumbnails for {filename} FAILED", exc_info=True)
+        finally:
+            with self._lock:
+                del self._in_flight[stem]
+            future.set_result(ok)
+        return ok
+
+    def submit(self, filename: str):
+        """Queue a build in the background, e.g. for a freshly published segment"""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="ThumbnailWorker", daemon=True)
+                self._worker.start()
+        try:
+            self._queue.put_nowait(filename)
+        except queue.Full:
+            logging.debug(f"Thumbnail queue full, {filename} will be built on demand")
+
+    # -- building + eviction
+
+    def _build(self, filename: str) -> bool:
+        duration = self.get_duration(filename)
+        if not duration:
+            return False
+        sprite_path = self.sprite_path(filename)
+        times = build_sprite(self.get_path(filename), sprite_path, duration)
+        vtt = build_vtt(os.path.basename(sprite_path), times, duration)
+        tmp_path = self.vtt_path(filename) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(vtt)
+        # the vtt appearing marks the pair complete
+        os.replace(tmp_path, self.vtt_path(filename))
+        if self.on_built:
+            try:
+                self.on_built(filename, sprite_path, times)
+            except:
+                logging.error(f"`on_built` callback FAILED for {filename}", exc_info=True)
+        n_bytes = os.path.getsize(sprite_path) + len(vtt)
+        with self._lock:
+            self._lru[os.path.splitext(filename)[0]] = n_bytes
+            self._total_bytes += n_bytes
+            self._evict()
+        return True
+
+    def _evict(self):
+        # called with self._lock held
+        while self._total_bytes > self.max_bytes and len(self._lru) > 1:
+            stem, n_bytes = self._lru.popitem(last=False)
+            self._total_bytes -= n_bytes
+            for ext in (".vtt", ".jpg"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, stem + ext))
+                except FileNotFoundError:
+                    pass
+
+    def _load(self):
+        pairs = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                stem, ext = os.path.splitext(entry.name)
+                if ext != ".vtt":
+                    continue
+                sprite = os.path.join(self.cache_dir, stem + ".jpg")
+                try:
+                    pairs.append((entry.stat().st_mtime, stem, entry.stat().st_size + os.path.getsize(sprite)))
+                except FileNotFoundError:
+                    os.remove(entry.path)  # sprite evicted or lost, vtt is useless alone
+        for _, stem, n_bytes in sorted(pairs):
+            self._lru[stem] = n_bytes
+            self._total_bytes += n_bytes
+        with self._lock:
+            self._evict()
+        logging.debug(f"Thumbnail cache loaded, {len(self._lru)} segments, {self._total_bytes} bytes")
+
+    def _run(self):
+        while True:
+            filename = self._queue.get()
+            self.ensure(filename)
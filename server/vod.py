@@ -0,0 +1,303 @@
+"""HLS VOD manifests spanning many recorded segments, so the browser can treat
+a whole time range of footage as one seekable stream
+
+Two flavours, picked per manifest:
+    - fMP4: every file is fragmented (the recorder writes these), each
+      moof+mdat pair is served as an HLS byte range straight out of the
+      original file, so there is no server side work beyond the manifest
+    - TS: at least one file is a regular mp4 (e.g. older recordings), every
+      file is then one segment, remuxed to MPEG-TS on the fly with -c copy
+
+Clips for download are cut the same way, the covering files are joined with
+ffmpeg's concat demuxer (-c copy, so cuts land on keyframes) and streamed out
+as fragmented MP4 while ffmpeg is still producing it.
+
+Running this file directly (with mediaindex importable) will test the functions
+within it
+"""
+
+import logging
+import math
+import os
+import subprocess
+import tempfile
+import threading
+import unittest
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import mediaindex
+
+VOD_REMUX_CHUNK_BYTES = 64 * 1024
+# fragmented so the mp4 can be written (and sent) front to back through a pipe
+EXPORT_FRAGMENTED_MP4_ARGS = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+
+
+@dataclass
+class VodEntry:
+    filename: str
+    start: datetime
+    camera_name: str
+    duration: float
+    fragments: mediaindex.FragmentIndex | None = None
+    filepath: str | None = None
+
+
+def parse_time_arg(value: str | None) -> datetime | None:
+    """Accepts ISO style `2025-06-11T15:30:15` or the display format
+    `2025-06-11 15:30:15`, raises ValueError otherwise. Recordings are named in
+    local time, so a value with a UTC offset (`...Z`, `...+02:00`) is
+    converted to local time
+    """
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+# filename -> (path, mtime ns, size, fragment index), one per segment in the
+# media index for as long as it is there (see `forget_fragment_index()`), so
+# a playlist over the whole archive is parsed once, not once per request
+_fragment_indexes: dict[str, tuple[str, int, int, mediaindex.FragmentIndex | None]] = {}
+_fragment_indexes_lock = threading.Lock()
+
+
+def get_fragment_index(fpath: str) -> mediaindex.FragmentIndex | None:
+    """None for regular mp4s, or for files we cannot parse"""
+    filename = os.path.basename(fpath)
+    try:
+        st = os.stat(fpath)
+        with _fragment_indexes_lock:
+            cached = _fragment_indexes.get(filename)
+        # validated on path, mtime and size too, so a moved or rewritten file is never served stale
+        if cached and cached[:3] == (fpath, st.st_mtime_ns, st.st_size):
+            return cached[3]
+        fragments = mediaindex.fragment_index_from_path(fpath)
+        with _fragment_indexes_lock:
+            _fragment_indexes[filename] = (fpath, st.st_mtime_ns, st.st_size, fragments)
+        return fragments
+    except:
+        logging.warning(f"Unable to read fragment index of {fpath}", exc_info=True)
+        return None
+
+
+def forget_fragment_index(filename: str):
+    """Drops the cached fragment index of a segment gone from the media index"""
+    with _fragment_indexes_lock:
+        _fragment_indexes.pop(filename, None)
+
+
+def _program_date_time(dt: datetime) -> str:
+    return dt.astimezone().isoformat(timespec="milliseconds")
+
+
+def _playlist_header(version: int, target_duration: float) -> list[str]:
+    return [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{version}",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        f"#EXT-X-TARGETDURATION:{max(1, math.ceil(target_duration))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+
+
+def build_fmp4_playlist(entries: list[VodEntry], video_url) -> str:
+    """`video_url(filename)` gives the URL the original file is served at,
+    which must support Range requests
+    """
+    target = max((f.duration for e in entries for f in e.fragments.fragments), default=1)
+    lines = _playlist_header(7, target)
+    for i, entry in enumerate(entries):
+        url = video_url(entry.filename)
+        if i > 0:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f'#EXT-X-MAP:URI="{url}",BYTERANGE="{entry.fragments.init_size}@0"')
+        lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{_program_date_time(entry.start)}")
+        for frag in entry.fragments.fragments:
+            lines.append(f"#EXTINF:{frag.duration:.3f},")
+            lines.append(f"#EXT-X-BYTERANGE:{frag.size}@{frag.offset}")
+            lines.append(url)
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def build_ts_playlist(entries: list[VodEntry], segment_url) -> str:
+    """`segment_url(filename)` gives the URL of the on the fly TS remux"""
+    lines = _playlist_header(3, max((e.duration for e in entries), default=1))
+    for i, entry in enumerate(entries):
+        if i > 0:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{_program_date_time(entry.start)}")
+        lines.append(f"#EXTINF:{entry.duration:.3f},")
+        lines.append(segment_url(entry.filename))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def remux_to_ts(fpath: str):
+    """Generator streaming `fpath` remuxed to MPEG-TS, no re-encode"""
+    proc = subprocess.Popen(
+        [
+            "ffmpeg", "-loglevel", "error",
+            "-i", fpath,
+            "-c", "copy",
+            "-f", "mpegts",
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            chunk = proc.stdout.read(VOD_REMUX_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        if proc.returncode not in (0, -9):
+            logging.error(f"`remux_to_ts()`: ffmpeg exited with {proc.returncode} for {fpath}")
+
+
+def concat_list(entries: list[VodEntry], start: datetime | None, end: datetime | None) -> str:
+    """ffmpeg concat demuxer script for `entries` (in time order), trimmed to
+    [start, end] with inpoint/outpoint on the first and last file
+    """
+    lines = ["ffconcat version 1.0"]
+    for i, entry in enumerate(entries):
+        escaped = entry.filepath.replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+        if i == 0 and start and start > entry.start:
+            lines.append(f"inpoint {(start - entry.start).total_seconds():.3f}")
+        if i == len(entries) - 1 and end:
+            outpoint = (end - entry.start).total_seconds()
+            if outpoint < entry.duration:
+                lines.append(f"outpoint {outpoint:.3f}")
+    return "\n".join(lines) + "\n"
+
+
+class ExportError(Exception):
+    """ffmpeg could not be started, or exited before producing any of the
+    clip. The message holds whatever it wrote to stderr
+    """
+
+
+def export_clip(entries: list[VodEntry], start: datetime | None, end: datetime | None):
+    """Starts ffmpeg on the clip as fragmented MP4, no re-encode, and waits for
+    its first chunk so a failure can still become an error response. Returns
+    an iterator streaming the clip from there, None if ffmpeg succeeded
+    without output (nothing left in range after the cuts), raises
+    `ExportError` if it failed. With stream copy ffmpeg can only cut on
+    keyframes, so the clip starts at the last keyframe before `start`
+    """
+    fd, list_path = tempfile.mkstemp(prefix="export_", suffix=".ffconcat")
+    with os.fdopen(fd, "w") as f:
+        f.write(concat_list(entries, start, end))
+    # a file rather than a pipe, nobody reads stderr while the clip streams
+    stderr = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(
+            [
+                "ffmpeg", "-loglevel", "error",
+                "-f", "concat", "-safe", "0",
+                "-i", list_path,
+                "-c", "copy",
+                *EXPORT_FRAGMENTED_MP4_ARGS,
+                "-f", "mp4",
+                "pipe:1",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+    except OSError as e:
+        stderr.close()
+        os.remove(list_path)
+        raise ExportError(f"could not run ffmpeg: {e}") from e
+
+    def read_stderr() -> str:
+        stderr.seek(0)
+        return stderr.read().decode(errors="replace").strip()
+
+    def cleanup(log_failure: bool = True):
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        proc.stdout.close()
+        if log_failure and proc.returncode not in (0, -9):
+            logging.error(f"`export_clip()`: ffmpeg exited with {proc.returncode}: {read_stderr()}")
+        stderr.close()
+        os.remove(list_path)
+
+    try:
+        first = proc.stdout.read(VOD_REMUX_CHUNK_BYTES)
+    except BaseException:
+        cleanup()
+        raise
+    if not first:
+        proc.wait()
+        message = read_stderr()
+        returncode = proc.returncode
+        cleanup(log_failure=False)  # raised instead
+        if returncode != 0:
+            raise ExportError(message or f"ffmpeg exited with {returncode}")
+        return None
+
+    return _ExportStream(proc, first, cleanup)
+
+
+class _ExportStream:
+    """The rest of a started export. An iterator with `close()` rather than a
+    generator, so the WSGI server closing it before the first chunk still
+    stops ffmpeg
+    """
+
+    def __init__(self, proc: subprocess.Popen, first: bytes, cleanup):
+        self._proc = proc
+        self._first = first
+        self._cleanup = cleanup
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if self._cleanup is None:
+            raise StopIteration
+        chunk, self._first = self._first or self._proc.stdout.read(VOD_REMUX_CHUNK_BYTES), b""
+        if not chunk:
+            self.close()
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        cleanup, self._cleanup = self._cleanup, None
+        if cleanup:
+            cleanup()
+
+
+class TestParseTimeArg(unittest.TestCase):
+    def test_naive(self):
+        self.assertEqual(parse_time_arg("2025-06-16T10:07:00"), datetime(2025, 6, 16, 10, 7))
+        self.assertEqual(parse_time_arg("2025-06-16 10:07:00"), datetime(2025, 6, 16, 10, 7))
+        self.assertIsNone(parse_time_arg(""))
+        with self.assertRaises(ValueError):
+            parse_time_arg("yesterday")
+
+    def test_offsets_become_local_time(self):
+        for value, utc in (
+            ("2025-06-16T10:07:00Z", datetime(2025, 6, 16, 10, 7)),
+            ("2025-06-16T10:07:00+02:00", datetime(2025, 6, 16, 8, 7)),
+        ):
+            dt = parse_time_arg(value)
+            self.assertIsNone(dt.tzinfo)
+            self.assertEqual(dt, utc.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None))
+            # comparable with the naive filename timestamps
+            self.assertTrue(dt + timedelta(minutes=5) > datetime(2000, 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1 +1,7 @@
-from .utils import generate_filename, parse_filename, dt_strfmt
\ No newline at end of file
+from .utils import generate_filename, parse_filename, parse_filenames, ParsedFilenames, dt_strfmt
+from .segindex import SegmentIndex, Segment, write_segment_index, segments_from_filenames, dt_to_epoch, epoch_to_dt
+from .layout import (
+    LAYOUT_FLAT, LAYOUT_PARTITIONED, LAYOUTS, read_layout, write_layout, partition_dir, relative_dir,
+    LAYOUT_MARKER_FNAME, segment_path, list_cameras, partition_dirs, walk_partitions, iter_segments,
+    prune_empty_dirs,
+)
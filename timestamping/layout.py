@@ -0,0 +1,265 @@
+"""Where segments live under the videos directory
+
+Running this file directly will test the functions within it
+
+Two layouts, same filenames in both:
+
+    flat         <root>/<filename>
+    partitioned  <root>/<camera>/YYYY/MM/DD/HH/<filename>
+
+Everything in one flat directory gets slow on FAT/exFAT USB drives once it
+holds tens of thousands of entries (lookups, listing and creating files are
+all linear in the directory size there), partitioned keeps every directory
+down to an hour of one camera. The directory of a segment follows from its
+filename (timestamp + camera), so a segment is still identified by filename
+alone and nothing needs a lookup table to find it.
+
+Which layout an archive uses is recorded in a marker file at its root, absent
+means flat. diskmanage/migrate_layout.py moves an existing archive over and
+writes the marker. Loose files at the root of a partitioned archive (e.g. left
+there by a migration that is still running) are still found by
+`iter_segments`, so readers never have to care.
+"""
+
+import heapq
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+from .utils import generate_filename, parse_filename
+
+LAYOUT_FLAT = "flat"
+LAYOUT_PARTITIONED = "partitioned"
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_PARTITIONED)
+LAYOUT_MARKER_FNAME = "_layout"
+
+# width of each partition level below the camera: year, month, day, hour
+_PARTITION_WIDTHS = (4, 2, 2, 2)
+
+
+def read_layout(root: str) -> str:
+    try:
+        with open(os.path.join(root, LAYOUT_MARKER_FNAME)) as f:
+            layout = f.read().strip()
+    except FileNotFoundError:
+        return LAYOUT_FLAT
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r} in {os.path.join(root, LAYOUT_MARKER_FNAME)}")
+    return layout
+
+
+def write_layout(root: str, layout: str):
+    if layout not in LAYOUTS:
+        raise ValueError(f"`layout` must be one of {LAYOUTS}")
+    marker_path = os.path.join(root, LAYOUT_MARKER_FNAME)
+    tmp_path = marker_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(layout + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, marker_path)
+
+
+def partition_dir(*, camera_name: str, for_time: datetime) -> str:
+    """Directory of the hour `for_time` falls in, relative to the root"""
+    return os.path.join(
+        camera_name, f"{for_time.year:04d}", f"{for_time.month:02d}", f"{for_time.day:02d}", f"{for_time.hour:02d}"
+    )
+
+
+def relative_dir(fname: str, layout: str, extension=".mp4") -> str | None:
+    """Directory of a segment relative to the root ("" when flat), None if the
+    layout needs a timestamp and `fname` has none
+    """
+    if layout == LAYOUT_FLAT:
+        return ""
+    dt, camera_name = parse_filename(fname, extension)
+    if dt is None:
+        return None
+    return partition_dir(camera_name=camera_name, for_time=dt)
+
+
+def segment_path(root: str, fname: str, layout: str, extension=".mp4") -> str | None:
+    """Where `fname` belongs under `root`, None if it has no place in `layout`"""
+    reldir = relative_dir(fname, layout, extension)
+    return None if reldir is None else os.path.join(root, reldir, fname)
+
+
+def list_cameras(root: str) -> list[str]:
+    """Camera directories at the root of a partitioned archive"""
+    try:
+        with os.scandir(root) as it:
+            return sorted(
+                e.name for e in it if e.is_dir(follow_symlinks=False) and not e.name.startswith(("_", "."))
+            )
+    except FileNotFoundError:
+        return []
+
+
+def _sorted_subdirs(path: str, width: int) -> list[str]:
+    try:
+        with os.scandir(path) as it:
+            return sorted(
+                e.name for e in it
+                if len(e.name) == width and e.name.isdigit() and e.is_dir(follow_symlinks=False)
+            )
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _descend(root: str, reldir: str, parts: tuple[int, ...]) -> Iterator[tuple[datetime, str]]:
+    # depth first, so the oldest hours come out without listing the newer ones
+    if len(parts) == len(_PARTITION_WIDTHS):
+        try:
+            yield datetime(*parts), reldir
+        except ValueError:
+            pass  # e.g. a month 13 directory
+        return
+    for name in _sorted_subdirs(os.path.join(root, reldir), _PARTITION_WIDTHS[len(parts)]):
+        yield from _descend(root, os.path.join(reldir, name), parts + (int(name),))
+
+
+def walk_partitions(root: str, camera_names: Iterable[str] | None = None) -> Iterator[tuple[datetime, str]]:
+    """(hour, relative dir) of every hour directory, oldest first across all
+    cameras. Lazy: directories are only listed as the walk reaches them
+    """
+    cameras = list_cameras(root) if camera_names is None else camera_names
+    return heapq.merge(*(_descend(root, camera_name, ()) for camera_name in cameras))
+
+
+def partition_dirs(
+    root: str,
+    start: datetime,
+    end: datetime,
+    *,
+    camera_names: Iterable[str] | None = None,
+    existing_only: bool = True,
+) -> list[str]:
+    """Relative hour directories that may hold segments starting in
+    [start, end), oldest first. One stat per hour per camera, so meant for
+    ranges of hours to days, `walk_partitions` for everything
+    """
+    cameras = list_cameras(root) if camera_names is None else list(camera_names)
+    dirs = []
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        for camera_name in cameras:
+            reldir = partition_dir(camera_name=camera_name, for_time=hour)
+            if not existing_only or os.path.isdir(os.path.join(root, reldir)):
+                dirs.append(reldir)
+        hour += timedelta(hours=1)
+    return dirs
+
+
+def _sorted_files(root: str, reldir: str, extension: str) -> list[tuple[str, str]]:
+    try:
+        with os.scandir(os.path.join(root, reldir)) as it:
+            return sorted((e.name, reldir) for e in it if e.name.endswith(extension) and e.is_file())
+    except FileNotFoundError:
+        return []
+
+
+def iter_segments(root: str, layout: str | None = None, extension=".mp4") -> Iterator[tuple[str, str]]:
+    """(relative dir, filename) of every segment, in filename (so time) order.
+    Partitioned archives are walked lazily, an hour directory at a time, and
+    loose files at the root are included
+    """
+    layout = read_layout(root) if layout is None else layout
+    streams = [_sorted_files(root, "", extension)]
+    if layout == LAYOUT_PARTITIONED:
+        # each camera's hours are in order, but an hour of one camera can
+        # interleave with the same hour of another, so merge file by file
+        streams += [
+            (file for _, reldir in _descend(root, camera_name, ()) for file in _sorted_files(root, reldir, extension))
+            for camera_name in list_cameras(root)
+        ]
+    for fname, reldir in heapq.merge(*streams):
+        yield reldir, fname
+
+
+def prune_empty_dirs(root: str, reldir: str):
+    """Removes the hour directory `reldir` and then its parents, up to and
+    including the camera directory, for as long as they are empty
+    """
+    while reldir:
+        try:
+            os.rmdir(os.path.join(root, reldir))
+        except OSError:
+            return  # not empty (or already gone)
+        reldir = os.path.dirname(reldir)
+
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _touch(self, fname: str, layout: str) -> str:
+        path = segment_path(self.root, fname, layout)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+        return path
+
+    def test_marker_round_trip(self):
+        self.assertEqual(read_layout(self.root), LAYOUT_FLAT)
+        write_layout(self.root, LAYOUT_PARTITIONED)
+        self.assertEqual(read_layout(self.root), LAYOUT_PARTITIONED)
+        with self.assertRaises(ValueError):
+            write_layout(self.root, "nested")
+
+    def test_segment_path(self):
+        fname = generate_filename(for_time=datetime(2025, 6, 16, 9, 5, 0), camera_name="garage_cam")
+        self.assertEqual(segment_path("/v", fname, LAYOUT_FLAT), os.path.join("/v", fname))
+        self.assertEqual(
+            segment_path("/v", fname, LAYOUT_PARTITIONED),
+            os.path.join("/v", "garage_cam", "2025", "06", "16", "09", fname),
+        )
+        self.assertIsNone(segment_path("/v", "notes.txt", LAYOUT_PARTITIONED))
+
+    def test_partition_dirs(self):
+        for hour in (22, 23):
+            self._touch(generate_filename(for_time=datetime(2025, 12, 31, hour), camera_name="cam"), LAYOUT_PARTITIONED)
+        self._touch(generate_filename(for_time=datetime(2026, 1, 1, 0, 30), camera_name="cam"), LAYOUT_PARTITIONED)
+        dirs = partition_dirs(self.root, datetime(2025, 12, 31, 22, 59), datetime(2026, 1, 1, 0, 1))
+        self.assertEqual(dirs, [
+            os.path.join("cam", "2025", "12", "31", "22"),
+            os.path.join("cam", "2025", "12", "31", "23"),
+            os.path.join("cam", "2026", "01", "01", "00"),
+        ])
+        self.assertEqual(len(partition_dirs(self.root, datetime(2025, 12, 31, 21), datetime(2025, 12, 31, 23))), 1)
+        self.assertEqual(
+            len(partition_dirs(self.root, datetime(2025, 1, 1), datetime(2025, 1, 2), camera_names=["cam"], existing_only=False)),
+            24,
+        )
+
+    def test_iter_segments_in_time_order(self):
+        fnames = [
+            generate_filename(for_time=datetime(2025, 6, 16, h, m), camera_name=camera_name)
+            for h in (9, 10, 23) for m in (0, 55) for camera_name in ("a_cam", "b_cam")
+        ]
+        for fname in fnames[1:]:
+            self._touch(fname, LAYOUT_PARTITIONED)
+        self._touch(fnames[0], LAYOUT_FLAT)  # loose, e.g. mid migration
+        os.makedirs(os.path.join(self.root, "a_cam", "2025", "13", "01", "00"))  # ignored
+        got = list(iter_segments(self.root, LAYOUT_PARTITIONED))
+        self.assertEqual([fname for _, fname in got], sorted(fnames))
+        self.assertEqual(got[0][0], "")
+        self.assertEqual(got[1][0], os.path.join("b_cam", "2025", "06", "16", "09"))
+        self.assertEqual([fname for _, fname in iter_segments(self.root, LAYOUT_FLAT)], fnames[:1])
+
+    def test_prune_empty_dirs(self):
+        path = self._touch(generate_filename(for_time=datetime(2025, 6, 16, 9), camera_name="cam"), LAYOUT_PARTITIONED)
+        other = self._touch(generate_filename(for_time=datetime(2025, 6, 17, 9), camera_name="cam"), LAYOUT_PARTITIONED)
+        os.remove(path)
+        prune_empty_dirs(self.root, os.path.relpath(os.path.dirname(path), self.root))
+        self.assertFalse(os.path.exists(os.path.join(self.root, "cam", "2025", "06", "16")))
+        self.assertTrue(os.path.exists(other))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,293 @@
+"""Compact on-disk segment index, memory mapped so opening it is ~free
+
+Running this file directly will test the functions within it
+
+One fixed-width column per field, so a column can be bisected or handed to
+numpy as-is without unpacking anything:
+
+    header      32 bytes, see _HEADER
+    cameras     camera names, "\\n" joined utf-8, padded to 8 bytes
+    starts      int64   wall clock epoch seconds of the filename timestamp
+    sizes       int64   bytes
+    durations   float32 seconds
+    camera_ids  uint16  index into the camera names
+    flags       uint16  FLAG_* bits
+
+Records are sorted by start. "Wall clock epoch" means the local timestamp in
+the filename counted as if it were UTC (`calendar.timegm`), so it round trips
+exactly with the filename regardless of timezone or DST.
+"""
+
+import bisect
+import calendar
+import mmap
+import os
+import struct
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple
+
+from .layout import iter_segments
+from .utils import generate_filename, parse_filename, parse_filenames
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for `SegmentIndex.columns()`
+    np = None
+
+_EPOCH = datetime(1970, 1, 1)
+_MAGIC = b"PISX"
+_VERSION = 1
+# magic, version, n_cameras, n_records, max_duration, camera table bytes
+_HEADER = struct.Struct("<4sHHQdI4x")
+
+FLAG_DURATION_ESTIMATED = 0x1  # duration not probed, e.g. built from filenames only
+FLAG_FRAGMENTED = 0x2
+FLAG_HAS_EVENT = 0x4
+
+
+class Segment(NamedTuple):
+    start_epoch: int
+    duration: float
+    size: int
+    camera_name: str
+    flags: int = 0
+
+
+def dt_to_epoch(dt: datetime) -> int:
+    return calendar.timegm(dt.timetuple())
+
+
+def epoch_to_dt(epoch: int) -> datetime:
+    return _EPOCH + timedelta(seconds=int(epoch))
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _column_offsets(n_records: int, camera_table_bytes: int) -> dict[str, int]:
+    offset = _HEADER.size + _pad8(camera_table_bytes)
+    offsets = {}
+    for name, width in (("starts", 8), ("sizes", 8), ("durations", 4), ("camera_ids", 2), ("flags", 2)):
+        offsets[name] = offset
+        offset += width * n_records
+    offsets["end"] = offset
+    return offsets
+
+
+def write_segment_index(path: str, segments: Iterable[Segment]) -> int:
+    """Atomically (temp file + rename) write an index, returns record count"""
+    segments = sorted(segments, key=lambda s: (s.start_epoch, s.camera_name))
+    cameras = sorted({s.camera_name for s in segments})
+    if len(cameras) > 0xFFFF:
+        raise ValueError("Too many cameras for a uint16 camera id")
+    camera_ids = {name: i for i, name in enumerate(cameras)}
+    camera_table = "\n".join(cameras).encode("utf-8")
+    max_duration = max((s.duration for s in segments), default=0.0)
+
+    n = len(segments)
+    offsets = _column_offsets(n, len(camera_table))
+    buf = bytearray(offsets["end"])
+    _HEADER.pack_into(buf, 0, _MAGIC, _VERSION, len(cameras), n, max_duration, len(camera_table))
+    buf[_HEADER.size : _HEADER.size + len(camera_table)] = camera_table
+    struct.pack_into(f"<{n}q", buf, offsets["starts"], *(s.start_epoch for s in segments))
+    struct.pack_into(f"<{n}q", buf, offsets["sizes"], *(s.size for s in segments))
+    struct.pack_into(f"<{n}f", buf, offsets["durations"], *(s.duration for s in segments))
+    struct.pack_into(f"<{n}H", buf, offsets["camera_ids"], *(camera_ids[s.camera_name] for s in segments))
+    struct.pack_into(f"<{n}H", buf, offsets["flags"], *(s.flags for s in segments))
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".segindex_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+    return n
+
+
+def segments_from_filenames(
+    dir_path: str,
+    *,
+    extension: str = ".mp4",
+    durations: dict[str, float] | None = None,
+    default_duration: float = 0.0,
+) -> list[Segment]:
+    """Segments for every parseable filename in `dir_path` (in either layout),
+    durations come from `durations` (filename -> seconds) where known,
+    otherwise `default_duration` flagged as estimated
+    """
+    durations = durations or {}
+    segments = []
+    found = list(iter_segments(dir_path, extension=extension))
+    parsed = parse_filenames((fname for _, fname in found), extension)
+    for (reldir, fname), start, camera_id in zip(found, parsed.epochs, parsed.camera_ids):
+        if camera_id < 0:
+            continue
+        flags = 0
+        duration = durations.get(fname)
+        if duration is None:
+            duration = default_duration
+            flags |= FLAG_DURATION_ESTIMATED
+        size = os.stat(os.path.join(dir_path, reldir, fname)).st_size
+        segments.append(Segment(start, duration, size, parsed.cameras[camera_id], flags))
+    return segments
+
+
+class SegmentIndex:
+    """Read only view of an index file. Every column is a zero copy memoryview
+    straight onto the mapped file
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), size, prot=mmap.PROT_READ) if size else None
+        if self._mm is None or size < _HEADER.size:
+            raise ValueError(f"{path} is not a segment index")
+        magic, version, n_cameras, n, max_duration, camera_table_bytes = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} segment index")
+        self.n_records = n
+        self.max_duration = max_duration
+        table = self._mm[_HEADER.size : _HEADER.size + camera_table_bytes].decode("utf-8")
+        self.cameras = table.split("\n") if n_cameras else []
+        self._camera_ids = {name: i for i, name in enumerate(self.cameras)}
+
+        offsets = _column_offsets(n, camera_table_bytes)
+        if offsets["end"] > size:
+            raise ValueError(f"{path} is truncated")
+        view = memoryview(self._mm)
+        self.starts = view[offsets["starts"] : offsets["sizes"]].cast("q")
+        self.sizes = view[offsets["sizes"] : offsets["durations"]].cast("q")
+        self.durations = view[offsets["durations"] : offsets["camera_ids"]].cast("f")
+        self.camera_ids = view[offsets["camera_ids"] : offsets["flags"]].cast("H")
+        self.flags = view[offsets["flags"] : offsets["end"]].cast("H")
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def __getitem__(self, i: int) -> Segment:
+        return Segment(
+            self.starts[i], self.durations[i], self.sizes[i], self.cameras[self.camera_ids[i]], self.flags[i]
+        )
+
+    def camera_id(self, camera_name: str) -> int | None:
+        return self._camera_ids.get(camera_name)
+
+    def filename(self, i: int, extension: str = ".mp4") -> str:
+        return generate_filename(
+            for_time=epoch_to_dt(self.starts[i]),
+            camera_name=self.cameras[self.camera_ids[i]],
+            extension=extension,
+        )
+
+    def overlapping(self, start_epoch: float, end_epoch: float) -> range:
+        """Indices of segments overlapping [start_epoch, end_epoch), found with
+        two bisections; no segment is longer than the stored max duration, so
+        only that much look-behind ever needs checking
+        """
+        lo = bisect.bisect_left(self.starts, start_epoch - self.max_duration)
+        hi = bisect.bisect_left(self.starts, end_epoch)
+        while lo < hi and self.starts[lo] + self.durations[lo] <= start_epoch:
+            lo += 1
+        return range(lo, hi)
+
+    def columns(self) -> dict:
+        """numpy arrays over the mapped columns (no copy), for vectorised
+        aggregate queries
+        """
+        if np is None:
+            raise ImportError("numpy is required for `SegmentIndex.columns()`")
+        return {
+            "starts": np.frombuffer(self.starts, dtype=np.int64),
+            "sizes": np.frombuffer(self.sizes, dtype=np.int64),
+            "durations": np.frombuffer(self.durations, dtype=np.float32),
+            "camera_ids": np.frombuffer(self.camera_ids, dtype=np.uint16),
+            "flags": np.frombuffer(self.flags, dtype=np.uint16),
+        }
+
+    def close(self):
+        for name in ("starts", "sizes", "durations", "camera_ids", "flags"):
+            getattr(self, name).release()
+        self._mm.close()
+
+
+class TestSegmentIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "segments.idx")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _five_minute_segments(self, n: int, camera_name: str = "cam") -> list[Segment]:
+        t0 = dt_to_epoch(datetime(2025, 6, 16, 10, 0, 0))
+        return [Segment(t0 + 300 * i, 300.0, 1000 + i, camera_name) for i in range(n)]
+
+    def test_round_trip(self):
+        segments = self._five_minute_segments(10) + self._five_minute_segments(3, "other_cam")
+        self.assertEqual(write_segment_index(self.path, segments), 13)
+        index = SegmentIndex(self.path)
+        self.assertEqual(len(index), 13)
+        self.assertEqual(sorted(index[i] for i in range(len(index))), sorted(segments))
+        self.assertEqual(index.cameras, ["cam", "other_cam"])
+        index.close()
+
+    def test_filename_round_trip(self):
+        write_segment_index(self.path, self._five_minute_segments(2, "my_camera"))
+        index = SegmentIndex(self.path)
+        self.assertEqual(index.filename(1), "20250616_100500_my_camera.mp4")
+        dt, camera_name = parse_filename(index.filename(1))
+        self.assertEqual(dt_to_epoch(dt), index.starts[1])
+        index.close()
+
+    def test_overlapping(self):
+        write_segment_index(self.path, self._five_minute_segments(12))
+        index = SegmentIndex(self.path)
+        t0 = index.starts[0]
+        self.assertEqual(list(index.overlapping(t0 + 310, t0 + 900)), [1, 2])
+        self.assertEqual(list(index.overlapping(t0 + 300, t0 + 301)), [1])
+        self.assertEqual(list(index.overlapping(t0 - 1000, t0)), [])
+        self.assertEqual(list(index.overlapping(t0 + 10_000, t0 + 20_000)), [])
+        index.close()
+
+    def test_empty_index(self):
+        write_segment_index(self.path, [])
+        index = SegmentIndex(self.path)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(list(index.overlapping(0, 10**10)), [])
+        index.close()
+
+    def test_from_filenames(self):
+        for name in ["20250616_103045_cam.mp4", "20250616_103545_cam.mp4", "notes.txt"]:
+            with open(os.path.join(self.tmpdir.name, name), "wb") as f:
+                f.write(b"x" * 7)
+        segments = segments_from_filenames(self.tmpdir.name, durations={"20250616_103045_cam.mp4": 299.5})
+        write_segment_index(self.path, segments)
+        index = SegmentIndex(self.path)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index[0].duration, 299.5)
+        self.assertEqual(index[0].flags, 0)
+        self.assertEqual(index[1].flags, FLAG_DURATION_ESTIMATED)
+        self.assertEqual(index[1].size, 7)
+        index.close()
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test_numpy_columns(self):
+        write_segment_index(self.path, self._five_minute_segments(5))
+        index = SegmentIndex(self.path)
+        cols = index.columns()
+        self.assertEqual(int(cols["sizes"].sum()), sum(1000 + i for i in range(5)))
+        self.assertEqual(float(cols["durations"].sum()), 1500.0)
+        del cols
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,9 +3,12 @@ Despite some of the naming in this file, we actually use this module for
 generating log file names as well as camera names!
 """
 
+from array import array
+import calendar
 from datetime import datetime
+import functools
 import re
-from typing import Callable, Literal, Tuple
+from typing import Callable, Iterable, Literal, NamedTuple, Tuple
 import unittest
 
 TIMESTAMP_FMT = r"%Y%m%d_%H%M%S"
@@ -38,6 +41,10 @@ def generate_filename(
         timestamp = generate_now_timestamp()
     return f"{timestamp}_{camera_name}{extension}"
 
+@functools.lru_cache(maxsize=32)
+def _filename_pattern(extension: str) -> re.Pattern:
+    return re.compile(TIMESTAMP_REGEX_FMT + rf"_(.+){re.escape(extension)}")
+
 def parse_filename(fname: str, extension=".mp4") -> Tuple[datetime, str] | Tuple[None, None]:
     """Returns tuple containing:
          - timestamp as datetime object
@@ -50,14 +57,76 @@ def parse_filename(fname: str, extension=".mp4") -> Tuple[datetime, str] | Tuple
         extension = extension
     try:
         assert fname.endswith(extension)
-        regex_obj = re.fullmatch(TIMESTAMP_REGEX_FMT + rf"_(.+){re.escape(extension)}", fname)
+        regex_obj = _filename_pattern(extension).fullmatch(fname)
         assert regex_obj, f"ERROR: {fname} is unable to be timestamp parsed!"
         timestamp_str, camera_name = regex_obj.groups()
+        # `\d` and `strptime` both take any unicode decimal digit, only ascii is ours
+        assert timestamp_str.isascii()
         dt = datetime.strptime(timestamp_str, TIMESTAMP_FMT)
         return dt, camera_name
     except:
         return None, None
 
+class ParsedFilenames(NamedTuple):
+    """Column per field, row i is the i-th name passed to `parse_filenames`"""
+    epochs: array      # "q", wall clock epoch seconds (see segindex.dt_to_epoch), 0 if unparseable
+    camera_ids: array  # "i", index into `cameras`, -1 if unparseable
+    cameras: list[str]
+
+# ascii digits only, as in `parse_filename`: `\d` in `TIMESTAMP_REGEX_FMT` and `strptime`
+# would both take any unicode decimal digit
+_TIMESTAMP_PREFIX = re.compile(r"[0-9]{8}_[0-9]{6}_")
+
+def _day_epoch(day: str) -> int | None:
+    """Wall clock epoch of midnight on "YYYYMMDD", None if no such day"""
+    year, month, day_of_month = int(day[:4]), int(day[4:6]), int(day[6:8])
+    if year < 1 or not 1 <= month <= 12 or not 1 <= day_of_month <= calendar.monthrange(year, month)[1]:
+        return None
+    return calendar.timegm((year, month, day_of_month, 0, 0, 0))
+
+def parse_filenames(fnames: Iterable[str], extension=".mp4") -> ParsedFilenames:
+    """`parse_filename` for many names at once, with the same results: row i
+    parses to (epoch_to_dt(epochs[i]), cameras[camera_ids[i]]), or to
+    (None, None) where camera_ids[i] is -1. The timestamp is a fixed width
+    prefix, so it is checked with a match anchored at the start (no
+    backtracking) and sliced into integers rather than going through
+    `strptime`, and each day's validity + epoch is worked out once per call
+    """
+    extension = _add_dot_to_extension(extension)
+    camera_start, camera_end = len("YYYYMMDD_HHMMSS_"), -len(extension)
+    epochs, camera_ids = array("q"), array("i")
+    cameras: list[str] = []
+    camera_index: dict[str, int] = {}
+    day_epochs: dict[str, int | None] = {}
+    # bound once, this loop runs for every file on the drive
+    prefix_match, append_epoch, append_camera_id = _TIMESTAMP_PREFIX.match, epochs.append, camera_ids.append
+    for fname in fnames:
+        epoch = None
+        camera_name = fname[camera_start:camera_end]
+        # same as `_filename_pattern`: the camera name is `.+`, so non empty without newlines
+        if camera_name and fname.endswith(extension) and prefix_match(fname) and "\n" not in camera_name:
+            day = fname[:8]
+            if day in day_epochs:
+                day_epoch = day_epochs[day]
+            else:
+                day_epoch = day_epochs[day] = _day_epoch(day)
+            if day_epoch is not None:
+                hhmmss = int(fname[9:15])
+                hour, minute, second = hhmmss // 10000, hhmmss // 100 % 100, hhmmss % 100
+                if hour < 24 and minute < 60 and second < 60:
+                    epoch = day_epoch + 3600 * hour + 60 * minute + second
+        if epoch is None:
+            append_epoch(0)
+            append_camera_id(-1)
+            continue
+        camera_id = camera_index.get(camera_name)
+        if camera_id is None:
+            camera_id = camera_index[camera_name] = len(cameras)
+            cameras.append(camera_name)
+        append_epoch(epoch)
+        append_camera_id(camera_id)
+    return ParsedFilenames(epochs, camera_ids, cameras)
+
 def dt_strfmt(dt: datetime):
     return dt.strftime(DISPLAY_STR_FMT)
 
@@ -168,6 +237,48 @@ class TestUtils(unittest.TestCase):
         dt, cam_name = parsed
         self.assertEqual(cam_name, long_name)
 
+    def test_parse_filenames_matches_parse_filename(self):
+        """Bulk parsing agrees with `parse_filename` name by name, including
+        the names it rejects
+        """
+        fnames = [
+            "20250616_103045_camera1.mp4",
+            "20250616_103046_camera2.mp4",
+            "20250616_103045_my_camera_name.mp4",
+            "20240229_235959_camera1.mp4",  # leap day
+            "20250229_000000_camera1.mp4",  # not a leap year
+            "20250631_000000_camera1.mp4",
+            "20251301_000000_camera1.mp4",
+            "20250001_000000_camera1.mp4",
+            "20250100_000000_camera1.mp4",
+            "00000101_000000_camera1.mp4",
+            "00010101_000000_camera1.mp4",
+            "99991231_235959_camera1.mp4",
+            "20250616_240000_camera1.mp4",
+            "20250616_236000_camera1.mp4",
+            "20250616_235960_camera1.mp4",
+            "20250616_103045_camera1.MP4",
+            "20250616_103045_.mp4",
+            "20250616_103045_cam\nera.mp4",
+            "\uff12\uff10\uff12\uff15\uff10\uff16\uff11\uff16_103045_camera1.mp4",  # full width digits
+            "\u0662\u0660\u0662\u06650616_100000_cam.mp4",  # arabic-indic digits, mixed with ascii
+            "20250616103045_camera1.mp4",
+            "badname.mp4",
+            "",
+        ]
+        for extension in (".mp4", "mp4", ".log"):
+            parsed = parse_filenames(fnames, extension)
+            self.assertEqual(len(parsed.epochs), len(fnames))
+            for i, fname in enumerate(fnames):
+                dt, camera_name = parse_filename(fname, extension)
+                if dt is None:
+                    self.assertEqual(parsed.camera_ids[i], -1, fname)
+                else:
+                    self.assertEqual(parsed.epochs[i], calendar.timegm(dt.timetuple()), fname)
+                    self.assertEqual(parsed.cameras[parsed.camera_ids[i]], camera_name, fname)
+        parsed = parse_filenames(fnames)
+        self.assertEqual(parsed.cameras, ["camera1", "camera2", "my_camera_name"])
+
 
 if __name__ == "__main__":
     unittest.main()